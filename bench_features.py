@@ -0,0 +1,181 @@
+"""
+Benchmarks of the feature kernels on the synthetic markets of synthetic_market,
+so they run anywhere, without the libraries of project_setup.
+
+Each kernel is timed per day, per instrument-year and per full backfill
+(all the instruments over backfill_years), and its throughput and peak
+memory (traced by tracemalloc on one unit of each scope) are reported.
+Results are compared with the baselines saved by a previous run with
+--save, and the script exits with 1 if any of them regresses by more than
+--tolerance.
+
+python bench_features.py --kernels vec vec-jit batch batch-jit --scopes day instrument-year
+python bench_features.py --save
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+from project_config import sub_win_width, tot_bar_num
+from synthetic_market import synthetic_instruments, gen_synthetic_market
+from xfuns import cal_features_and_return_one_day
+from features_vec import cal_features_and_return_one_day_vec, cal_features_and_return_batch, vec_bar_cols
+from features_stream import CStreamingFeatures
+
+days_per_year = 243
+default_baselines_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baselines.json")
+
+
+# --- kernel variants, each one calculates features and return for all the blocks of one instrument
+def _per_day(fun, **kwargs):
+    def run(blocks: list, instrument: str, contract_multiplier: int):
+        for _, contract, pre_settle, pre_spot_close, m01_df in blocks:
+            fun(m01=m01_df, instrument=instrument, contract=contract, contract_multiplier=contract_multiplier,
+                pre_settle=pre_settle, pre_spot_close=pre_spot_close,
+                sub_win_width=sub_win_width, tot_bar_num=tot_bar_num, **kwargs)
+
+    return run
+
+
+def _batch(backend: str):
+    def run(blocks: list, instrument: str, contract_multiplier: int):
+        _, contracts, pre_settles, pre_spot_closes, m01_dfs = zip(*blocks)
+        cal_features_and_return_batch(
+            m01_tensor=np.stack([_[vec_bar_cols].to_numpy(dtype=np.float64) for _ in m01_dfs]),
+            fields=vec_bar_cols,
+            instrument=instrument, contracts=list(contracts), contract_multiplier=contract_multiplier,
+            pre_settle=np.array(pre_settles, dtype=np.float64),
+            pre_spot_close=np.array(pre_spot_closes, dtype=np.float64),
+            sub_win_width=sub_win_width, tot_bar_num=tot_bar_num, backend=backend)
+
+    return run
+
+
+def _stream(blocks: list, instrument: str, contract_multiplier: int):
+    for _, contract, pre_settle, pre_spot_close, m01_df in blocks:
+        streaming_features = CStreamingFeatures(
+            instrument=instrument, contract=contract, contract_multiplier=contract_multiplier,
+            pre_settle=pre_settle, pre_spot_close=pre_spot_close,
+            sub_win_width=sub_win_width, tot_bar_num=tot_bar_num)
+        for bar in m01_df.to_dict("records"):
+            streaming_features.update(bar)
+
+
+bench_kernels = {
+    "pandas": _per_day(cal_features_and_return_one_day),
+    "vec": _per_day(cal_features_and_return_one_day_vec, backend="numpy"),
+    "vec-jit": _per_day(cal_features_and_return_one_day_vec, backend="jit"),
+    "batch": _batch("numpy"),
+    "batch-jit": _batch("jit"),
+    "stream": _stream,
+}
+
+
+# --- scopes, each one is a list of units (blocks, instrument, contract_multiplier) generated lazily
+def _units(scope: str, backfill_years: int):
+    if scope == "day":
+        yield gen_synthetic_market("IF.CFE", "20220104", 1, seed=0, tot_bar_num=tot_bar_num), "IF.CFE", 300
+    elif scope == "instrument-year":
+        yield gen_synthetic_market("IF.CFE", "20220104", days_per_year, seed=0, tot_bar_num=tot_bar_num), "IF.CFE", 300
+    elif scope == "backfill":
+        for i, (instrument, (_, contract_multiplier, _)) in enumerate(synthetic_instruments.items()):
+            for y in range(backfill_years):
+                bgn_date = "{}0104".format(2016 + y)
+                blocks = gen_synthetic_market(instrument, bgn_date, days_per_year, seed=100 * i + y, tot_bar_num=tot_bar_num)
+                yield blocks, instrument, contract_multiplier
+    else:
+        print("Error! scope = {} is not recognized".format(scope))
+        sys.exit()
+
+
+def bench_kernel_and_scope(kernel: str, scope: str, backfill_years: int, day_repeat: int) -> dict:
+    run = bench_kernels[kernel]
+    days, seconds, peak_mem = 0, 0.0, 0
+    for u, (blocks, instrument, contract_multiplier) in enumerate(_units(scope, backfill_years)):
+        repeat = day_repeat if scope == "day" else 1
+        elapsed = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            run(blocks, instrument, contract_multiplier)
+            elapsed.append(time.perf_counter() - t0)
+        days, seconds = days + len(blocks), seconds + float(np.median(elapsed))
+        if u == 0:
+            # units of a scope are of the same size, so the first one is traced
+            tracemalloc.start()
+            run(blocks, instrument, contract_multiplier)
+            peak_mem = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return {
+        "kernel": kernel,
+        "scope": scope,
+        "days": days,
+        "seconds": seconds,
+        "days_per_sec": days / seconds,
+        "ms_per_day": seconds / days * 1000,
+        "peak_mem_mb": peak_mem / 2 ** 20,
+    }
+
+
+def compare_with_baselines(bench_df: pd.DataFrame, baselines: dict, tolerance: float) -> pd.DataFrame:
+    """
+
+    :param bench_df: results of this run, one row for each kernel and scope
+    :param baselines: {"kernel/scope": {"ms_per_day": float, "peak_mem_mb": float}}
+    :param tolerance: relative slowdown or memory growth allowed
+    :return: bench_df with the ratios to the baselines and a status column
+    """
+    bench_df = bench_df.copy()
+    keys = bench_df["kernel"] + "/" + bench_df["scope"]
+    for k in ["ms_per_day", "peak_mem_mb"]:
+        base = keys.map(lambda z: baselines.get(z, {}).get(k, np.nan))
+        bench_df[k + "_ratio"] = bench_df[k] / base
+    is_regression = (bench_df["ms_per_day_ratio"] > 1 + tolerance) | (bench_df["peak_mem_mb_ratio"] > 1 + tolerance)
+    bench_df["status"] = np.where(bench_df["ms_per_day_ratio"].isna(), "new", np.where(is_regression, "REGRESSION", "ok"))
+    return bench_df
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description="Benchmarks of the feature kernels on synthetic markets")
+    args_parser.add_argument("--kernels", nargs="+", choices=list(bench_kernels), default=list(bench_kernels))
+    args_parser.add_argument("--scopes", nargs="+", choices=["day", "instrument-year", "backfill"],
+                             default=["day", "instrument-year", "backfill"])
+    args_parser.add_argument("--backfill-years", type=int, default=7)
+    args_parser.add_argument("--day-repeat", type=int, default=20)
+    args_parser.add_argument("--baselines", type=str, default=default_baselines_path)
+    args_parser.add_argument("--tolerance", type=float, default=0.2)
+    args_parser.add_argument("--save", action="store_true", help="save the results of this run as the baselines")
+    args = args_parser.parse_args()
+
+    # warm up, e.g. the compilation of the jit kernels is not timed
+    warm_up_unit = next(_units("day", 0))
+    for kernel in args.kernels:
+        bench_kernels[kernel](*warm_up_unit)
+
+    bench_data = []
+    for kernel in args.kernels:
+        for scope in args.scopes:
+            bench_data.append(bench_kernel_and_scope(kernel, scope, args.backfill_years, args.day_repeat))
+            print("... {:>10s} {:>16s} {:>10.3f} ms/day".format(kernel, scope, bench_data[-1]["ms_per_day"]))
+    bench_df = pd.DataFrame(bench_data)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, "r") as j:
+            baselines = json.load(j)
+    bench_df = compare_with_baselines(bench_df, baselines, args.tolerance)
+    pd.set_option("display.width", 0)
+    print(bench_df.to_string(index=False, float_format=lambda z: "{:.3f}".format(z)))
+
+    if args.save:
+        for r in bench_data:
+            baselines["{}/{}".format(r["kernel"], r["scope"])] = {k: r[k] for k in ["ms_per_day", "peak_mem_mb"]}
+        with open(args.baselines, "w") as j:
+            json.dump(baselines, j, indent=4, sort_keys=True)
+        print("... baselines are saved to {}".format(args.baselines))
+    elif (bench_df["status"] == "REGRESSION").any():
+        sys.exit(1)
@@ -0,0 +1,105 @@
+import os
+import glob
+import hashlib
+import multiprocessing as mp
+import pandas as pd
+
+# saved in the save_dir of each CChartRenderer, fig_name -> fingerprint of the last chart rendered
+charts_manifest_file = "charts.manifest.csv"
+
+
+def fingerprint_of_chart(plot_df: pd.DataFrame, plot_kwargs: dict) -> str:
+    """
+
+    :param plot_df: data frame of the lines
+    :param plot_kwargs: the other arguments of plot_lines
+    :return: a hash of everything the chart is drawn from, it does not depend on the process or the session
+    """
+    h = hashlib.sha1()
+    h.update("{!r}|{!r}".format(plot_df.columns.to_list(), sorted(plot_kwargs.items())).encode())
+    h.update(pd.util.hash_pandas_object(plot_df, index=True).to_numpy().tobytes())
+    return h.hexdigest()[0:16]
+
+
+def _init_render_worker():
+    # also switches the backend if pyplot is imported already, so the workers never open a window
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _render(plot_kwargs: dict) -> str:
+    from skyrim.winterhold import plot_lines
+    plot_lines(**plot_kwargs)
+    return plot_kwargs["t_fig_name"]
+
+
+class CChartRenderer(object):
+    """
+    Charts of skyrim.winterhold.plot_lines saved to save_dir, rendered by a pool of proc_num processes with
+    the non-interactive Agg backend, while the caller goes on. The pool is started by the first chart which
+    has to be rendered, a chart is skipped if it is saved and its fingerprint is the one recorded when it
+    was rendered last time.
+
+    Fingerprints are recorded by close(), after all the charts are rendered, so an interrupted run renders
+    its charts again next time.
+    """
+
+    def __init__(self, save_dir: str, proc_num: int = 4):
+        self.m_save_dir = save_dir
+        self.m_proc_num = proc_num
+        self.m_manifest_path = os.path.join(save_dir, charts_manifest_file)
+        self.m_fingerprints: dict[str, str] = {}
+        if os.path.exists(self.m_manifest_path):
+            manifest_df = pd.read_csv(self.m_manifest_path, dtype=str)
+            self.m_fingerprints = dict(zip(manifest_df["fig_name"], manifest_df["fingerprint"]))
+        self.m_pool = None
+        self.m_jobs = []
+        self.m_skipped = 0
+
+    def _is_saved(self, fig_name: str) -> bool:
+        return any(not p.endswith(".tmp") for p in glob.glob(os.path.join(glob.escape(self.m_save_dir), glob.escape(fig_name) + ".*")))
+
+    def submit(self, t_plot_df: pd.DataFrame, t_fig_name: str, **kwargs) -> bool:
+        """
+
+        :param t_plot_df:
+        :param t_fig_name:
+        :param kwargs: the other arguments of plot_lines, except t_save_dir
+        :return: True if the chart is rendered, False if it is skipped
+        """
+        fingerprint = fingerprint_of_chart(t_plot_df, kwargs)
+        if self.m_fingerprints.get(t_fig_name) == fingerprint and self._is_saved(t_fig_name):
+            self.m_skipped += 1
+            return False
+        if self.m_pool is None:
+            self.m_pool = mp.Pool(processes=self.m_proc_num, initializer=_init_render_worker)
+        plot_kwargs = dict(t_plot_df=t_plot_df, t_fig_name=t_fig_name, t_save_dir=self.m_save_dir, **kwargs)
+        self.m_jobs.append((t_fig_name, fingerprint, self.m_pool.apply_async(_render, args=(plot_kwargs,))))
+        return True
+
+    def close(self):
+        """
+        waits for all the charts, and records the fingerprints of the ones rendered
+        """
+        rendered = 0
+        for fig_name, fingerprint, job in self.m_jobs:
+            try:
+                job.get()
+                self.m_fingerprints[fig_name] = fingerprint
+                rendered += 1
+            except Exception as e:
+                self.m_fingerprints.pop(fig_name, None)
+                print("... Warning! {} is not rendered: {}".format(fig_name, e))
+        if self.m_pool is not None:
+            self.m_pool.close()
+            self.m_pool.join()
+            self.m_pool = None
+        self.m_jobs = []
+
+        # written to a temporary file first, so an interrupted run never leaves a broken manifest
+        manifest_df = pd.DataFrame(sorted(self.m_fingerprints.items()), columns=["fig_name", "fingerprint"])
+        tmp_path = self.m_manifest_path + ".tmp"
+        manifest_df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.m_manifest_path)
+        print("... {} charts rendered, {} unchanged charts skipped in {}".format(rendered, self.m_skipped, self.m_save_dir))
+        return 0
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+from features_store import CFeaturesStore
+from features_cube import CFeaturesCube, build_features_cube
+
+# ml_test.py is the testing stage of the models, not a module of tests
+collect_ignore = ["ml_test.py"]
+
+
+@pytest.fixture
+def make_cube(tmp_path):
+    """
+    make_cube(rows_df, instruments, tids, name) saves rows_df, with the columns trade_date, instrument, tid and
+    values, to a CFeaturesStore in tmp_path / name and builds a CFeaturesCube of it
+    """
+
+    def _make_cube(rows_df: pd.DataFrame, instruments: list[str], tids: list[str], name: str = "cube") -> CFeaturesCube:
+        save_dir = str(tmp_path / name)
+        rows_df = rows_df.assign(contract=rows_df["instrument"].str[0:2] + "2301", timestamp=np.int64(0))
+        frames = [(trade_date, instrument, day_df.drop(columns="trade_date").reset_index(drop=True))
+                  for (trade_date, instrument), day_df in rows_df.groupby(by=["trade_date", "instrument"])]
+        CFeaturesStore(save_dir).write(frames)
+        build_features_cube(save_dir, rows_df["trade_date"].min(), "99991231", instruments, tids)
+        return CFeaturesCube(save_dir)
+
+    return _make_cube
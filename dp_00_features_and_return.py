@@ -1,12 +1,26 @@
 import sys
 import os
 import datetime as dt
-import json
+import itertools as ittl
+import functools
+import contextlib
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
-from skyrim.whiterun import CCalendar, CInstrumentInfoTable
-from skyrim.winterhold import check_and_mkdir
-from skyrim.falkreath import CManagerLibReader, CTable
-from xfuns import cal_features_and_return_one_day
+from xfuns import check_m01_bars, cal_features_and_return_one_day
+from m01_reader import CM01MajorContractReader, iter_prefetched
+from features_manifest import CFeaturesManifest, features_manifest_file, fingerprint_of_inputs, now_label
+from features_store import CFeaturesStore
+from features_vec import cal_features_and_return_one_day_vec, cal_features_and_return_batch, vec_bar_cols
+from features_jit import jit_available
+from project_config import factors, features_kernel_version
+
+# "vec" differs from "pandas" in the vtop factors when volumes tie, as documented in
+# cal_features_and_return_one_day_vec, so the manifest records which one saved each day
+features_engines = {
+    "pandas": cal_features_and_return_one_day,
+    "vec": cal_features_and_return_one_day_vec,
+}
 
 
 def split_spot_daily_k(equity_index_by_instrument_dir: str, equity_indexes: list[str]):
@@ -21,6 +35,307 @@ def split_spot_daily_k(equity_index_by_instrument_dir: str, equity_indexes: list
     return 0
 
 
+def get_features_and_return_path(research_features_and_return_dir: str, trade_date: str, instrument: str) -> str:
+    return os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date,
+                        "{}-{}-features_and_return.csv.gz".format(trade_date, instrument))
+
+
+def merge_selected_factors(saved_df: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param saved_df: features and return of one day and one instrument, as saved by cal_features_and_return
+    :param new_df: the same day and instrument, with only some factors calculated
+    :return: saved_df with the columns of new_df replaced or added, columns are kept in the order of project_config
+    """
+    id_cols = ["instrument", "contract", "tid", "timestamp"]
+    if saved_df["tid"].tolist() != new_df["tid"].tolist() or saved_df["contract"].tolist() != new_df["contract"].tolist():
+        raise ValueError("saved features and return do not match the new ones for {} @ {}".format(
+            new_df["instrument"].iloc[0], new_df["timestamp"].iloc[0]))
+    merged_df = saved_df.reset_index(drop=True)
+    for lbl in new_df.columns.difference(id_cols):
+        merged_df[lbl] = new_df[lbl].to_numpy()
+    return merged_df[id_cols + [_ for _ in factors + ["rtm"] if _ in merged_df.columns]]
+
+
+def kernel_label(engine: str, batch_freq: str | None, backend: str) -> str:
+    """
+
+    :return: features_kernel_version and the kernel which calculates the days, like "1.pandas" or "1.vec-jit",
+             backend "jit" falls back to "numpy" if numba is not installed, as features_vec does
+    """
+    if (batch_freq is None) and (engine == "pandas"):
+        return "{}.pandas".format(features_kernel_version)
+    return "{}.vec-{}".format(features_kernel_version, "jit" if (backend == "jit") and jit_available else "numpy")
+
+
+def load_reference_tables(equity_indexes: list[str],
+                          equity_index_by_instrument_dir: str,
+                          md_by_instru_dir: str,
+                          major_minor_dir: str) -> dict[str, dict[str, pd.DataFrame]]:
+    """
+
+    :return: {"spot": {instrument: df}, "futures_md": {instrument: df}, "major_minor": {instrument: df}}, all of them
+             indexed by trade_date
+    """
+    reference_tables = {"spot": {}, "futures_md": {}, "major_minor": {}}
+    for equity_index_code, equity_instru_id in equity_indexes:
+        spot_data_file = "{}.csv".format(equity_index_code)
+        spot_data_path = os.path.join(equity_index_by_instrument_dir, spot_data_file)
+        spot_df = pd.read_csv(spot_data_path, dtype={"trade_date": str}).set_index("trade_date")
+        reference_tables["spot"][equity_instru_id] = spot_df
+
+        futures_md_file = "{}.md.settle.csv.gz".format(equity_instru_id)
+        futures_md_path = os.path.join(md_by_instru_dir, futures_md_file)
+        futures_md_df = pd.read_csv(futures_md_path, dtype={"trade_date": str}).set_index("trade_date")
+        reference_tables["futures_md"][equity_instru_id] = futures_md_df
+
+        major_minor_file = "major_minor.{}.csv.gz".format(equity_instru_id)
+        major_minor_path = os.path.join(major_minor_dir, major_minor_file)
+        major_minor_df = pd.read_csv(major_minor_path, dtype=str).set_index("trade_date")
+        reference_tables["major_minor"][equity_instru_id] = major_minor_df
+
+        print("... {}:{} spot and futures data loaded @ {}".format(equity_index_code, equity_instru_id, dt.datetime.now()))
+    return reference_tables
+
+
+# reference tables of this process, set once by init_reference_tables, and inherited by the workers
+# of cal_features_and_return when they are forked, or passed to each one once when they are spawned
+_reference_tables = {}
+
+# lock of the features store in the workers, held while they read it, as the main process holds it while
+# it writes the days finished so far, so a partition is never read while it is swapped
+_store_lock = contextlib.nullcontext()
+
+# IM.CFE is not listed before this date
+im_bgn_date = "20220722"
+
+
+def init_reference_tables(reference_tables: dict[str, dict[str, pd.DataFrame]], store_lock=None):
+    global _store_lock
+    _reference_tables.update(reference_tables)
+    if store_lock is not None:
+        _store_lock = store_lock
+
+
+def split_read_chunks(batches: list[tuple[str, list[tuple[str, str]]]]) -> list[list[tuple[str, list[tuple[str, str]]]]]:
+    """
+
+    :param batches: [(batch_id, [(trade_date, prev_date), ...]), ...]
+    :return: the batches grouped by month, or by year for yearly batches, each group is read from M01 at once,
+             and saved as soon as it is calculated
+    """
+    return [list(chunk) for _, chunk in ittl.groupby(batches, key=lambda z: z[0][0:6])]
+
+
+def days_of_batches(batches: list[tuple[str, list[tuple[str, str]]]], equity_indexes: list[str]) -> list[tuple[str, str]]:
+    return [(trade_date, equity_instru_id) for _, batch_dates in batches for trade_date, _ in batch_dates
+            for _, equity_instru_id in equity_indexes if not ((trade_date <= im_bgn_date) and (equity_instru_id == "IM.CFE"))]
+
+
+def unexpected_failures(batches: list[tuple[str, list[tuple[str, str]]]], equity_indexes: list[str],
+                        e: Exception) -> list[tuple[str, str, str]]:
+    return [(trade_date, equity_instru_id, "unexpected error: {!r}".format(e))
+            for trade_date, equity_instru_id in days_of_batches(batches, equity_indexes)]
+
+
+def cal_features_and_return_for_batches(batches: list[tuple[str, list[tuple[str, str]]]],
+                                        equity_indexes: list[str],
+                                        contract_multipliers: dict[str, int],
+                                        futures_md_structure_path: str,
+                                        futures_em01_db_name: str,
+                                        futures_md_dir: str,
+                                        research_features_and_return_dir: str,
+                                        sub_win_width: int, tot_bar_num: int,
+                                        engine: str, batch_freq: str | None,
+                                        selected_factors: list[str] | None, backend: str,
+                                        run_mode: str, manifest: CFeaturesManifest, store: CFeaturesStore,
+                                        save_csv: bool,
+                                        verbose: bool):
+    """
+
+    :param batches: [(batch_id, [(trade_date, prev_date), ...]), ...], consecutive dates, read from M01 by this call only
+    :param run_mode: "o" to calculate every day, "a" to skip the days which are up-to-date in manifest
+    :param manifest: records of the days already saved
+    :param store: features store, only read by this call
+    :param save_csv: whether to save the csv files too
+    :return: yields (failures, records, frames) of each chunk of split_read_chunks(batches), failures =
+             [(trade_date, instrument, reason), ...], dates of instruments which failed are not saved, records =
+             [(trade_date, instrument, fingerprint, kernel_version, rows, saved_at), ...] of the days calculated,
+             to update the manifest with, frames = [(trade_date, instrument, features_and_ret_df), ...], to write
+             to the store
+    """
+    id_cols = ["timestamp", "loc_id", "instrument", "exchange", "wind_code"]
+    val_cols = [
+        "open", "high", "low", "close",
+        "volume", "amount", "oi",
+        "daily_open", "daily_high", "daily_low",
+        "preclose", "preoi",
+    ]
+    m01_columns = id_cols + val_cols
+    kernel_version = kernel_label(engine, batch_freq, backend)
+    if save_csv:
+        from skyrim.winterhold import check_and_mkdir
+    spot_data_manager = _reference_tables["spot"]
+    futures_md_manager = _reference_tables["futures_md"]
+    major_minor_manager = _reference_tables["major_minor"]
+
+    # --- major contract, previous settle and previous spot close of each date and instrument
+    day_refs, no_major_contract = {}, set()
+    for _, batch_dates in batches:
+        for trade_date, prev_date in batch_dates:
+            for equity_index_code, equity_instru_id in equity_indexes:
+                if (trade_date <= im_bgn_date) and (equity_instru_id == "IM.CFE"):
+                    continue
+                try:
+                    major_contract = major_minor_manager[equity_instru_id].at[trade_date, "n_contract"]
+                    pre_settle = futures_md_manager[equity_instru_id].at[prev_date, major_contract]
+                    pre_spot_close = spot_data_manager[equity_instru_id].at[prev_date, "close"]
+                    day_refs[(trade_date, equity_instru_id)] = (major_contract, pre_settle, pre_spot_close)
+                except KeyError:
+                    no_major_contract.add((trade_date, equity_instru_id))
+
+    # --- M01 is read by chunks of at least a month, only the bars of the major contracts are read, and
+    # the next chunk is read in a background thread while this one is calculated
+    def read_chunk(m01_reader: CM01MajorContractReader, chunk: list):
+        return m01_reader.read([(trade_date, equity_instru_id, day_refs[(trade_date, equity_instru_id)][0])
+                                for _, batch_dates in chunk for trade_date, _ in batch_dates
+                                for _, equity_instru_id in equity_indexes if (trade_date, equity_instru_id) in day_refs])
+
+    read_chunks = split_read_chunks(batches)
+    prefetched_chunks = iter_prefetched(
+        tasks=read_chunks,
+        open_reader=lambda: CM01MajorContractReader(
+            futures_md_structure_path, futures_em01_db_name, futures_md_dir, m01_columns),
+        read_fun=read_chunk)
+
+    def cal_chunk(chunk: list, m01_dfs: dict, m01_errors: dict) -> tuple[list, list, list]:
+        failures, records, frames = [], [], []
+        for batch_id, batch_dates in chunk:
+            batch_blocks = {equity_instru_id: [] for _, equity_instru_id in equity_indexes}
+            for trade_date, _ in batch_dates:
+                failures += [(trade_date, equity_instru_id, m01_errors[(trade_date, equity_instru_id)])
+                             for _, equity_instru_id in equity_indexes if (trade_date, equity_instru_id) in m01_errors]
+                if all(len(m01_dfs.get((trade_date, equity_instru_id), [])) == 0 for _, equity_instru_id in equity_indexes):
+                    continue
+
+                for equity_index_code, equity_instru_id in equity_indexes:
+                    if (trade_date, equity_instru_id) in no_major_contract:
+                        failures.append((trade_date, equity_instru_id, "does not have major contract"))
+                        continue
+                    if (trade_date, equity_instru_id) not in m01_dfs:
+                        continue
+                    major_contract, pre_settle, pre_spot_close = day_refs[(trade_date, equity_instru_id)]
+                    major_contract_m01_df = m01_dfs[(trade_date, equity_instru_id)].round(2)
+                    try:
+                        # every block is checked here, before the batch kernel stacks it with the other days
+                        check_m01_bars({k: major_contract_m01_df[k].to_numpy(dtype=np.int64 if k == "timestamp" else np.float64)
+                                        for k in ["open", "high", "low", "close", "timestamp"]},
+                                       major_contract, tot_bar_num, widths=(5, 10, 15))
+                    except ValueError as e:
+                        failures.append((trade_date, equity_instru_id, str(e)))
+                        continue
+                    fingerprint = fingerprint_of_inputs(major_contract_m01_df, major_contract, pre_settle, pre_spot_close,
+                                                        sub_win_width, tot_bar_num)
+                    if (run_mode in ["A", "APPEND"]) and manifest.is_up_to_date(
+                            trade_date, equity_instru_id, fingerprint, kernel_version):
+                        with _store_lock:
+                            if store.has_day(trade_date, equity_instru_id):
+                                continue
+                    batch_blocks[equity_instru_id].append(
+                        (trade_date, major_contract, pre_settle, pre_spot_close, major_contract_m01_df, fingerprint))
+
+            for equity_instru_id, blocks in batch_blocks.items():
+                if len(blocks) == 0:
+                    continue
+                contract_multiplier = contract_multipliers[equity_instru_id]
+                trade_dates, major_contracts, pre_settles, pre_spot_closes, m01_blocks, fingerprints = zip(*blocks)
+                save_paths = [get_features_and_return_path(research_features_and_return_dir, trade_date, equity_instru_id)
+                              for trade_date in trade_dates]
+                # backfill only if every day in this batch is already saved
+                with _store_lock:
+                    backfill = (selected_factors is not None) and all(store.has_day(_, equity_instru_id) for _ in trade_dates)
+                kwargs = {"sub_win_width": sub_win_width, "tot_bar_num": tot_bar_num}
+                if backfill:
+                    kwargs["selected_factors"] = selected_factors
+                if (batch_freq is not None) or (engine == "vec"):
+                    kwargs["backend"] = backend
+                try:
+                    if batch_freq is None:
+                        features_and_ret_dfs = [features_engines[engine](
+                            m01=major_contract_m01_df,
+                            instrument=equity_instru_id, contract=major_contract, contract_multiplier=contract_multiplier,
+                            pre_settle=pre_settle, pre_spot_close=pre_spot_close, **kwargs
+                        ) for _, major_contract, pre_settle, pre_spot_close, major_contract_m01_df, _ in blocks]
+                    else:
+                        features_and_ret_dfs = cal_features_and_return_batch(
+                            m01_tensor=np.stack([_[vec_bar_cols].to_numpy(dtype=np.float64) for _ in m01_blocks]),
+                            fields=vec_bar_cols,
+                            instrument=equity_instru_id, contracts=list(major_contracts), contract_multiplier=contract_multiplier,
+                            pre_settle=np.array(pre_settles, dtype=np.float64),
+                            pre_spot_close=np.array(pre_spot_closes, dtype=np.float64), **kwargs)
+
+                    if backfill:
+                        with _store_lock:
+                            saved_dfs = store.read_days(list(trade_dates), equity_instru_id)
+                        features_and_ret_dfs = [merge_selected_factors(saved_dfs[trade_date], new_df)
+                                                for trade_date, new_df in zip(trade_dates, features_and_ret_dfs)]
+                except ValueError as e:
+                    # saved days which do not match the new ones
+                    failures += [(trade_date, equity_instru_id, "calculation failed: {!r}".format(e)) for trade_date in trade_dates]
+                    continue
+
+                for trade_date, fingerprint, features_and_return_path, features_and_ret_df in zip(
+                        trade_dates, fingerprints, save_paths, features_and_ret_dfs):
+                    if save_csv:
+                        check_and_mkdir(os.path.join(research_features_and_return_dir, trade_date[0:4]))
+                        check_and_mkdir(os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date))
+                        features_and_ret_df.to_csv(features_and_return_path, index=False, float_format="%.6f")
+                    frames.append((trade_date, equity_instru_id, features_and_ret_df))
+                    if not backfill:
+                        records.append((trade_date, equity_instru_id, fingerprint, kernel_version,
+                                        len(features_and_ret_df), now_label()))
+                    elif (record := manifest.get(trade_date, equity_instru_id)) is not None:
+                        # the other columns are not recalculated, so the fingerprint is kept, but the file is newer
+                        # than the one loaded to sqlite3. A day mixing two kernels is recorded by both of them, so
+                        # it is not up to date for any kernel and the next append calculates it again in full
+                        saved_fingerprint, saved_version, rows, _ = record
+                        if kernel_version not in saved_version.split("+"):
+                            saved_version = saved_version + "+" + kernel_version
+                        records.append((trade_date, equity_instru_id, saved_fingerprint, saved_version, rows, now_label()))
+
+            if verbose:
+                print("... features and return are calculated for {}".format(batch_id))
+        return failures, records, frames
+
+    for chunk, (m01_dfs, m01_errors) in prefetched_chunks:
+        try:
+            res = cal_chunk(chunk, m01_dfs, m01_errors)
+        except Exception as e:
+            # bad days are failed one by one above, anything else fails the days of this chunk only
+            res = unexpected_failures(chunk, equity_indexes, e), [], []
+        yield res
+
+
+def cal_features_and_return_for_chunk(chunk: list[tuple[str, list[tuple[str, str]]]], **kwargs) -> tuple[list, list, list]:
+    """
+    task of the workers of cal_features_and_return, any error, e.g. in opening M01, fails the days of the chunk
+    instead of the whole run
+
+    :param chunk: one chunk of split_read_chunks
+    :param kwargs: the other arguments of cal_features_and_return_for_batches
+    :return: (failures, records, frames) of the chunk
+    """
+    failures, records, frames = [], [], []
+    try:
+        for chunk_failures, chunk_records, chunk_frames in cal_features_and_return_for_batches(batches=chunk, **kwargs):
+            failures += chunk_failures
+            records += chunk_records
+            frames += chunk_frames
+    except Exception as e:
+        return unexpected_failures(chunk, kwargs["equity_indexes"], e), [], []
+    return failures, records, frames
+
+
 def cal_features_and_return(bgn_date: str, stp_date: str,
                             equity_indexes: list[str],
                             calendar_path: str, futures_instru_info_path: str,
@@ -31,91 +346,121 @@ def cal_features_and_return(bgn_date: str, stp_date: str,
                             futures_md_dir: str,
                             major_minor_dir: str,
                             research_features_and_return_dir: str,
+                            sub_win_width: int = 30, tot_bar_num: int = 240,
+                            engine: str = "pandas",
+                            batch_freq: str | None = None,
+                            selected_factors: list[str] | None = None,
+                            backend: str = "numpy",
+                            proc_num: int | None = None,
+                            run_mode: str = "o",
+                            save_csv: bool = False,
                             verbose: bool = False
                             ):
-    im_bgn_date = "20220722"
-    id_cols = ["timestamp", "loc_id", "instrument", "exchange", "wind_code"]
-    val_cols = [
-        "open", "high", "low", "close",
-        "volume", "amount", "oi",
-        "daily_open", "daily_high", "daily_low",
-        "preclose", "preoi",
-    ]
-    m01_columns = id_cols + val_cols
+    """
+
+    :param sub_win_width: checkpoint grid, see project_config
+    :param tot_bar_num: number of minute bars of a day
+    :param engine: "pandas" or "vec", used when batch_freq is None
+    :param batch_freq: None, "month" or "year"
+    :param selected_factors: None to calculate and save all factors and rtm, otherwise only these columns are
+                             calculated and replaced (or added) in the days already saved in the store, days
+                             not saved are calculated in full. Requires the vectorized kernels.
+    :param backend: "numpy" or "jit", backend of the vectorized kernels, see features_vec.cal_features_and_return_vec
+    :param proc_num: None to run in this process, otherwise the months (or years, for yearly batches) are
+                     calculated by proc_num worker processes, each one reading its own months from M01
+    :param run_mode: must be one of ['o', 'overwrite', 'a', 'append'], "o" calculates every day, "a" calculates
+                     only the days which are missing from the manifest, or saved from other inputs (fingerprint
+                     of M01 bars, pre settle, pre spot close and checkpoint grid) or by another kernel, i.e. another
+                     kernel version, engine or backend, see kernel_label.
+                     Days saved are recorded in the manifest in both modes.
+    :param save_csv: features and return are saved to the CFeaturesStore in research_features_and_return_dir,
+                     and to the csv files of each day too if it is True, for convert_csv_to_sqlite3
+    :param verbose:
+    :return: 0 if all dates are saved, 1 if any (date, instrument) failed, failures are reported by date.
+             Days are written to the store and recorded in the manifest month by month, as soon as each month
+             is calculated, so an interrupted run keeps the months finished before
+    """
+    if (selected_factors is not None) and (batch_freq is None) and (engine == "pandas"):
+        print("Error! selected_factors is only supported by the vectorized kernels, use engine = 'vec' or set batch_freq")
+        sys.exit()
+    run_mode = run_mode.upper()
+    if run_mode not in ["O", "OVERWRITE", "A", "APPEND"]:
+        print("Error! run_mode = {} is not recognized".format(run_mode))
+        sys.exit()
+    if (selected_factors is not None) and (run_mode in ["A", "APPEND"]):
+        print("Error! selected_factors recalculates the days already saved, it can not be used with run_mode = 'a'")
+        sys.exit()
+
+    # imported here, so the kernels and helpers of this module do not need skyrim
+    from skyrim.whiterun import CCalendar, CInstrumentInfoTable
+    from skyrim.winterhold import check_and_mkdir
 
     # --- load calendar
     calendar = CCalendar(calendar_path)
 
     # --- load instru info table
     instru_info_table = CInstrumentInfoTable(t_path=futures_instru_info_path, t_index_label="windCode", t_type="CSV")
+    contract_multipliers = {equity_instru_id: instru_info_table.get_multiplier(equity_instru_id)
+                            for _, equity_instru_id in equity_indexes}
 
-    # --- spot and futures manager
-    spot_data_manager, futures_md_manager, major_minor_manager = {}, {}, {}
-    for equity_index_code, equity_instru_id in equity_indexes:
-        spot_data_file = "{}.csv".format(equity_index_code)
-        spot_data_path = os.path.join(equity_index_by_instrument_dir, spot_data_file)
-        spot_df = pd.read_csv(spot_data_path, dtype={"trade_date": str}).set_index("trade_date")
-        spot_data_manager[equity_instru_id] = spot_df
+    # --- manifest and store of the days already saved
+    check_and_mkdir(research_features_and_return_dir)
+    manifest = CFeaturesManifest(os.path.join(research_features_and_return_dir, features_manifest_file))
+    store = CFeaturesStore(research_features_and_return_dir)
 
-        futures_md_file = "{}.md.settle.csv.gz".format(equity_instru_id)
-        futures_md_path = os.path.join(md_by_instru_dir, futures_md_file)
-        futures_md_df = pd.read_csv(futures_md_path, dtype={"trade_date": str}).set_index("trade_date")
-        futures_md_manager[equity_instru_id] = futures_md_df
+    # --- spot and futures manager, loaded once and shared by all the workers
+    init_reference_tables(load_reference_tables(
+        equity_indexes, equity_index_by_instrument_dir, md_by_instru_dir, major_minor_dir))
 
-        major_minor_file = "major_minor.{}.csv.gz".format(equity_instru_id)
-        major_minor_path = os.path.join(major_minor_dir, major_minor_file)
-        major_minor_df = pd.read_csv(major_minor_path, dtype=str).set_index("trade_date")
-        major_minor_manager[equity_instru_id] = major_minor_df
+    # --- batches
+    # batch_freq = None: one day in each batch, calculated by features_engines[engine]
+    # batch_freq = "month" | "year": all days in the batch are stacked and calculated by the vectorized batch kernel
+    batch_key_len = {None: 8, "month": 6, "year": 4}[batch_freq]
+    iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    batches = [(batch_id, [(trade_date, calendar.get_next_date(trade_date, -1)) for trade_date in batch_dates])
+               for batch_id, batch_dates in ittl.groupby(iter_dates, key=lambda z: z[0:batch_key_len])]
 
-        print("... {}:{} spot and futures data loaded @ {}".format(equity_index_code, equity_instru_id, dt.datetime.now()))
+    kwargs = dict(
+        equity_indexes=equity_indexes, contract_multipliers=contract_multipliers,
+        futures_md_structure_path=futures_md_structure_path, futures_em01_db_name=futures_em01_db_name,
+        futures_md_dir=futures_md_dir, research_features_and_return_dir=research_features_and_return_dir,
+        sub_win_width=sub_win_width, tot_bar_num=tot_bar_num, engine=engine, batch_freq=batch_freq,
+        selected_factors=selected_factors, backend=backend, run_mode=run_mode, manifest=manifest, store=store,
+        save_csv=save_csv, verbose=verbose,
+    )
+    if proc_num is None:
+        pool, store_lock = None, contextlib.nullcontext()
+        results = cal_features_and_return_for_batches(batches=batches, **kwargs)
+    else:
+        # workers hold the lock while they read the store, this process while it writes it
+        store_lock = mp.Lock()
+        if mp.get_start_method() == "fork":
+            # workers are forked after the reference tables are loaded, so they inherit them without a copy
+            pool = mp.Pool(processes=proc_num, initializer=init_reference_tables, initargs=({}, store_lock))
+        else:
+            # spawned workers start empty, the reference tables are pickled to each one of them once
+            pool = mp.Pool(processes=proc_num, initializer=init_reference_tables, initargs=(_reference_tables, store_lock))
+        results = pool.imap_unordered(functools.partial(cal_features_and_return_for_chunk, **kwargs),
+                                      split_read_chunks(batches))
 
-    # --- init lib writer
-    with open(futures_md_structure_path, "r") as j:
-        m01_table_struct = json.load(j)[futures_em01_db_name]["CTable"]
-    m01_table = CTable(t_table_struct=m01_table_struct)
-    m01_db = CManagerLibReader(t_db_save_dir=futures_md_dir, t_db_name=futures_em01_db_name + ".db")
-    m01_db.set_default(m01_table.m_table_name)
-
-    # --- main loop
-    for trade_date in calendar.get_iter_list(bgn_date, stp_date, True):
-        prev_date = calendar.get_next_date(trade_date, -1)
-        m01_df = m01_db.read_by_date(t_trade_date=trade_date, t_value_columns=m01_columns).round(2)
-        if len(m01_df) == 0:
-            continue
-
-        check_and_mkdir(save_year_dir := os.path.join(research_features_and_return_dir, trade_date[0:4]))
-        check_and_mkdir(save_date_dir := os.path.join(save_year_dir, trade_date))
-
-        for equity_index_code, equity_instru_id in equity_indexes:
-            if (trade_date <= im_bgn_date) and (equity_instru_id == "IM.CFE"):
-                continue
-            try:
-                major_contract = major_minor_manager[equity_instru_id].at[trade_date, "n_contract"]
-                pre_settle = futures_md_manager[equity_instru_id].at[prev_date, major_contract]
-                pre_spot_close = spot_data_manager[equity_instru_id].at[prev_date, "close"]
-            except KeyError:
-                print(equity_instru_id, "does not have major contract @ ", trade_date)
-                sys.exit()
-            major_contract_m01_df = m01_df.loc[m01_df.wind_code == major_contract].reset_index(drop=True)
-            if (num_of_bars := len(major_contract_m01_df)) != 240:
-                print("Error! Number of bars = {} @ {} for {} - {}".format(
-                    num_of_bars, trade_date, equity_instru_id, major_contract))
-                sys.exit()
-
-            contract_multiplier = instru_info_table.get_multiplier(equity_instru_id)
-            features_and_ret_df = cal_features_and_return_one_day(
-                m01=major_contract_m01_df,
-                instrument=equity_instru_id, contract=major_contract, contract_multiplier=contract_multiplier,
-                pre_settle=pre_settle, pre_spot_close=pre_spot_close)
-
-            features_and_return_file = "{}-{}-features_and_return.csv.gz".format(trade_date, equity_instru_id)
-            features_and_return_path = os.path.join(save_date_dir, features_and_return_file)
-            features_and_ret_df.to_csv(features_and_return_path, index=False, float_format="%.6f")
-
-        if verbose:
-            print("... features and return are calculated for {}".format(trade_date))
-
-    # --- close lib
-    m01_db.close()
+    # --- write store and update manifest, by this process only, as soon as each chunk is calculated
+    failures, saved_num = [], 0
+    for chunk_failures, records, frames in results:
+        with store_lock:
+            store.write(frames)
+        manifest.update(records)
+        manifest.save()
+        failures += chunk_failures
+        saved_num += len(records)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    print("... features and return of {} (trade_date, instrument) are saved".format(saved_num))
 
+    # --- report failures
+    if len(failures) > 0:
+        print("... {} failures in calculating features and return".format(len(failures)))
+        for trade_date, equity_instru_id, reason in sorted(failures):
+            print("... {} {}: {}".format(trade_date, equity_instru_id, reason))
+        return 1
     return 0
@@ -1,33 +1,181 @@
+import sys
 import os
+import time
+import sqlite3
 import datetime as dt
 import pandas as pd
-from skyrim.falkreath import CManagerLibWriterByDate, CTable
-from skyrim.whiterun import CCalendar
+from features_manifest import CFeaturesManifest, features_manifest_file, sqlite3_manifest_file
+from features_store import CFeaturesStore
 
+# secondary indexes of features_and_return, {index_name: columns}, created after the dates are loaded.
+# The primary key starts with trade_date, these ones serve the readers of features_and_return.db by tid
+# outside this project, the stages of this project read the CFeaturesCube instead
+features_and_return_indexes = {
+    "idx_features_and_return_tid_trade_date": ["tid", "trade_date"],
+    "idx_features_and_return_instrument_tid_trade_date": ["instrument", "tid", "trade_date"],
+}
 
-def convert_csv_to_sqlite3(run_mode: str, bgn_date: str, stp_date: str,
-                           calendar_path: str,
-                           research_features_and_return_dir: str,
-                           equity_indexes,
-                           sqlite3_tables,
-                           ):
+# every shape of query issued on features_and_return, as the t_conditions of read_by_conditions: the
+# delete of the loader, and the shapes of the readers by tid outside this project the indexes are built for
+features_and_return_query_shapes = {
+    "load_to_sqlite3, append": [
+        ("trade_date", "=", "20230103")],
+    "external, one tid": [
+        ("tid", "=", "T01"), ("trade_date", ">=", "20230101"), ("trade_date", "<", "20230601")],
+    "external, one instrument and tid": [
+        ("instrument", "=", "IC.CFE"), ("tid", "=", "T01"), ("trade_date", ">=", "20230101"), ("trade_date", "<", "20230601")],
+}
+
+
+def create_secondary_indexes(connection: sqlite3.Connection, table_name: str, indexes: dict[str, list[str]]):
+    for index_name, index_cols in indexes.items():
+        connection.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(index_name, table_name, ", ".join(index_cols)))
+    # statistics for the query planner to choose between the primary key and the indexes
+    connection.execute("ANALYZE {}".format(table_name))
+    connection.commit()
+    return 0
+
+
+def check_query_plans(db_path: str, table_name: str,
+                      query_shapes: dict[str, list[tuple[str, str, str]]]) -> list[tuple[str, str, str]]:
+    """
+
+    :param db_path:
+    :param table_name:
+    :param query_shapes: {description: t_conditions}
+    :return: [(description, plan, problem), ...], problem is "" if the plan searches an index by all the equality
+             conditions, "full scan" if it reads the whole table, or the equality conditions the index does not use,
+             e.g. the trade_date range of the primary key is searched and the rows of every tid are read
+    """
+    connection = sqlite3.connect(db_path)
+    res = []
+    for description, conditions in query_shapes.items():
+        sql = "EXPLAIN QUERY PLAN SELECT * FROM {} WHERE {}".format(
+            table_name, " AND ".join("{} {} ?".format(c, op) for c, op, _ in conditions))
+        plan = "; ".join(detail for _, _, _, detail in connection.execute(sql, [v for _, _, v in conditions]))
+        if any(detail.startswith("SCAN") and "INDEX" not in detail for detail in plan.split("; ")):
+            problem = "full scan"
+        elif unused := [c for c, op, _ in conditions if op == "=" and "{}=?".format(c) not in plan]:
+            problem = "index does not use {}".format(", ".join(unused))
+        else:
+            problem = ""
+        res.append((description, plan, problem))
+    connection.close()
+    return res
+
+
+def report_query_plans(db_path: str, table_name: str) -> int:
+    """
+
+    :return: number of the query shapes of features_and_return_query_shapes with a problem in their plans
     """
+    problems = 0
+    for description, plan, problem in check_query_plans(db_path, table_name, features_and_return_query_shapes):
+        problems += problem != ""
+        print("... {:<40s} {}".format(description, plan))
+        if problem:
+            print("... Warning! {}: {}".format(description, problem))
+    return problems
 
-    :param run_mode: must be one of ['o', 'overwrite', 'a', 'append']
+
+class CSqlite3BulkWriter(object):
+    """
+    Writer of a table which exists already, with the delete_by_date and update_by_date of
+    CManagerLibWriterByDate. Rows are buffered for bulk_days dates and inserted by executemany,
+    all in one transaction, which is committed by close(). During the load the journal is kept
+    in memory, the database is not synced and the cache is large. The secondary indexes are
+    dropped before the load and created again after it, so they are built once.
+    """
+
+    def __init__(self, db_path: str, table_name: str, columns: list[str], indexes: dict[str, list[str]],
+                 bulk_days: int = 250, cache_size_mb: int = 512):
+        self.m_db_path, self.m_table_name, self.m_columns, self.m_indexes = db_path, table_name, columns, indexes
+        self.m_bulk_days = bulk_days
+        self.m_buffer: list[pd.DataFrame] = []
+        self.m_buffer_dates: set[str] = set()
+
+        self.m_connection = sqlite3.connect(db_path, isolation_level=None)
+        self.m_connection.execute("PRAGMA journal_mode = MEMORY")
+        self.m_connection.execute("PRAGMA synchronous = OFF")
+        self.m_connection.execute("PRAGMA temp_store = MEMORY")
+        self.m_connection.execute("PRAGMA cache_size = {}".format(-cache_size_mb * 1024))
+        for index_name in indexes:
+            self.m_connection.execute("DROP INDEX IF EXISTS {}".format(index_name))
+        self.m_connection.execute("BEGIN")
+        self.m_insert_sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            table_name, ", ".join(columns), ", ".join(["?"] * len(columns)))
+
+    def delete_by_date(self, t_date: str):
+        # buffered rows are of other dates, so the delete can be executed at once
+        self.m_connection.execute("DELETE FROM {} WHERE trade_date = ?".format(self.m_table_name), (t_date,))
+
+    def update_by_date(self, t_date: str, t_update_df: pd.DataFrame):
+        self.m_buffer.append(t_update_df.assign(trade_date=t_date))
+        self.m_buffer_dates.add(t_date)
+        if len(self.m_buffer_dates) >= self.m_bulk_days:
+            self._flush()
+
+    def _flush(self):
+        if len(self.m_buffer) == 0:
+            return
+        # converted once for all the buffered dates, to python objects which sqlite3 accepts
+        rows = pd.concat(self.m_buffer, ignore_index=True)[self.m_columns].to_numpy(dtype=object).tolist()
+        self.m_connection.executemany(self.m_insert_sql, rows)
+        self.m_buffer.clear()
+        self.m_buffer_dates.clear()
+
+    def close(self):
+        self._flush()
+        self.m_connection.execute("COMMIT")
+        create_secondary_indexes(self.m_connection, self.m_table_name, self.m_indexes)
+        self.m_connection.execute("PRAGMA synchronous = FULL")
+        self.m_connection.execute("PRAGMA journal_mode = DELETE")
+        self.m_connection.close()
+
+
+def load_to_sqlite3(run_mode: str, bgn_date: str, stp_date: str,
+                    calendar_path: str,
+                    research_features_and_return_dir: str,
+                    equity_indexes,
+                    sqlite3_tables,
+                    read_date,
+                    bulk_load: bool = False,
+                    ):
+    """
+
+    :param run_mode: must be one of ['o', 'overwrite', 'a', 'append'], "o" rebuilds the table from the dates
+                     in [bgn_date, stp_date), "a" reloads only the dates with an instrument whose record in the
+                     manifest of cal_features_and_return differs from the one loaded, or is missing
     :param bgn_date: begin date, format = [YYYYMMDD]
     :param stp_date: stop date, format = [YYYYMMDD], can be skip, and program will use bgn only
     :param calendar_path:
     :param research_features_and_return_dir:
     :param equity_indexes:
     :param sqlite3_tables:
+    :param read_date: read_date(trade_date, instruments) -> {instrument: features_and_ret_df}
+    :param bulk_load: load all the dates in one transaction by CSqlite3BulkWriter, instead of a transaction
+                      for each instrument and date by CManagerLibWriterByDate
     :return:
     """
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
+    run_mode = run_mode.upper()
+    if run_mode not in ["O", "OVERWRITE", "A", "APPEND"]:
+        print("Error! run_mode = {} is not recognized".format(run_mode))
+        sys.exit()
+
+    # imported here, so the query plan checks of this module do not need skyrim
+    from skyrim.falkreath import CManagerLibWriterByDate, CTable
+    from skyrim.whiterun import CCalendar
+
     # --- load calendar
     calendar = CCalendar(calendar_path)
 
+    # --- load manifests, of the csv files saved and of the ones loaded to sqlite3
+    features_manifest = CFeaturesManifest(os.path.join(research_features_and_return_dir, features_manifest_file))
+    sqlite3_manifest = CFeaturesManifest(os.path.join(research_features_and_return_dir, sqlite3_manifest_file))
+
     # --- load lib writer
     features_and_return_lib = CManagerLibWriterByDate(
         t_db_save_dir=research_features_and_return_dir,
@@ -36,28 +184,144 @@ def convert_csv_to_sqlite3(run_mode: str, bgn_date: str, stp_date: str,
     features_and_return_tab = CTable(t_table_struct=sqlite3_tables["features_and_return"])
     features_and_return_lib.initialize_table(
         t_table=features_and_return_tab,
-        t_remove_existence=run_mode.upper() in ["O", "OVERWRITE"]
+        t_remove_existence=run_mode in ["O", "OVERWRITE"]
     )
+    db_path = os.path.join(research_features_and_return_dir, "features_and_return.db")
+    table_struct = sqlite3_tables["features_and_return"]
+    if bulk_load:
+        # the table is created, or dropped and created, by CManagerLibWriterByDate, and loaded by the bulk writer
+        features_and_return_lib.close()
+        features_and_return_lib = CSqlite3BulkWriter(
+            db_path=db_path, table_name=table_struct["table_name"],
+            columns=list(table_struct["primary_keys"]) + list(table_struct["value_columns"]),
+            indexes=features_and_return_indexes,
+        )
 
-    for trade_date in calendar.get_iter_list(bgn_date, stp_date, True):
-        save_date_dir = os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date)
-        for equity_index_code, equity_instru_id in equity_indexes:
-            if trade_date <= "20220722" and equity_instru_id == "IM.CFE":
-                continue
+    # --- dates to load
+    iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    dates_instruments = {trade_date: [equity_instru_id for _, equity_instru_id in equity_indexes
+                                      if not (trade_date <= "20220722" and equity_instru_id == "IM.CFE")]
+                         for trade_date in iter_dates}
+    if run_mode in ["O", "OVERWRITE"]:
+        sqlite3_manifest.clear()
+    else:
+        # a date is deleted and loaded as a whole, so it is skipped only if all the instruments are up-to-date
+        iter_dates = [trade_date for trade_date in iter_dates if not all(
+            (record := features_manifest.get(trade_date, equity_instru_id)) is not None
+            and record == sqlite3_manifest.get(trade_date, equity_instru_id)
+            for equity_instru_id in dates_instruments[trade_date])]
+        for trade_date in iter_dates:
+            for equity_instru_id in dates_instruments[trade_date]:
+                sqlite3_manifest.remove(trade_date, equity_instru_id)
+    # saved before any date is deleted, so an interrupted run loads these dates again
+    sqlite3_manifest.save()
 
-            features_and_return_file = "{}-{}-features_and_return.csv.gz".format(trade_date, equity_instru_id)
-            features_and_return_path = os.path.join(save_date_dir, features_and_return_file)
-            features_and_ret_df = pd.read_csv(features_and_return_path, dtype={"trade_date": str, "timestamp": int})
+    t0, rows = time.time(), 0
+    for trade_date in iter_dates:
+        if run_mode in ["A", "APPEND"]:
+            features_and_return_lib.delete_by_date(t_date=trade_date)
 
-            if run_mode in ["A", "APPEND"]:
-                print(features_and_ret_df)
-                features_and_return_lib.delete_by_date(t_date=trade_date)
+        for equity_instru_id, features_and_ret_df in read_date(trade_date, dates_instruments[trade_date]).items():
             features_and_return_lib.update_by_date(
                 t_date=trade_date,
                 t_update_df=features_and_ret_df,
             )
+            rows += len(features_and_ret_df)
+
+            # days not in the manifest, or changed since, are loaded but not recorded, so they are loaded again
+            record = features_manifest.get(trade_date, equity_instru_id)
+            if record is None:
+                continue
+            if record[2] != len(features_and_ret_df):
+                print("... Warning! {} rows of {} @ {} are loaded, but {} are recorded in the manifest".format(
+                    len(features_and_ret_df), equity_instru_id, trade_date, record[2]))
+                continue
+            sqlite3_manifest.update([(trade_date, equity_instru_id) + record])
 
         print("... @ {0}, features and return of {1} converted to sqlite3".format(dt.datetime.now(), trade_date))
 
     features_and_return_lib.close()
+    if not bulk_load:
+        connection = sqlite3.connect(db_path)
+        create_secondary_indexes(connection, table_struct["table_name"], features_and_return_indexes)
+        connection.close()
+    report_query_plans(db_path, table_struct["table_name"])
+    sqlite3_manifest.save()
+    elapsed = time.time() - t0
+    print("... {} of {} dates are loaded to sqlite3, {} rows in {:.1f} seconds, {:.0f} rows/sec".format(
+        len(iter_dates), len(dates_instruments), rows, elapsed, rows / max(elapsed, 1e-6)))
     return 0
+
+
+def convert_csv_to_sqlite3(run_mode: str, bgn_date: str, stp_date: str,
+                           calendar_path: str,
+                           research_features_and_return_dir: str,
+                           equity_indexes,
+                           sqlite3_tables,
+                           bulk_load: bool = False,
+                           ):
+    """
+    loads the csv files saved by cal_features_and_return with save_csv = True, see load_to_sqlite3
+
+    """
+
+    def read_date(trade_date: str, instruments: list[str]) -> dict[str, pd.DataFrame]:
+        save_date_dir = os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date)
+        res = {}
+        for equity_instru_id in instruments:
+            features_and_return_file = "{}-{}-features_and_return.csv.gz".format(trade_date, equity_instru_id)
+            features_and_return_path = os.path.join(save_date_dir, features_and_return_file)
+            res[equity_instru_id] = pd.read_csv(features_and_return_path, dtype={"trade_date": str, "timestamp": int})
+        return res
+
+    return load_to_sqlite3(run_mode, bgn_date, stp_date, calendar_path, research_features_and_return_dir,
+                           equity_indexes, sqlite3_tables, read_date, bulk_load)
+
+
+def export_store_to_sqlite3(run_mode: str, bgn_date: str, stp_date: str,
+                            calendar_path: str,
+                            research_features_and_return_dir: str,
+                            equity_indexes,
+                            sqlite3_tables,
+                            bulk_load: bool = False,
+                            ):
+    """
+    exports the CFeaturesStore saved by cal_features_and_return to features_and_return.db, see load_to_sqlite3
+
+    """
+    store = CFeaturesStore(research_features_and_return_dir)
+    table_struct = sqlite3_tables["features_and_return"]
+    day_cols = [c for c in table_struct["primary_keys"] if c != "trade_date"] + list(table_struct["value_columns"])
+    year_cache = {}
+
+    def read_date(trade_date: str, instruments: list[str]) -> dict[str, pd.DataFrame]:
+        # the store is read by years, a year at a time
+        year = trade_date[0:4]
+        if year not in year_cache:
+            year_cache.clear()
+            year_df = store.read_by_conditions(
+                t_conditions=[("trade_date", ">=", year + "0101"), ("trade_date", "<=", year + "1231")],
+                t_value_columns=["trade_date"] + day_cols,
+            )
+            year_cache[year] = {k: v[day_cols].reset_index(drop=True) for k, v in year_df.groupby(by=["trade_date", "instrument"])}
+        res = {}
+        for equity_instru_id in instruments:
+            if (trade_date, equity_instru_id) not in year_cache[year]:
+                # failed in cal_features_and_return, and reported there
+                print("... Warning! features and return of {} @ {} are not saved in the store".format(equity_instru_id, trade_date))
+                continue
+            res[equity_instru_id] = year_cache[year][(trade_date, equity_instru_id)]
+        return res
+
+    return load_to_sqlite3(run_mode, bgn_date, stp_date, calendar_path, research_features_and_return_dir,
+                           equity_indexes, sqlite3_tables, read_date, bulk_load)
+
+
+if __name__ == "__main__":
+    from project_setup import research_features_and_return_dir
+    from project_config import sqlite3_tables as project_sqlite3_tables
+
+    # python dp_01_convert_csv_to_sqlite3.py, checks the plans of the query shapes on the table already loaded
+    if report_query_plans(os.path.join(research_features_and_return_dir, "features_and_return.db"),
+                          project_sqlite3_tables["features_and_return"]["table_name"]) > 0:
+        sys.exit(1)
@@ -0,0 +1,115 @@
+import pandas as pd
+from result_store import CResultStore
+from group_tests import select_factors
+
+# saved in group_tests_dir, with the tables group_tests_monthly and selected_factors
+factor_selection_db_name = "factor_selection.db"
+monthly_stats_cols = ["obs", "hdg_sum", "hdg_sum_sq"]
+cum_stats_cols = ["cum_obs", "cum_sum", "cum_sum_sq"]
+
+
+def next_month(trade_month: str) -> str:
+    y, m = int(trade_month[0:4]), int(trade_month[4:6])
+    return "{:04d}{:02d}".format(y + m // 12, m % 12 + 1)
+
+
+def update_factor_selection(
+        factors: list[str], tids: list[str],
+        run_mode: str,
+        group_tests_dir: str,
+        sqlite3_tables: dict,
+        head_n: int = 8,
+):
+    """
+    walk-forward selection of the factors of each tid: the factors of a month are selected by select_factors
+    from the cumulative hdg returns of all the months before it, so a month never sees its own returns.
+
+    Sums of hdg of each factor, tid and month, and their running totals, are saved in group_tests_monthly.
+    With run_mode = "a", only the months from the last one saved, which may be incomplete, are read from
+    group_tests and calculated again on top of the running totals of the month before, and so are the
+    selections of the months after them.
+
+    """
+    overwrite = run_mode.upper() in ["O", "OVERWRITE"]
+    monthly_lib = CResultStore(group_tests_dir, factor_selection_db_name, sqlite3_tables["group_tests_monthly"])
+    monthly_lib.initialize_table(t_remove_existence=overwrite)
+    selected_lib = CResultStore(group_tests_dir, factor_selection_db_name, sqlite3_tables["selected_factors"])
+    selected_lib.initialize_table(t_remove_existence=overwrite)
+
+    # --- months to calculate, and the running totals before them
+    bgn_month = monthly_lib.max_of("trade_month")
+    prv_month = None if bgn_month is None else monthly_lib.max_of("trade_month", [("trade_month", "<", bgn_month)])
+    if prv_month is None:
+        prv_df = pd.DataFrame(columns=["factor", "tid"] + cum_stats_cols)
+    else:
+        prv_df = monthly_lib.read_by_conditions(
+            t_conditions=[("trade_month", "=", prv_month)],
+            t_value_columns=["factor", "tid"] + cum_stats_cols,
+        )
+
+    group_tests_lib = CResultStore(group_tests_dir, "group_tests.db", sqlite3_tables["group_tests"])
+    hdg_df = group_tests_lib.read_by_conditions(
+        t_conditions=[] if bgn_month is None else [("trade_date", ">=", bgn_month + "01")],
+        t_value_columns=["factor", "tid", "trade_date", "hdg"]
+    )
+    group_tests_lib.close()
+    if len(hdg_df) == 0:
+        print("... no month of group tests to select factors from")
+        monthly_lib.close()
+        selected_lib.close()
+        return 0
+
+    # --- monthly stats, every factor and tid has a row for every month, so the running totals of
+    # the last month saved cover all of them
+    hdg_df["trade_month"] = hdg_df["trade_date"].str[0:6]
+    hdg_df["hdg_sq"] = hdg_df["hdg"] ** 2
+    months = sorted(hdg_df["trade_month"].unique())
+    full_index = pd.MultiIndex.from_product([factors, tids, months], names=["factor", "tid", "trade_month"])
+    monthly_df = hdg_df.groupby(by=["factor", "tid", "trade_month"]).agg(
+        obs=("hdg", "size"), hdg_sum=("hdg", "sum"), hdg_sum_sq=("hdg_sq", "sum")
+    ).reindex(full_index, fill_value=0)
+    prv_cum = prv_df.set_index(["factor", "tid"])[cum_stats_cols].reindex(full_index.droplevel("trade_month")).fillna(0)
+    cum = monthly_df.groupby(level=["factor", "tid"])[monthly_stats_cols].cumsum()
+    for monthly_col, cum_col in zip(monthly_stats_cols, cum_stats_cols):
+        monthly_df[cum_col] = cum[monthly_col].to_numpy() + prv_cum[cum_col].to_numpy()
+    monthly_df["cum_obs"] = monthly_df["cum_obs"].astype(int)
+    monthly_lib.update(t_update_df=monthly_df.reset_index())
+
+    # --- selections of the months after the ones calculated
+    selected_dfs = []
+    for (tid, trade_month), tid_month_df in monthly_df.groupby(level=["tid", "trade_month"]):
+        cum_hdg = tid_month_df.droplevel(["tid", "trade_month"]).query("cum_obs > 0")["cum_sum"]
+        if len(cum_hdg) > 0:
+            selected_dfs.append(select_factors(cum_hdg, head_n).assign(tid=tid, trade_month=next_month(trade_month)))
+    if bgn_month is not None:
+        selected_lib.remove(t_conditions=[("trade_month", ">", bgn_month)])
+    if len(selected_dfs) > 0:
+        selected_lib.update(t_update_df=pd.concat(selected_dfs, ignore_index=True))
+    monthly_lib.close()
+    selected_lib.close()
+    print("... factors of {} are selected for {} - {}".format(tids, next_month(months[0]), next_month(months[-1])))
+    return 0
+
+
+def read_selected_factors(tids: list[str], bgn_date: str, stp_date: str,
+                          group_tests_dir: str, sqlite3_tables: dict) -> dict[str, dict[str, pd.DataFrame]]:
+    """
+    the months of [bgn_date, stp_date) of all the tids are read in one query
+
+    :return: {tid: {trade_month: selected_factors_df}}, selected_factors_df.columns = ["factor", "direction"],
+             months without any selection, like the first month of the group tests, are not included
+    """
+    selected_lib = CResultStore(group_tests_dir, factor_selection_db_name, sqlite3_tables["selected_factors"])
+    selected_df = selected_lib.read_by_conditions(
+        t_conditions=[
+            ("trade_month", ">=", bgn_date[0:6]),
+            ("trade_month", "<=", stp_date[0:6]),
+        ],
+        t_value_columns=["tid", "trade_month", "factor", "direction"]
+    )
+    selected_lib.close()
+    res = {tid: {} for tid in tids}
+    for (tid, trade_month), month_df in selected_df.groupby(by=["tid", "trade_month"]):
+        if tid in res:
+            res[tid][trade_month] = month_df[["factor", "direction"]].reset_index(drop=True)
+    return res
@@ -0,0 +1,254 @@
+import os
+import shutil
+import operator
+import numpy as np
+import pandas as pd
+from features_store import CFeaturesStore, store_id_cols
+from features_manifest import CFeaturesManifest, features_manifest_file
+
+features_cube_name = "features_and_return.cube"
+_ops = {"=": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+def build_features_cube(research_features_and_return_dir: str, bgn_date: str, stp_date: str,
+                        instruments: list[str], tids: list[str]):
+    """
+    materializes the days of CFeaturesStore in [bgn_date, stp_date) as a CFeaturesCube in the same directory,
+    the store is read a year at a time, and written to the memory mapped files directly. The fingerprint of
+    the manifest records of [bgn_date, stp_date) is saved with the cube, so CFeaturesCube can tell when the
+    features are saved again after the cube is built
+
+    :param research_features_and_return_dir:
+    :param bgn_date:
+    :param stp_date:
+    :param instruments: instrument axis, like ["IH.CFE", "IF.CFE", "IC.CFE", "IM.CFE"]
+    :param tids: tid axis, project_config.tids
+    :return:
+    """
+    store = CFeaturesStore(research_features_and_return_dir)
+    id_df = store.read_by_conditions(
+        t_conditions=[("trade_date", ">=", bgn_date), ("trade_date", "<", stp_date)],
+        t_value_columns=["trade_date"],
+    )
+    dates = np.unique(id_df["trade_date"].to_numpy(dtype=str))
+    value_cols = store.value_columns()
+
+    # written to a temporary directory and swapped, so the stages never map a cube half written
+    cube_dir = os.path.join(research_features_and_return_dir, features_cube_name)
+    tmp_dir, old_dir = cube_dir + ".tmp", cube_dir + ".old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for axis_name, axis in [("dates", dates), ("instruments", instruments), ("tids", tids), ("columns", value_cols)]:
+        np.save(os.path.join(tmp_dir, axis_name + ".npy"), np.array(axis, dtype=str))
+    shape = (len(dates), len(instruments), len(tids))
+    values = np.lib.format.open_memmap(os.path.join(tmp_dir, "values.npy"), mode="w+", dtype=np.float64, shape=shape + (len(value_cols),))
+    present = np.lib.format.open_memmap(os.path.join(tmp_dir, "present.npy"), mode="w+", dtype=bool, shape=shape)
+    timestamp = np.lib.format.open_memmap(os.path.join(tmp_dir, "timestamp.npy"), mode="w+", dtype=np.int64, shape=shape)
+    contract = np.full(shape[0:2], "", dtype="<U16")
+    values[...], present[...], timestamp[...] = np.nan, False, 0
+
+    instrument_idx, tid_idx = {z: i for i, z in enumerate(instruments)}, {z: i for i, z in enumerate(tids)}
+    for year in sorted(set(_[0:4] for _ in dates)):
+        year_df = store.read_by_conditions(
+            t_conditions=[("trade_date", ">=", max(bgn_date, year + "0101")), ("trade_date", "<=", year + "1231"),
+                          ("trade_date", "<", stp_date)],
+            t_value_columns=store_id_cols + value_cols,
+        )
+        year_df = year_df.loc[year_df["instrument"].isin(instruments) & year_df["tid"].isin(tids)]
+        d = np.searchsorted(dates, year_df["trade_date"].to_numpy(dtype=str))
+        i = year_df["instrument"].map(instrument_idx).to_numpy()
+        t = year_df["tid"].map(tid_idx).to_numpy()
+        values[d, i, t, :] = year_df[value_cols].to_numpy(dtype=np.float64)
+        present[d, i, t] = True
+        timestamp[d, i, t] = year_df["timestamp"].to_numpy(dtype=np.int64)
+        contract[d, i] = year_df["contract"].to_numpy(dtype=str)
+        print("... features cube of {} is built".format(year))
+    np.save(os.path.join(tmp_dir, "contract.npy"), contract)
+    np.save(os.path.join(tmp_dir, "source.npy"), np.array([bgn_date, stp_date, manifest_fingerprint(
+        research_features_and_return_dir, bgn_date, stp_date)], dtype=str))
+    values.flush()
+    present.flush()
+    timestamp.flush()
+    del values, present, timestamp
+
+    if os.path.exists(cube_dir):
+        os.replace(cube_dir, old_dir)
+    os.replace(tmp_dir, cube_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print("... features cube of {} dates x {} instruments x {} tids x {} columns is saved to {}".format(
+        shape[0], shape[1], shape[2], len(value_cols), cube_dir))
+    return 0
+
+
+def manifest_fingerprint(research_features_and_return_dir: str, bgn_date: str, stp_date: str) -> str:
+    manifest = CFeaturesManifest(os.path.join(research_features_and_return_dir, features_manifest_file))
+    return manifest.fingerprint(bgn_date, stp_date)
+
+
+class CFeaturesCube(object):
+    """
+    Features and return of [date, instrument, tid, column], as a dense float64 array memory mapped from
+    the files saved by build_features_cube. Cells of days not saved, like IM.CFE before 20220722, are NaN
+    and not present.
+
+    Selections by one date range and single instrument, tid or column are views of the mapped files, so
+    they are not copied, and all the processes reading the cube share the same pages. The cube is
+    pickled by its directory and mapped again when it is unpickled, so it can be passed to workers.
+
+    read_by_conditions takes the same arguments as CFeaturesStore.read_by_conditions, and returns the rows
+    present, in the order of the axes.
+
+    A warning is printed when the cube is opened if the manifest of save_dir no longer matches the one it was
+    built from, i.e. features are saved again after the cube is built, so build_features_cube must be run
+    again. Workers unpickling the cube do not check it again.
+    """
+
+    def __init__(self, save_dir: str, cube_name: str = features_cube_name):
+        self.m_cube_dir = os.path.join(save_dir, cube_name)
+        self._map()
+        self.check_source(save_dir)
+
+    def check_source(self, save_dir: str) -> bool:
+        """
+
+        :return: True if the features of the dates of the cube are not saved again after it was built
+        """
+        source_path = os.path.join(self.m_cube_dir, "source.npy")
+        if not os.path.exists(source_path):
+            print("... Warning! {} is built before its source is recorded, build it again".format(self.m_cube_dir))
+            return False
+        bgn_date, stp_date, fingerprint = np.load(source_path).tolist()
+        if manifest_fingerprint(save_dir, bgn_date, stp_date) != fingerprint:
+            print("... Warning! features of [{}, {}) are saved again after {} is built, build it again".format(
+                bgn_date, stp_date, self.m_cube_dir))
+            return False
+        return True
+
+    def _map(self):
+        def load(name: str, mmap_mode: str | None = None) -> np.ndarray:
+            return np.load(os.path.join(self.m_cube_dir, name + ".npy"), mmap_mode=mmap_mode)
+
+        self.m_dates, self.m_instruments, self.m_tids, self.m_columns = [
+            load(_) for _ in ["dates", "instruments", "tids", "columns"]]
+        self.m_instrument_idx = {z: i for i, z in enumerate(self.m_instruments.tolist())}
+        self.m_tid_idx = {z: i for i, z in enumerate(self.m_tids.tolist())}
+        self.m_column_idx = {z: i for i, z in enumerate(self.m_columns.tolist())}
+        self.m_values, self.m_present, self.m_timestamp = [load(_, "r") for _ in ["values", "present", "timestamp"]]
+        self.m_contract = load("contract")
+
+    def __getstate__(self):
+        return {"m_cube_dir": self.m_cube_dir}
+
+    def __setstate__(self, state):
+        self.m_cube_dir = state["m_cube_dir"]
+        self._map()
+
+    # --- index
+    @property
+    def dates(self) -> np.ndarray:
+        return self.m_dates
+
+    @property
+    def instruments(self) -> list[str]:
+        return self.m_instruments.tolist()
+
+    @property
+    def tids(self) -> list[str]:
+        return self.m_tids.tolist()
+
+    @property
+    def columns(self) -> list[str]:
+        return self.m_columns.tolist()
+
+    def date_slice(self, bgn_date: str | None = None, stp_date: str | None = None) -> slice:
+        """
+
+        :return: positions of the dates in [bgn_date, stp_date) on the date axis
+        """
+        bgn = 0 if bgn_date is None else int(np.searchsorted(self.m_dates, bgn_date, side="left"))
+        stp = len(self.m_dates) if stp_date is None else int(np.searchsorted(self.m_dates, stp_date, side="left"))
+        return slice(bgn, stp)
+
+    def instrument_index(self, instrument: str) -> int:
+        return self.m_instrument_idx[instrument]
+
+    def tid_index(self, tid: str) -> int:
+        return self.m_tid_idx[tid]
+
+    def column_index(self, column: str) -> int:
+        return self.m_column_idx[column]
+
+    # --- slice
+    def sel(self, bgn_date: str | None = None, stp_date: str | None = None,
+            instrument: str | None = None, tid: str | None = None, column: str | None = None) -> np.ndarray:
+        """
+
+        :return: view of the values in [bgn_date, stp_date), with the axis of each of instrument, tid and column
+                 which is given dropped, e.g. sel(bgn, stp, tid="T01", column="rtm") is [date, instrument]
+        """
+        return self.m_values[(
+            self.date_slice(bgn_date, stp_date),
+            slice(None) if instrument is None else self.instrument_index(instrument),
+            slice(None) if tid is None else self.tid_index(tid),
+            slice(None) if column is None else self.column_index(column),
+        )]
+
+    def present(self, bgn_date: str | None = None, stp_date: str | None = None) -> np.ndarray:
+        """
+
+        :return: view of [date, instrument, tid], True if the cell is saved
+        """
+        return self.m_present[self.date_slice(bgn_date, stp_date)]
+
+    def read_by_conditions(self, t_conditions: list[tuple[str, str, object]], t_value_columns: list[str] | None = None) -> pd.DataFrame:
+        """
+
+        :param t_conditions: [(column, op, value), ...], op is one of "=", "!=", "<", "<=", ">", ">=", all of them
+                             must hold
+        :param t_value_columns: columns to read, None to read all of them
+        :return: rows present, in the order of the date, instrument and tid axes
+        """
+        value_cols = store_id_cols + self.columns if t_value_columns is None else t_value_columns
+
+        # conditions on the axes select a block, the other ones are checked row by row
+        bgn, stp = 0, len(self.m_dates)
+        instrument_sel, tid_sel, row_conditions = slice(None), slice(None), []
+        for c, op, v in t_conditions:
+            if c == "trade_date" and op in [">=", ">", "=", "<", "<="]:
+                if op in [">=", ">", "="]:
+                    bgn = max(bgn, int(np.searchsorted(self.m_dates, v, side="right" if op == ">" else "left")))
+                if op in ["<", "<=", "="]:
+                    stp = min(stp, int(np.searchsorted(self.m_dates, v, side="left" if op == "<" else "right")))
+            elif c == "instrument" and op == "=" and isinstance(instrument_sel, slice):
+                instrument_sel = [self.m_instrument_idx[v]] if v in self.m_instrument_idx else []
+            elif c == "tid" and op == "=" and isinstance(tid_sel, slice):
+                tid_sel = [self.m_tid_idx[v]] if v in self.m_tid_idx else []
+            else:
+                row_conditions.append((c, op, v))
+        stp = max(bgn, stp)
+        instrument_ids = np.arange(len(self.m_instruments))[instrument_sel]
+        tid_ids = np.arange(len(self.m_tids))[tid_sel]
+
+        block = np.ix_(np.arange(bgn, stp), instrument_ids, tid_ids)
+        d, i, t = np.nonzero(self.m_present[block])
+        d, i, t = d + bgn, instrument_ids[i], tid_ids[t]
+        data = {
+            "trade_date": self.m_dates[d],
+            "instrument": self.m_instruments[i],
+            "contract": self.m_contract[d, i],
+            "tid": self.m_tids[t],
+            "timestamp": self.m_timestamp[d, i, t],
+        }
+        mask = np.ones(len(d), dtype=bool)
+        for c, op, v in row_conditions:
+            col = data[c] if c in data else self.m_values[d, i, t, self.m_column_idx[c]]
+            mask &= _ops[op](col, v)
+        value_col_ids = np.array([self.m_column_idx[c] for c in value_cols if c not in data], dtype=int)
+        d, i, t = d[mask][:, None], i[mask][:, None], t[mask][:, None]
+        values = self.m_values[d, i, t, value_col_ids[None, :]]
+        res = {c: data[c][mask] for c in value_cols if c in data}
+        res.update({c: values[:, k] for k, c in enumerate([_ for _ in value_cols if _ not in data])})
+        return pd.DataFrame(res)[value_cols]
+
+    def close(self):
+        pass
@@ -0,0 +1,248 @@
+"""
+Compiled kernels of the sort based factors and the Spearman
+correlations of features_vec. Each kernel
+walks the full day order once per checkpoint, keeping only the bars of the
+prefix, so no prefix order is ever materialized. Sorting is still done by
+numpy in features_vec, so ties are broken the same way as the numpy path.
+
+cache = True keeps the compiled machine code next to this file, so only
+the first process ever pays for the compilation.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+
+    jit_available = True
+except ImportError:
+    jit_available = False
+
+    def njit(*args, **kwargs):
+        # numba is not installed, kernels stay plain python and features_vec falls back to its numpy path
+        def decorator(fun):
+            return fun
+
+        return decorator
+
+
+@njit(cache=True, error_model="numpy")
+def _prefix(order_d: np.ndarray, bar_num: int, po: np.ndarray) -> int:
+    k = 0
+    for i in order_d:
+        if i < bar_num:
+            po[k] = i
+            k += 1
+    return k
+
+
+@njit(cache=True, error_model="numpy")
+def _nanmean_of(x: np.ndarray, po: np.ndarray, bgn: int, end: int) -> float:
+    s, c = 0.0, 0
+    for k in range(bgn, end):
+        v = x[po[k]]
+        if not np.isnan(v):
+            s += v
+            c += 1
+    return s / c if c > 0 else np.nan
+
+
+@njit(cache=True, error_model="numpy")
+def _smart_money_kernel(order: np.ndarray, volume: np.ndarray, amount: np.ndarray, vwap: np.ndarray,
+                        m01_return_cls: np.ndarray, vwap_cum: np.ndarray,
+                        n: np.ndarray, props: np.ndarray, ret_scale: float) -> np.ndarray:
+    days, bars = volume.shape
+    out = np.empty((2 * len(props), days, len(n)))
+    po, vol_cumsum = np.empty(bars, dtype=np.int64), np.empty(bars)
+    for d in range(days):
+        for j in range(len(n)):
+            bar_num = _prefix(order[d], n[j], po)
+            s = 0.0
+            for k in range(bar_num):
+                s += volume[d, po[k]]
+                vol_cumsum[k] = s
+            for p in range(len(props)):
+                volume_threshold = vol_cumsum[bar_num - 1] * props[p]
+                n_smart = 1
+                for k in range(bar_num):
+                    if vol_cumsum[k] < volume_threshold:
+                        n_smart += 1
+                smart_amount, smart_vwap, smart_ret = 0.0, 0.0, 0.0
+                for k in range(min(n_smart, bar_num)):
+                    a = amount[d, po[k]]
+                    smart_amount += a
+                    smart_vwap += vwap[d, po[k]] * a
+                    smart_ret += m01_return_cls[d, po[k]] * a
+                out[2 * p, d, j] = (smart_vwap / smart_amount / vwap_cum[d, bar_num - 1] - 1) * ret_scale
+                out[2 * p + 1, d, j] = smart_ret / smart_amount
+    return out
+
+
+@njit(cache=True, error_model="numpy")
+def _amplitude_kernel(order: np.ndarray, amplitude: np.ndarray, n: np.ndarray, props: np.ndarray) -> np.ndarray:
+    days, bars = amplitude.shape
+    out = np.empty((3 * len(props), days, len(n)))
+    po = np.empty(bars, dtype=np.int64)
+    for d in range(days):
+        for j in range(len(n)):
+            bar_num = _prefix(order[d], n[j], po)
+            for p in range(len(props)):
+                k = int(props[p] * bar_num)
+                vh = _nanmean_of(amplitude[d], po, 0, k)
+                vl = _nanmean_of(amplitude[d], po, bar_num - k, bar_num)
+                out[3 * p, d, j], out[3 * p + 1, d, j], out[3 * p + 2, d, j] = vh, vl, vh - vl
+    return out
+
+
+@njit(cache=True, error_model="numpy")
+def _extreme_return_kernel(m01_return_cls: np.ndarray, n: np.ndarray) -> np.ndarray:
+    days, bars = m01_return_cls.shape
+    out = np.empty((2, days, len(n)))
+    valid = np.empty(bars)
+    for d in range(days):
+        ret = m01_return_cls[d]
+        ret_min, ret_max, c, i = np.nan, np.nan, 0, 0
+        for j in range(len(n)):
+            while i < n[j]:
+                v = ret[i]
+                if not np.isnan(v):
+                    ret_min = v if np.isnan(ret_min) else min(ret_min, v)
+                    ret_max = v if np.isnan(ret_max) else max(ret_max, v)
+                    valid[c] = v
+                    c += 1
+                i += 1
+            if c == 0:
+                ret_median = np.nan
+            else:
+                s = np.sort(valid[0:c])
+                ret_median = s[c // 2] if c % 2 == 1 else (s[c // 2 - 1] + s[c // 2]) / 2
+            exr = ret_max if ret_max + ret_min > 2 * ret_median else ret_min
+            idx_exr = 0
+            for k in range(n[j]):
+                if ret[k] == exr:
+                    idx_exr = k
+                    break
+            out[0, d, j] = exr
+            out[1, d, j] = ret[idx_exr - 1] if idx_exr >= 1 else np.nan
+    return out
+
+
+@njit(cache=True, error_model="numpy")
+def _spearman_of_prefixes_kernel(x: np.ndarray, y: np.ndarray, n: np.ndarray) -> np.ndarray:
+    # ranks of the members are shifted by each new member, so all the prefixes cost O(bars ** 2) in total
+    days, bars = x.shape
+    out = np.empty((days, len(n)))
+    members, rank_x, rank_y = np.empty(bars, dtype=np.int64), np.empty(bars), np.empty(bars)
+    for d in range(days):
+        nobs, i = 0, 0
+        for j in range(len(n)):
+            while i < n[j]:
+                xi, yi = x[d, i], y[d, i]
+                if np.isfinite(xi) and np.isfinite(yi):
+                    rxi, ryi = 1.0, 1.0
+                    for m in range(nobs):
+                        xm, ym = x[d, members[m]], y[d, members[m]]
+                        if xm < xi:
+                            rxi += 1.0
+                        elif xm > xi:
+                            rank_x[m] += 1.0
+                        else:
+                            rxi += 0.5
+                            rank_x[m] += 0.5
+                        if ym < yi:
+                            ryi += 1.0
+                        elif ym > yi:
+                            rank_y[m] += 1.0
+                        else:
+                            ryi += 0.5
+                            rank_y[m] += 0.5
+                    members[nobs], rank_x[nobs], rank_y[nobs] = i, rxi, ryi
+                    nobs += 1
+                i += 1
+            mean = (nobs + 1) / 2
+            sxy, sxx, syy = 0.0, 0.0, 0.0
+            for m in range(nobs):
+                vx, vy = rank_x[m] - mean, rank_y[m] - mean
+                sxy, sxx, syy = sxy + vx * vy, sxx + vx * vx, syy + vy * vy
+            divisor = np.sqrt(sxx * syy)
+            out[d, j] = sxy / divisor if divisor != 0 else np.nan
+    return out
+
+
+@njit(cache=True, error_model="numpy")
+def _average_ranks(v: np.ndarray) -> np.ndarray:
+    order = np.argsort(v, kind="mergesort")
+    ranks, a, size = np.empty(len(v)), 0, len(v)
+    while a < size:
+        b = a
+        while (b + 1 < size) and (v[order[b + 1]] == v[order[a]]):
+            b += 1
+        for k in range(a, b + 1):
+            ranks[order[k]] = (a + b) / 2 + 1
+        a = b + 1
+    return ranks
+
+
+@njit(cache=True, error_model="numpy")
+def _spearman_of_heads_kernel(x: np.ndarray, y: np.ndarray, order: np.ndarray,
+                              n: np.ndarray, props: np.ndarray) -> np.ndarray:
+    # only the members of each head are gathered and ranked, instead of walking the whole day for each head
+    days, bars = x.shape
+    out = np.empty((days, len(n), len(props)))
+    po, hx, hy = np.empty(bars, dtype=np.int64), np.empty(bars), np.empty(bars)
+    for d in range(days):
+        for j in range(len(n)):
+            bar_num = _prefix(order[d], n[j], po)
+            for p in range(len(props)):
+                nobs = 0
+                for k in range(int(props[p] * bar_num)):
+                    xk, yk = x[d, po[k]], y[d, po[k]]
+                    if np.isfinite(xk) and np.isfinite(yk):
+                        hx[nobs], hy[nobs] = xk, yk
+                        nobs += 1
+                rank_x, rank_y = _average_ranks(hx[0:nobs]), _average_ranks(hy[0:nobs])
+                mean = (nobs + 1) / 2
+                sxy, sxx, syy = 0.0, 0.0, 0.0
+                for m in range(nobs):
+                    vx, vy = rank_x[m] - mean, rank_y[m] - mean
+                    sxy, sxx, syy = sxy + vx * vy, sxx + vx * vx, syy + vy * vy
+                divisor = np.sqrt(sxx * syy)
+                out[d, j, p] = sxy / divisor if divisor != 0 else np.nan
+    return out
+
+
+def smart_money_jit(order: np.ndarray, volume: np.ndarray, amount: np.ndarray, vwap: np.ndarray,
+                    m01_return_cls: np.ndarray, vwap_cum: np.ndarray, n: np.ndarray, ret_scale: int) -> dict[str, np.ndarray]:
+    out = _smart_money_kernel(order, volume, amount, vwap, m01_return_cls, vwap_cum,
+                              n.astype(np.int64), np.array([0.1, 0.2, 0.5]), float(ret_scale))
+    lbls = ["smart01", "smart01_ret", "smart02", "smart02_ret", "smart05", "smart05_ret"]
+    return dict(zip(lbls, out))
+
+
+def amplitude_jit(order: np.ndarray, amplitude: np.ndarray, n: np.ndarray) -> dict[str, np.ndarray]:
+    out = _amplitude_kernel(order, amplitude, n.astype(np.int64), np.array([0.1, 0.2, 0.5]))
+    lbls = ["vh01", "vl01", "vd01", "vh02", "vl02", "vd02", "vh05", "vl05", "vd05"]
+    return dict(zip(lbls, out))
+
+
+def spearman_of_heads_jit(x: np.ndarray, y: np.ndarray, order: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """
+
+    :param x: shape = (days, bars)
+    :param y: shape = (days, bars)
+    :param order: order of the full day, the heads of each prefix are its first 10%, 20% and 50% bars
+    :param n: checkpoints, i.e. number of bars in each prefix
+    :return: shape = (days, checkpoints, heads)
+    """
+    return _spearman_of_heads_kernel(x, y, order, n.astype(np.int64), np.array([0.1, 0.2, 0.5]))
+
+
+def spearman_of_prefixes_jit(x: np.ndarray, y: np.ndarray, n: np.ndarray) -> np.ndarray:
+    # same as rank_corr.spearman_of_subsets with the subsets x[:, 0:n], y[:, 0:n] for each n
+    return _spearman_of_prefixes_kernel(x, y, n.astype(np.int64))
+
+
+def extreme_return_jit(m01_return_cls: np.ndarray, n: np.ndarray) -> dict[str, np.ndarray]:
+    out = _extreme_return_kernel(m01_return_cls, n.astype(np.int64))
+    return {"exr": out[0], "exrb01": out[1]}
+
@@ -0,0 +1,91 @@
+import os
+import hashlib
+import datetime as dt
+import pandas as pd
+
+# manifests are saved in research_features_and_return_dir:
+# features_manifest_file records the csv files saved by dp_00_features_and_return.cal_features_and_return,
+# sqlite3_manifest_file records the records of features_manifest_file loaded by dp_01_convert_csv_to_sqlite3
+features_manifest_file = "features_and_return.manifest.csv"
+sqlite3_manifest_file = "features_and_return.db.manifest.csv"
+manifest_cols = ["trade_date", "instrument", "fingerprint", "kernel_version", "rows", "saved_at"]
+
+
+def fingerprint_of_inputs(m01_df: pd.DataFrame, contract: str, pre_settle: float, pre_spot_close: float,
+                          sub_win_width: int, tot_bar_num: int) -> str:
+    """
+
+    :param m01_df: minute bars of the major contract, exactly as they are passed to the kernels
+    :param contract:
+    :param pre_settle:
+    :param pre_spot_close:
+    :param sub_win_width:
+    :param tot_bar_num:
+    :return: a hash of everything the features and return of one day and one instrument are calculated from,
+             it does not depend on the process or the session, so it can be saved and compared later
+    """
+    h = hashlib.sha1()
+    h.update("{}|{!r}|{!r}|{}|{}".format(contract, float(pre_settle), float(pre_spot_close),
+                                         sub_win_width, tot_bar_num).encode())
+    h.update(pd.util.hash_pandas_object(m01_df, index=False).to_numpy().tobytes())
+    return h.hexdigest()[0:16]
+
+
+class CFeaturesManifest(object):
+    """
+    (trade_date, instrument) -> (fingerprint, kernel_version, rows, saved_at), saved as a csv file.
+    It is read and written by the main process only, workers return their records to it.
+    """
+
+    def __init__(self, manifest_path: str):
+        self.m_path = manifest_path
+        self.m_records: dict[tuple[str, str], tuple[str, str, int, str]] = {}
+        if os.path.exists(manifest_path):
+            manifest_df = pd.read_csv(manifest_path, dtype=str)
+            for trade_date, instrument, fingerprint, kernel_version, rows, saved_at in manifest_df[manifest_cols].itertuples(index=False):
+                self.m_records[(trade_date, instrument)] = (fingerprint, kernel_version, int(rows), saved_at)
+
+    def get(self, trade_date: str, instrument: str) -> tuple[str, str, int, str] | None:
+        return self.m_records.get((trade_date, instrument))
+
+    def is_up_to_date(self, trade_date: str, instrument: str, fingerprint: str, kernel_version: str) -> bool:
+        record = self.get(trade_date, instrument)
+        return (record is not None) and (record[0] == fingerprint) and (record[1] == kernel_version)
+
+    def update(self, records: list[tuple[str, str, str, str, int, str]]):
+        """
+
+        :param records: [(trade_date, instrument, fingerprint, kernel_version, rows, saved_at), ...]
+        """
+        for trade_date, instrument, fingerprint, kernel_version, rows, saved_at in records:
+            self.m_records[(trade_date, instrument)] = (fingerprint, kernel_version, rows, saved_at)
+
+    def remove(self, trade_date: str, instrument: str):
+        self.m_records.pop((trade_date, instrument), None)
+
+    def clear(self):
+        self.m_records.clear()
+
+    def fingerprint(self, bgn_date: str, stp_date: str) -> str:
+        """
+
+        :return: a hash of the records of the days in [bgn_date, stp_date), it changes whenever any of these
+                 days is saved again, added or removed
+        """
+        h = hashlib.sha1()
+        for (trade_date, instrument), record in sorted(self.m_records.items()):
+            if bgn_date <= trade_date < stp_date:
+                h.update("{}|{}|{}|{}|{}|{}\n".format(trade_date, instrument, *record).encode())
+        return h.hexdigest()[0:16]
+
+    def save(self):
+        manifest_df = pd.DataFrame([k + v for k, v in sorted(self.m_records.items())], columns=manifest_cols)
+        # written to a temporary file first, so an interrupted run never leaves a broken manifest
+        tmp_path = self.m_path + ".tmp"
+        manifest_df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.m_path)
+        return 0
+
+
+def now_label() -> str:
+    return dt.datetime.now().strftime("%Y%m%d %H:%M:%S.%f")
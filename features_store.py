@@ -0,0 +1,172 @@
+import os
+import shutil
+import operator
+import itertools as ittl
+import numpy as np
+import pandas as pd
+
+features_store_name = "features_and_return.store"
+store_id_cols = ["trade_date", "instrument", "contract", "tid", "timestamp"]
+_ops = {"=": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class CFeaturesStore(object):
+    """
+    Features and return saved by columns, in partitions of {year}/{instrument}, one .npy file for each
+    column of each partition, float64 are saved exactly. A read loads only the columns it needs, from
+    the partitions its conditions on trade_date and instrument do not exclude.
+
+    read_by_conditions takes the same arguments as the CManagerLibReader of features_and_return.db,
+    so the stages reading features and return use either of them in the same way.
+
+    Partitions are rewritten as a whole, by one process at a time. Reading is safe from many processes
+    as long as no partition is being written.
+    """
+
+    def __init__(self, save_dir: str, store_name: str = features_store_name):
+        self.m_store_dir = os.path.join(save_dir, store_name)
+        self.m_dates_cache: dict[tuple[str, str], set[str]] = {}
+
+    # --- layout
+    def _partition_dir(self, year: str, instrument: str) -> str:
+        return os.path.join(self.m_store_dir, year, instrument)
+
+    def _partitions(self, bgn_year: str | None, end_year: str | None, instrument: str | None) -> list[tuple[str, str]]:
+        if not os.path.exists(self.m_store_dir):
+            return []
+        res = []
+        for year in sorted(os.listdir(self.m_store_dir)):
+            if (bgn_year is not None and year < bgn_year) or (end_year is not None and year > end_year):
+                continue
+            for partition_instrument in sorted(os.listdir(os.path.join(self.m_store_dir, year))):
+                if partition_instrument.endswith((".tmp", ".old")):
+                    continue
+                if instrument is None or partition_instrument == instrument:
+                    res.append((year, partition_instrument))
+        return res
+
+    def _columns_of(self, year: str, instrument: str) -> list[str]:
+        return np.load(os.path.join(self._partition_dir(year, instrument), "_columns.npy")).tolist()
+
+    def _load(self, year: str, instrument: str, columns: list[str]) -> dict[str, np.ndarray]:
+        partition_dir = self._partition_dir(year, instrument)
+        return {c: np.load(os.path.join(partition_dir, c + ".npy")) for c in columns}
+
+    def _save(self, year: str, instrument: str, partition_df: pd.DataFrame):
+        # written to a temporary directory and swapped, so a partition is never read half written
+        partition_dir = self._partition_dir(year, instrument)
+        tmp_dir, old_dir = partition_dir + ".tmp", partition_dir + ".old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        columns = [c for c in partition_df.columns if c != "instrument"]
+        for c in columns:
+            if c in ["trade_date", "contract", "tid"]:
+                values = partition_df[c].to_numpy(dtype=str)
+            elif c == "timestamp":
+                values = partition_df[c].to_numpy(dtype=np.int64)
+            else:
+                values = partition_df[c].to_numpy(dtype=np.float64)
+            np.save(os.path.join(tmp_dir, c + ".npy"), values)
+        np.save(os.path.join(tmp_dir, "_columns.npy"), np.array(columns, dtype=str))
+        if os.path.exists(partition_dir):
+            os.replace(partition_dir, old_dir)
+        os.replace(tmp_dir, partition_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    # --- write
+    def write(self, frames: list[tuple[str, str, pd.DataFrame]]):
+        """
+
+        :param frames: [(trade_date, instrument, features_and_ret_df), ...], features_and_ret_df as returned by the
+                       kernels, days already saved are replaced
+        """
+        def partition_key(z):
+            return z[0][0:4], z[1]
+
+        for (year, instrument), partition_frames in ittl.groupby(sorted(frames, key=partition_key), key=partition_key):
+            new_df = pd.concat([df.assign(trade_date=trade_date) for trade_date, _, df in partition_frames], ignore_index=True)
+            if os.path.exists(self._partition_dir(year, instrument)):
+                saved_df = pd.DataFrame(self._load(year, instrument, self._columns_of(year, instrument)))
+                saved_df = saved_df.loc[~saved_df["trade_date"].isin(new_df["trade_date"])]
+                new_df = pd.concat([saved_df, new_df], ignore_index=True)
+            value_cols = [c for c in new_df.columns if c not in store_id_cols]
+            partition_df = new_df[[c for c in store_id_cols if c in new_df.columns] + value_cols]
+            self._save(year, instrument, partition_df.sort_values(by=["trade_date", "timestamp"], kind="stable"))
+            self.m_dates_cache.pop((year, instrument), None)
+        return 0
+
+    # --- read
+    def has_day(self, trade_date: str, instrument: str) -> bool:
+        year = trade_date[0:4]
+        if (year, instrument) not in self.m_dates_cache:
+            if os.path.exists(self._partition_dir(year, instrument)):
+                self.m_dates_cache[(year, instrument)] = set(self._load(year, instrument, ["trade_date"])["trade_date"])
+            else:
+                self.m_dates_cache[(year, instrument)] = set()
+        return trade_date in self.m_dates_cache[(year, instrument)]
+
+    def value_columns(self) -> list[str]:
+        """
+
+        :return: the value columns of all the partitions, in the order they are saved
+        """
+        res = {}
+        for year, instrument in self._partitions(None, None, None):
+            res.update(dict.fromkeys(c for c in self._columns_of(year, instrument) if c not in store_id_cols))
+        return list(res)
+
+    def read_by_conditions(self, t_conditions: list[tuple[str, str, object]], t_value_columns: list[str] | None = None) -> pd.DataFrame:
+        """
+
+        :param t_conditions: [(column, op, value), ...], op is one of "=", "!=", "<", "<=", ">", ">=", all of them
+                             must hold
+        :param t_value_columns: columns to read, None to read all of them
+        :return: rows sorted by trade_date, instrument and timestamp
+        """
+        bgn_year, end_year, instrument = None, None, None
+        for c, op, v in t_conditions:
+            if c == "trade_date" and op in [">", ">=", "="]:
+                bgn_year = max(bgn_year or v[0:4], v[0:4])
+            if c == "trade_date" and op in ["<", "<=", "="]:
+                end_year = min(end_year or v[0:4], v[0:4])
+            if c == "instrument" and op == "=":
+                instrument = v
+
+        dfs = []
+        for year, partition_instrument in self._partitions(bgn_year, end_year, instrument):
+            partition_cols = self._columns_of(year, partition_instrument)
+            value_cols = (["instrument"] + partition_cols) if t_value_columns is None else t_value_columns
+            if missing_cols := set(value_cols).difference(partition_cols + ["instrument"]):
+                raise KeyError("columns {} are not saved in the features store".format(sorted(missing_cols)))
+            load_cols = [c for c in dict.fromkeys(value_cols + [c for c, _, _ in t_conditions]) if c != "instrument"]
+            data = self._load(year, partition_instrument, load_cols)
+            data["instrument"] = np.full(len(data[load_cols[0]]), partition_instrument)
+            mask = np.ones(len(data["instrument"]), dtype=bool)
+            for c, op, v in t_conditions:
+                mask &= _ops[op](data[c], v)
+            dfs.append(pd.DataFrame({c: data[c][mask] for c in value_cols}))
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=t_value_columns)
+        res_df = pd.concat(dfs, ignore_index=True)
+        if "trade_date" in res_df.columns:
+            res_df = res_df.sort_values(by="trade_date", kind="stable", ignore_index=True)
+        return res_df
+
+    def read_days(self, trade_dates: list[str], instrument: str) -> dict[str, pd.DataFrame]:
+        """
+
+        :param trade_dates:
+        :param instrument:
+        :return: {trade_date: features_and_ret_df} of the days saved, in the layout returned by the kernels
+        """
+        src_df = self.read_by_conditions(
+            t_conditions=[
+                ("trade_date", ">=", min(trade_dates)),
+                ("trade_date", "<=", max(trade_dates)),
+                ("instrument", "=", instrument),
+            ])
+        return {trade_date: day_df.drop(columns="trade_date").reset_index(drop=True)
+                for trade_date, day_df in src_df.groupby(by="trade_date") if trade_date in trade_dates}
+
+    def close(self):
+        pass
@@ -0,0 +1,212 @@
+import bisect
+import heapq
+import numpy as np
+import pandas as pd
+from project_config import factors
+from rank_corr import CExpandingSpearman
+from features_vec import _mtm_vol_adj_and_skewness, _up_and_dn
+from features_vec import _smart_money, _amplitude, _volume_top_ret, _volume_top_corr
+
+
+class CStreamingFeatures(object):
+    """
+    Streaming counterpart of cal_features_and_return_one_day for one
+    instrument and one day. Minute bars are fed one at a time with
+    update(); when a bar completes a checkpoint window, the factor row of
+    that checkpoint is returned.
+
+    Costs with n bars fed so far:
+    1.  update() is O(log n) for the running sums, extremes, the median of
+        m01_return_cls and the bar before the extreme return, plus O(n)
+        for inserting the bar into the orders by smart_idx, vwap and
+        volume, which are python lists kept sorted by bisect.insort.
+    2.  a checkpoint reads the running state for the moments, gu/gd, exr
+        and exrb01, and up/dn only depends on the first 45 bars, so it is
+        not calculated again after them. The ranks for cvp/cvr are updated with the new
+        bars only, by CExpandingSpearman.
+    3.  smart money, amplitude and the volume top factors are calculated
+        again from the whole prefix in the sorted orders, so a checkpoint
+        is O(n), not constant. With the default windows there are only 7
+        checkpoints of at most 210 bars in a day.
+
+    Factors agree with the vectorized kernel for the same prefix within
+    rtol = 1e-8, atol = 1e-10, ties are kept in bar order as it does, so
+    the vtop factors agree too, unlike with the pandas kernel. Two columns
+    differ by construction:
+    1.  rtm is NaN, since it needs the vwap of the last bar of the day.
+    2.  timestamp is the last bar's timestamp + bar_seconds, the batch
+        kernels use the timestamp of the next bar, which differs at the
+        lunch break.
+    """
+
+    def __init__(self, instrument: str, contract: str, contract_multiplier: int,
+                 pre_settle: float, pre_spot_close: float,
+                 sub_win_width: int = 30, tot_bar_num: int = 240,
+                 amount_scale: float = 1e4, ret_scale: int = 100, bar_seconds: int = 60):
+        self.m_instrument, self.m_contract = instrument, contract
+        self.m_contract_multiplier = contract_multiplier
+        self.m_pre_settle, self.m_pre_spot_close = pre_settle, pre_spot_close
+        self.m_sub_win_width, self.m_tot_bar_num = sub_win_width, tot_bar_num
+        self.m_amount_scale, self.m_ret_scale, self.m_bar_seconds = amount_scale, ret_scale, bar_seconds
+        self.m_checkpoints = set(range(sub_win_width, tot_bar_num, sub_win_width))
+
+        self.m_size = 0
+        self.m_bars = {k: np.full((1, tot_bar_num), np.nan) for k in [
+            "high", "low", "close", "volume", "amount", "daily_high", "daily_low",
+            "vwap", "vwap_cum", "m01_return", "m01_return_cls", "smart_idx", "amplitude"]}
+        self.m_timestamp = 0
+        self.m_prev_day_close, self.m_this_day_open = np.nan, np.nan
+        self.m_cum_amount, self.m_cum_volume = 0.0, 0.0
+
+        # running sums of m01_return, shifted by its first valid value
+        self.m_shift, self.m_cnt, self.m_s1, self.m_s2, self.m_s3 = np.nan, 0, 0.0, 0.0, 0.0
+        # running sums of gu and gd
+        self.m_g = {"gu": [0, 0.0, 0.0], "gd": [0, 0.0, 0.0]}
+        # extremes of m01_return_cls with the index of their first bar, and the two halves
+        # for its median, a max heap of the lower half as negative values and a min heap
+        self.m_ret_min, self.m_ret_max, self.m_ret_min_idx, self.m_ret_max_idx = np.nan, np.nan, 0, 0
+        self.m_ret_lo, self.m_ret_hi = [], []
+        self.m_up_dn = None
+
+        # descending orders as (-value, bar index), NaN are kept apart and go last
+        self.m_orders = {k: ([], []) for k in ["smart_idx", "vwap", "volume"]}
+        self.m_cv_engine = CExpandingSpearman(shape=(2, 1), capacity=tot_bar_num)
+        self.m_cv_size = 0
+
+    def _insert_order(self, key: str, value: float, i: int):
+        sorted_pairs, nan_idx = self.m_orders[key]
+        if np.isnan(value):
+            nan_idx.append(i)
+        else:
+            bisect.insort(sorted_pairs, (-value, i))
+
+    def _prefix_order(self, key: str) -> np.ndarray:
+        sorted_pairs, nan_idx = self.m_orders[key]
+        return np.array([i for _, i in sorted_pairs] + nan_idx, dtype=int)[None, :]
+
+    def update(self, bar: dict) -> pd.DataFrame | None:
+        """
+
+        :param bar: one minute bar with the same fields as the rows of m01 in cal_features_and_return_one_day
+        :return: factors of the checkpoint completed by this bar, or None
+        """
+        i, b = self.m_size, self.m_bars
+        if i >= self.m_tot_bar_num:
+            raise ValueError("... more than {} bars are fed into CStreamingFeatures".format(self.m_tot_bar_num))
+        if i == 0:
+            self.m_prev_day_close, self.m_this_day_open = bar["preclose"], bar["daily_open"]
+        for k in ["high", "low", "close", "volume", "amount", "daily_high", "daily_low"]:
+            b[k][0, i] = bar[k]
+        self.m_timestamp = bar["timestamp"]
+
+        # intermediary variables
+        volume, amount = b["volume"][0, i], b["amount"][0, i]
+        self.m_cum_amount, self.m_cum_volume = self.m_cum_amount + amount, self.m_cum_volume + volume
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vwap = amount / volume / self.m_contract_multiplier * self.m_amount_scale
+            vwap_cum = np.float64(self.m_cum_amount) / self.m_cum_volume / self.m_contract_multiplier * self.m_amount_scale
+            prev_vwap = b["vwap"][0, i - 1] if i > 0 else np.nan
+            prev_close = b["close"][0, i - 1] if i > 0 else np.nan
+            vwap = prev_vwap if np.isnan(vwap) else vwap
+            b["vwap"][0, i] = vwap
+            b["vwap_cum"][0, i] = b["vwap_cum"][0, i - 1] if (np.isnan(vwap_cum) and i > 0) else vwap_cum
+            b["m01_return"][0, i] = ret = (vwap / (self.m_pre_settle if np.isnan(prev_vwap) else prev_vwap) - 1) * self.m_ret_scale
+            b["m01_return_cls"][0, i] = ret_cls = (b["close"][0, i] / (self.m_prev_day_close if np.isnan(prev_close) else prev_close) - 1) * self.m_ret_scale
+            b["smart_idx"][0, i] = smart_idx = np.abs(ret_cls) / np.sqrt(volume)
+            b["amplitude"][0, i] = (b["high"][0, i] / b["low"][0, i] - 1) * self.m_ret_scale
+
+        # running states
+        if not np.isnan(ret):
+            if np.isnan(self.m_shift):
+                self.m_shift = ret
+            y = ret - self.m_shift
+            self.m_cnt, self.m_s1, self.m_s2, self.m_s3 = self.m_cnt + 1, self.m_s1 + y, self.m_s2 + y * y, self.m_s3 + y * y * y
+        for lbl, sel in [("gu", ret_cls > 0), ("gd", ret_cls < 0)]:
+            if sel:
+                g = self.m_g[lbl]
+                g[0], g[1], g[2] = g[0] + 1, g[1] + abs(ret_cls), g[2] + abs(ret_cls) * i
+        if not np.isnan(ret_cls):
+            if not ret_cls >= self.m_ret_min:
+                self.m_ret_min, self.m_ret_min_idx = ret_cls, i
+            if not ret_cls <= self.m_ret_max:
+                self.m_ret_max, self.m_ret_max_idx = ret_cls, i
+            heapq.heappush(self.m_ret_hi, -heapq.heappushpop(self.m_ret_lo, -ret_cls))
+            if len(self.m_ret_hi) > len(self.m_ret_lo):
+                heapq.heappush(self.m_ret_lo, -heapq.heappop(self.m_ret_hi))
+        self._insert_order("smart_idx", smart_idx, i)
+        self._insert_order("vwap", vwap, i)
+        self._insert_order("volume", volume, i)
+
+        self.m_size = i + 1
+        if self.m_size in self.m_checkpoints:
+            return self._checkpoint()
+        return None
+
+    def _checkpoint(self) -> pd.DataFrame:
+        n, b, ret_scale = self.m_size, self.m_bars, self.m_ret_scale
+        norm_scale = np.sqrt(n)
+        res = {
+            "basis": (self.m_pre_settle / self.m_pre_spot_close - 1) * ret_scale,
+            "csr": (self.m_prev_day_close / self.m_pre_settle - 1) * ret_scale,
+            "onr": (self.m_this_day_open / self.m_prev_day_close - 1) * ret_scale,
+            "rtm": np.nan,
+        }
+        for lbl, k in [("vwap_ret", "vwap"), ("vwap_cum_ret", "vwap_cum"), ("hgh_ret", "daily_high"), ("low_ret", "daily_low")]:
+            res[lbl] = (b[k][0, n - 1] / self.m_this_day_open - 1) / norm_scale * ret_scale
+
+        mtm_vol_adj, skewness = _mtm_vol_adj_and_skewness(
+            np.array(self.m_cnt), np.array(self.m_s1), np.array(self.m_s2), np.array(self.m_s3),
+            0 if np.isnan(self.m_shift) else self.m_shift)
+        res["mtm_vol_adj"], res["skewness"] = float(mtm_vol_adj), float(skewness)
+
+        for lbl, (cnt, wgt_sum, idx_sum) in self.m_g.items():
+            res[lbl] = idx_sum / wgt_sum if cnt > 0 else 0
+        res["g_tau"] = res["gu"] - res["gd"]
+        res["g_tau_abs"] = abs(res["g_tau"])
+
+        # the 5, 10 and 15 minute bars of up/dn are all within the first 45 bars, so it is kept after them
+        if self.m_up_dn is None:
+            up, dn = _up_and_dn(b["high"][:, 0:n], b["low"][:, 0:n], np.array([n]))
+            res["up"], res["dn"] = int(up[0, 0]), int(dn[0, 0])
+            if n >= 45:
+                self.m_up_dn = res["up"], res["dn"]
+        else:
+            res["up"], res["dn"] = self.m_up_dn
+
+        # as _extreme_return in features_vec, from the running extremes and median
+        lo, hi = self.m_ret_lo, self.m_ret_hi
+        if len(lo) == 0:
+            ret_median = np.nan
+        else:
+            ret_median = -lo[0] if len(lo) > len(hi) else (-lo[0] + hi[0]) / 2
+        if self.m_ret_max + self.m_ret_min > 2 * ret_median:
+            res["exr"], exr_idx = self.m_ret_max, self.m_ret_max_idx
+        else:
+            res["exr"], exr_idx = self.m_ret_min, self.m_ret_min_idx
+        res["exrb01"] = b["m01_return_cls"][0, exr_idx - 1] if exr_idx >= 1 else np.nan
+
+        volume_order = self._prefix_order("volume")
+        for res_t in [
+            _smart_money(self._prefix_order("smart_idx"), b["volume"], b["amount"], b["vwap"], b["m01_return_cls"],
+                         b["vwap_cum"][:, n - 1], ret_scale),
+            _amplitude(self._prefix_order("vwap"), b["amplitude"]),
+            _volume_top_ret(volume_order, b["m01_return"]),
+            _volume_top_corr(volume_order, b["vwap"], b["m01_return"], b["volume"]),
+        ]:
+            res.update({lbl: float(val[0]) for lbl, val in res_t.items()})
+
+        n0 = self.m_cv_size
+        cv_x = np.stack([b["vwap"][:, n0:n], b["m01_return"][:, n0:n]])
+        cv_y = np.stack([b["volume"][:, n0:n], b["volume"][:, n0:n]])
+        res["cvp"], res["cvr"] = self.m_cv_engine.update(cv_x, cv_y)[:, 0]
+        self.m_cv_size = n
+
+        t = n // self.m_sub_win_width
+        res_df = pd.DataFrame({
+            "instrument": self.m_instrument,
+            "contract": self.m_contract,
+            "tid": "T{:02d}".format(t),
+            "timestamp": self.m_timestamp + self.m_bar_seconds,
+            **{lbl: res[lbl] for lbl in factors + ["rtm"]},
+        }, index=[t])
+        return res_df
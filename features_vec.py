@@ -0,0 +1,483 @@
+import numpy as np
+import pandas as pd
+from project_config import factors
+from rank_corr import spearman_of_heads, spearman_of_subsets
+from xfuns import aggregate_fixed_grid, check_m01_bars
+from features_jit import jit_available, smart_money_jit, amplitude_jit, extreme_return_jit
+from features_jit import spearman_of_heads_jit, spearman_of_prefixes_jit
+
+vec_bar_cols = ["open", "high", "low", "close", "volume", "amount",
+                "daily_open", "daily_high", "daily_low", "preclose", "timestamp"]
+
+
+def _ffill(x: np.ndarray) -> np.ndarray:
+    idx = np.where(np.isnan(x), 0, np.arange(x.shape[-1]))
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    return np.take_along_axis(x, idx, axis=-1)
+
+
+def _shift(x: np.ndarray, fill: np.ndarray) -> np.ndarray:
+    # same as pd.Series.shift(1).fillna(fill), fill is one value per day
+    y = np.empty_like(x)
+    y[:, 0] = fill
+    y[:, 1:] = x[:, :-1]
+    return np.where(np.isnan(y), fill[:, None], y)
+
+
+def _nanmean(x: np.ndarray) -> np.ndarray:
+    valid = ~np.isnan(x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(valid, x, 0).sum(axis=-1) / valid.sum(axis=-1)
+
+
+def _prefix_orders(order: np.ndarray, n: int) -> np.ndarray:
+    # bars before n keep their relative position in the full day order, so
+    # the order of a prefix is the full order with bars >= n filtered out
+    return order[order < n].reshape(order.shape[0], n)
+
+
+def _prefix_positions(order: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """
+
+    :param order: (days, bars), order of the full day
+    :param n: checkpoints, i.e. number of bars in each prefix
+    :return: position of each bar in the order of each prefix, shape = (days, bars, checkpoints),
+             bars >= n are given the position bars, i.e. after all the bars of the prefix
+    """
+    in_prefix = order[..., None] < n
+    sorted_pos = np.where(in_prefix, np.cumsum(in_prefix, axis=1) - 1, order.shape[1])
+    return np.take_along_axis(sorted_pos, np.argsort(order, axis=-1)[..., None], axis=1)
+
+
+def _desc_order(x: np.ndarray) -> np.ndarray:
+    # descending, NaN last, ties in bar order, i.e. what pandas gives with kind="stable"
+    return np.argsort(-x, axis=-1, kind="stable")
+
+
+def _prefix_power_sums(x: np.ndarray, n: np.ndarray) -> tuple[np.ndarray, ...]:
+    """
+
+    :param x: (days, bars)
+    :param n: checkpoints, i.e. number of bars in each prefix
+    :return: count, sums of the 1st, 2nd and 3rd powers of x - shift in each prefix, shape = (days, checkpoints),
+             and the shift of each day, which only keeps the sums away from cancellation
+    """
+    valid = ~np.isnan(x)
+    with np.errstate(invalid="ignore"):
+        shift = np.nanmean(np.where(valid, x, np.nan), axis=-1, keepdims=True)
+    y = np.where(valid, x - shift, 0)
+    cnt = np.cumsum(valid, axis=-1)[:, n - 1]
+    s1 = np.cumsum(y, axis=-1)[:, n - 1]
+    s2 = np.cumsum(y * y, axis=-1)[:, n - 1]
+    s3 = np.cumsum(y * y * y, axis=-1)[:, n - 1]
+    return cnt, s1, s2, s3, shift
+
+
+def _mtm_vol_adj_and_skewness(cnt, s1, s2, s3, shift) -> tuple[np.ndarray, np.ndarray]:
+    # mean / std and skewness, same as pd.Series.mean() / pd.Series.std() and pd.Series.skew()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = s1 / cnt
+        m2 = np.maximum(s2 - s1 * mu, 0)
+        m3 = s3 - 3 * mu * s2 + 2 * mu * mu * s1
+        mtm_vol_adj = np.where(cnt > 1, (mu + shift) / np.sqrt(m2 / (cnt - 1)), np.nan)
+        m2 = np.where(np.abs(m2) < 1e-14, 0, m2)
+        m3 = np.where(np.abs(m3) < 1e-14, 0, m3)
+        skewness = (cnt * (cnt - 1) ** 0.5 / (cnt - 2)) * (m3 / m2 ** 1.5)
+    return mtm_vol_adj, np.where(cnt < 3, np.nan, np.where(m2 == 0, 0, skewness))
+
+
+def _up_and_dn(high: np.ndarray, low: np.ndarray, n: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    up, dn = np.zeros((high.shape[0], len(n)), dtype=int), np.zeros((high.shape[0], len(n)), dtype=int)
+    m_aggs = aggregate_fixed_grid({"high": high[:, 0:45], "low": low[:, 0:45]}, widths=(5, 10, 15))
+    for width, m_agg in m_aggs.items():
+        if m_agg["low"].shape[-1] < 3:
+            continue
+        agg_low, agg_high = m_agg["low"], m_agg["high"]
+        is_up = (agg_low[:, 0] < agg_low[:, 1]) & (agg_low[:, 1] < agg_low[:, 2])
+        is_dn = (agg_high[:, 0] > agg_high[:, 1]) & (agg_high[:, 1] > agg_high[:, 2])
+        use = n >= 3 * width  # wider bars override narrower ones, as in the pandas kernel
+        up[:, use], dn[:, use] = is_up[:, None], is_dn[:, None]
+    return up, dn
+
+
+def _top_bars(bar_num: int) -> dict[str, int]:
+    return {"01": int(0.1 * bar_num), "02": int(0.2 * bar_num), "05": int(0.5 * bar_num)}
+
+
+def _smart_money(po: np.ndarray, volume: np.ndarray, amount: np.ndarray, vwap: np.ndarray,
+                 m01_return_cls: np.ndarray, vwap_cum_last: np.ndarray, ret_scale: int) -> dict[str, np.ndarray]:
+    # kyzq: smart money, po is the prefix ordered by smart_idx
+    res = {}
+    vol_cumsum = np.cumsum(np.take_along_axis(volume, po, axis=-1), axis=-1)
+    sorted_amount = np.take_along_axis(amount, po, axis=-1)
+    sorted_vwap = np.take_along_axis(vwap, po, axis=-1)
+    sorted_ret = np.take_along_axis(m01_return_cls, po, axis=-1)
+    for threshold_prop, _id in zip([0.1, 0.2, 0.5], ["01", "02", "05"]):
+        volume_threshold = vol_cumsum[:, -1:] * threshold_prop
+        n_smart = (vol_cumsum < volume_threshold).sum(axis=-1, keepdims=True) + 1
+        is_smart = np.arange(po.shape[1]) < n_smart
+        smart_amount = np.where(is_smart, sorted_amount, 0).sum(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            smart_vwap = np.where(is_smart, sorted_vwap * sorted_amount, 0).sum(axis=-1) / smart_amount
+            smart_ret = np.where(is_smart, sorted_ret * sorted_amount, 0).sum(axis=-1) / smart_amount
+        res["smart" + _id] = (smart_vwap / vwap_cum_last - 1) * ret_scale
+        res["smart" + _id + "_ret"] = smart_ret
+    return res
+
+
+def _amplitude(po: np.ndarray, amplitude: np.ndarray) -> dict[str, np.ndarray]:
+    # kyzq: amplitude, po is the prefix ordered by vwap
+    res, bar_num = {}, po.shape[1]
+    sorted_amplitude = np.take_along_axis(amplitude, po, axis=-1)
+    for _id, k in _top_bars(bar_num).items():
+        res["vh" + _id] = _nanmean(sorted_amplitude[:, 0:k])
+        res["vl" + _id] = _nanmean(sorted_amplitude[:, bar_num - k:])
+        res["vd" + _id] = res["vh" + _id] - res["vl" + _id]
+    return res
+
+
+def _extreme_return(ret_before_t: np.ndarray, ret_median: np.ndarray,
+                    ret_min: np.ndarray, ret_max: np.ndarray) -> dict[str, np.ndarray]:
+    # kyzq: extremely return
+    exr = np.where(ret_max + ret_min > 2 * ret_median, ret_max, ret_min)
+    idx_exr = np.argmax(ret_before_t == exr[:, None], axis=-1)
+    exrb01 = np.where(idx_exr >= 1, ret_before_t[np.arange(len(exr)), idx_exr - 1], np.nan)
+    return {"exr": exr, "exrb01": exrb01}
+
+
+def _volume_top_ret(po: np.ndarray, m01_return: np.ndarray) -> dict[str, np.ndarray]:
+    # old style alphas, po is the prefix ordered by volume
+    res, top_bars = {}, _top_bars(po.shape[1])
+    sorted_ret = np.take_along_axis(m01_return, po, axis=-1)
+    res["vtop01_ret"] = _nanmean(sorted_ret[:, 0:top_bars["01"]])
+    res["vtop02_ret"] = _nanmean(sorted_ret[:, top_bars["01"]:top_bars["02"]])
+    res["vtop05_ret"] = _nanmean(sorted_ret[:, top_bars["02"]:top_bars["05"]])
+    return res
+
+
+def _volume_top_corr(po: np.ndarray, vwap: np.ndarray, m01_return: np.ndarray, volume: np.ndarray) -> dict[str, np.ndarray]:
+    # old style alphas, po is the prefix ordered by volume
+    res, top_bars = {}, _top_bars(po.shape[1])
+    sorted_vwap = np.take_along_axis(vwap, po, axis=-1)
+    sorted_ret = np.take_along_axis(m01_return, po, axis=-1)
+    sorted_volume = np.take_along_axis(volume, po, axis=-1)
+    vtop_corr = spearman_of_heads(
+        np.stack([sorted_vwap, sorted_ret]), np.stack([sorted_volume, sorted_volume]), list(top_bars.values()))
+    for _id, corr in zip(top_bars, vtop_corr):
+        res["vtop" + _id + "_cvp"], res["vtop" + _id + "_cvr"] = corr
+    return res
+
+
+def _stack_checkpoints(res_by_t: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    return {lbl: np.stack([res_t[lbl] for res_t in res_by_t], axis=1) for lbl in res_by_t[0]}
+
+
+# --- intermediary variables
+# ctx holds the raw bars (days, bars), the scalars of the day and every intermediary variable
+# computed so far, each intermediary variable declares what it reads from ctx
+def _resolve(ctx: dict, name: str):
+    if name not in ctx:
+        deps, fun = intermediates_registry[name]
+        for dep in deps:
+            _resolve(ctx, dep)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ctx[name] = fun(ctx)
+    return ctx[name]
+
+
+intermediates_registry = {
+    "vwap": (["amount", "volume"], lambda ctx: _ffill(
+        ctx["amount"] / ctx["volume"] / ctx["contract_multiplier"] * ctx["amount_scale"])),
+    "vwap_cum": (["amount", "volume"], lambda ctx: _ffill(
+        np.cumsum(ctx["amount"], axis=-1) / np.cumsum(ctx["volume"], axis=-1) / ctx["contract_multiplier"] * ctx["amount_scale"])),
+    "m01_return": (["vwap", "pre_settle"], lambda ctx: (
+        ctx["vwap"] / _shift(ctx["vwap"], ctx["pre_settle"]) - 1) * ctx["ret_scale"]),
+    "m01_return_cls": (["close", "preclose"], lambda ctx: (
+        ctx["close"] / _shift(ctx["close"], ctx["preclose"][:, 0]) - 1) * ctx["ret_scale"]),
+    "smart_idx": (["m01_return_cls", "volume"], lambda ctx: np.abs(ctx["m01_return_cls"]) / np.sqrt(ctx["volume"])),
+    "amplitude": (["high", "low"], lambda ctx: (ctx["high"] / ctx["low"] - 1) * ctx["ret_scale"]),
+    "order_smart_idx": (["smart_idx"], lambda ctx: _desc_order(ctx["smart_idx"])),
+    "order_vwap": (["vwap"], lambda ctx: _desc_order(ctx["vwap"])),
+    "order_volume": (["volume"], lambda ctx: _desc_order(ctx["volume"])),
+}
+
+
+# --- factor groups
+# factors in the same group are computed together, each group declares the intermediary variables it needs
+def _g_spread(ctx: dict) -> dict[str, np.ndarray]:
+    pre_settle, pre_spot_close, ret_scale, t_num = ctx["pre_settle"], ctx["pre_spot_close"], ctx["ret_scale"], len(ctx["n"])
+    prev_day_close, this_day_open = ctx["preclose"][:, 0], ctx["daily_open"][:, 0]
+    return {
+        "basis": np.repeat(((pre_settle / pre_spot_close - 1) * ret_scale)[:, None], t_num, axis=1),
+        "csr": np.repeat(((prev_day_close / pre_settle - 1) * ret_scale)[:, None], t_num, axis=1),
+        "onr": np.repeat(((this_day_open / prev_day_close - 1) * ret_scale)[:, None], t_num, axis=1),
+    }
+
+
+def _g_prices_return(ctx: dict) -> dict[str, np.ndarray]:
+    n, this_day_open = ctx["n"], ctx["daily_open"][:, 0]
+    return {lbl: (ctx[k][:, n - 1] / this_day_open[:, None] - 1) / np.sqrt(n) * ctx["ret_scale"]
+            for lbl, k in [("vwap_ret", "vwap"), ("vwap_cum_ret", "vwap_cum"),
+                           ("hgh_ret", "daily_high"), ("low_ret", "daily_low")]}
+
+
+def _g_moments(ctx: dict) -> dict[str, np.ndarray]:
+    # huxo: momentum adjusted by volatility, and skewness
+    mtm_vol_adj, skewness = _mtm_vol_adj_and_skewness(*_prefix_power_sums(ctx["m01_return"], ctx["n"]))
+    return {"mtm_vol_adj": mtm_vol_adj, "skewness": skewness}
+
+
+def _g_time_center(ctx: dict) -> dict[str, np.ndarray]:
+    # kyzq: time center weighted by return
+    res, n, m01_return_cls = {}, ctx["n"], ctx["m01_return_cls"]
+    bar_idx = np.arange(m01_return_cls.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for lbl, sel in [("gu", m01_return_cls > 0), ("gd", m01_return_cls < 0)]:
+            wgt = np.where(sel, np.abs(m01_return_cls), 0)
+            wgt_sum = np.cumsum(wgt, axis=-1)[:, n - 1]
+            idx_sum = np.cumsum(wgt * bar_idx, axis=-1)[:, n - 1]
+            res[lbl] = np.where(np.cumsum(sel, axis=-1)[:, n - 1] > 0, idx_sum / wgt_sum, 0)
+    res["g_tau"] = res["gu"] - res["gd"]
+    res["g_tau_abs"] = np.abs(res["g_tau"])
+    return res
+
+
+def _g_chart(ctx: dict) -> dict[str, np.ndarray]:
+    up, dn = _up_and_dn(ctx["high"], ctx["low"], ctx["n"])
+    return {"up": up, "dn": dn}
+
+
+def _g_smart_money(ctx: dict) -> dict[str, np.ndarray]:
+    if ctx["backend"] == "jit":
+        return smart_money_jit(ctx["order_smart_idx"], ctx["volume"], ctx["amount"], ctx["vwap"],
+                               ctx["m01_return_cls"], ctx["vwap_cum"], ctx["n"], ctx["ret_scale"])
+    return _stack_checkpoints([_smart_money(
+        _prefix_orders(ctx["order_smart_idx"], bar_num), ctx["volume"], ctx["amount"], ctx["vwap"],
+        ctx["m01_return_cls"], ctx["vwap_cum"][:, bar_num - 1], ctx["ret_scale"]) for bar_num in ctx["n"]])
+
+
+def _g_amplitude(ctx: dict) -> dict[str, np.ndarray]:
+    if ctx["backend"] == "jit":
+        return amplitude_jit(ctx["order_vwap"], ctx["amplitude"], ctx["n"])
+    return _stack_checkpoints([_amplitude(
+        _prefix_orders(ctx["order_vwap"], bar_num), ctx["amplitude"]) for bar_num in ctx["n"]])
+
+
+def _g_extreme_return(ctx: dict) -> dict[str, np.ndarray]:
+    if ctx["backend"] == "jit":
+        return extreme_return_jit(ctx["m01_return_cls"], ctx["n"])
+    n, m01_return_cls, res_by_t = ctx["n"], ctx["m01_return_cls"], []
+    ret_min = np.fmin.accumulate(m01_return_cls, axis=-1)[:, n - 1]
+    ret_max = np.fmax.accumulate(m01_return_cls, axis=-1)[:, n - 1]
+    for j, bar_num in enumerate(n):
+        ret_before_t = m01_return_cls[:, 0:bar_num]
+        with np.errstate(invalid="ignore"):
+            ret_median = np.nanmedian(ret_before_t, axis=-1)
+        res_by_t.append(_extreme_return(ret_before_t, ret_median, ret_min[:, j], ret_max[:, j]))
+    return _stack_checkpoints(res_by_t)
+
+
+def _g_volume_top_ret(ctx: dict) -> dict[str, np.ndarray]:
+    return _stack_checkpoints([_volume_top_ret(
+        _prefix_orders(ctx["order_volume"], bar_num), ctx["m01_return"]) for bar_num in ctx["n"]])
+
+
+def _g_volume_top_corr(ctx: dict) -> dict[str, np.ndarray]:
+    if ctx["backend"] == "jit":
+        corr = {y_lbl: spearman_of_heads_jit(x, ctx["volume"], ctx["order_volume"], ctx["n"])
+                for x, y_lbl in [(ctx["vwap"], "cvp"), (ctx["m01_return"], "cvr")]}
+    else:
+        # the heads of all the checkpoints are subsets of the same day, so all of them are ranked in one pass
+        n, pos = ctx["n"], _prefix_positions(ctx["order_volume"], ctx["n"])
+        top_bars = np.array([list(_top_bars(bar_num).values()) for bar_num in n])  # (checkpoints, heads)
+        masks = (pos[..., None] < top_bars).reshape(pos.shape[0], pos.shape[1], -1)
+        corr = {y_lbl: spearman_of_subsets(x, ctx["volume"], masks).reshape(pos.shape[0], len(n), -1)
+                for x, y_lbl in [(ctx["vwap"], "cvp"), (ctx["m01_return"], "cvr")]}
+    res = {}
+    for y_lbl, corr_y in corr.items():
+        for h, _id in enumerate(["01", "02", "05"]):
+            res["vtop" + _id + "_" + y_lbl] = corr_y[:, :, h]
+    return res
+
+
+def _g_volume_corr(ctx: dict) -> dict[str, np.ndarray]:
+    # every checkpoint is a subset of the same day, so all of them are ranked in one pass
+    if ctx["backend"] == "jit":
+        return {
+            "cvp": spearman_of_prefixes_jit(ctx["vwap"], ctx["volume"], ctx["n"]),
+            "cvr": spearman_of_prefixes_jit(ctx["m01_return"], ctx["volume"], ctx["n"]),
+        }
+    masks = np.arange(ctx["volume"].shape[1])[:, None] < ctx["n"]
+    return {
+        "cvp": spearman_of_subsets(ctx["vwap"], ctx["volume"], masks),
+        "cvr": spearman_of_subsets(ctx["m01_return"], ctx["volume"], masks),
+    }
+
+
+def _g_rtm(ctx: dict) -> dict[str, np.ndarray]:
+    # return to mature
+    vwap = ctx["vwap"]
+    return {"rtm": (vwap[:, -1:] / vwap[:, ctx["n"]] - 1) * ctx["ret_scale"]}
+
+
+factor_groups = {
+    "spread": ([], ["basis", "csr", "onr"], _g_spread),
+    "prices_return": (["vwap", "vwap_cum"], ["vwap_ret", "vwap_cum_ret", "hgh_ret", "low_ret"], _g_prices_return),
+    "volume_top_ret": (["order_volume", "m01_return"], ["vtop01_ret", "vtop02_ret", "vtop05_ret"], _g_volume_top_ret),
+    "volume_top_corr": (["order_volume", "vwap", "m01_return"], [
+        "vtop01_cvp", "vtop02_cvp", "vtop05_cvp", "vtop01_cvr", "vtop02_cvr", "vtop05_cvr"], _g_volume_top_corr),
+    "volume_corr": (["vwap", "m01_return"], ["cvp", "cvr"], _g_volume_corr),
+    "chart": ([], ["up", "dn"], _g_chart),
+    "moments": (["m01_return"], ["skewness", "mtm_vol_adj"], _g_moments),
+    "smart_money": (["order_smart_idx", "vwap", "vwap_cum", "m01_return_cls"], [
+        "smart01", "smart01_ret", "smart02", "smart02_ret", "smart05", "smart05_ret"], _g_smart_money),
+    "amplitude": (["order_vwap", "amplitude"], [
+        "vh01", "vl01", "vd01", "vh02", "vl02", "vd02", "vh05", "vl05", "vd05"], _g_amplitude),
+    "extreme_return": (["m01_return_cls"], ["exr", "exrb01"], _g_extreme_return),
+    "time_center": (["m01_return_cls"], ["gu", "gd", "g_tau", "g_tau_abs"], _g_time_center),
+    "rtm": (["vwap"], ["rtm"], _g_rtm),
+}
+
+# factor -> (group, intermediary variables it needs)
+factors_registry = {lbl: (group, intermediates) for group, (intermediates, lbls, _) in factor_groups.items() for lbl in lbls}
+
+
+def cal_features_and_return_vec(bars: dict[str, np.ndarray],
+                                contract_multiplier: int,
+                                pre_settle: np.ndarray, pre_spot_close: np.ndarray,
+                                sub_win_width: int = 30, tot_bar_num: int = 240,
+                                amount_scale: float = 1e4, ret_scale: int = 100,
+                                selected_factors: list[str] | None = None,
+                                backend: str = "numpy") -> dict[str, np.ndarray]:
+    """
+
+    :param bars: open/high/low/close/volume/amount/daily_open/daily_high/daily_low/preclose/timestamp,
+                 each one with shape = (days, tot_bar_num)
+    :param contract_multiplier:
+    :param pre_settle: shape = (days,)
+    :param pre_spot_close: shape = (days,)
+    :param sub_win_width:
+    :param tot_bar_num:
+    :param amount_scale:
+    :param ret_scale:
+    :param selected_factors: subset of factors_registry, None means all of them, only the groups and
+                             intermediary variables they need are computed
+    :param backend: "numpy" or "jit", "jit" runs smart money, amplitude, extreme return and the Spearman
+                    correlations with the compiled kernels of features_jit, and falls back to "numpy"
+                    if numba is not installed
+    :return: timestamp and the selected factors, each one with shape = (days, checkpoints)
+    """
+    sub_win_num = int(tot_bar_num / sub_win_width)
+    n = np.arange(1, sub_win_num) * sub_win_width
+    ctx = dict(bars)
+    ctx.update({
+        "contract_multiplier": contract_multiplier, "pre_settle": pre_settle, "pre_spot_close": pre_spot_close,
+        "amount_scale": amount_scale, "ret_scale": ret_scale, "n": n,
+        "backend": "jit" if (backend == "jit") and jit_available else "numpy",
+    })
+    if selected_factors is None:
+        selected_factors = list(factors_registry)
+    selected_groups = list(dict.fromkeys(factors_registry[lbl][0] for lbl in selected_factors))
+
+    res = {"timestamp": bars["timestamp"][:, n]}
+    for group in selected_groups:
+        intermediates, _, fun = factor_groups[group]
+        for name in intermediates:
+            _resolve(ctx, name)
+        res_group = fun(ctx)
+        res.update({lbl: res_group[lbl] for lbl in selected_factors if lbl in res_group})
+    return res
+
+
+def cal_features_and_return_one_day_vec(m01: pd.DataFrame,
+                                        instrument: str, contract: str, contract_multiplier: int,
+                                        pre_settle: float, pre_spot_close: float,
+                                        sub_win_width: int = 30, tot_bar_num: int = 240,
+                                        amount_scale: float = 1e4, ret_scale: int = 100,
+                                        selected_factors: list[str] | None = None,
+                                        backend: str = "numpy") -> pd.DataFrame:
+    """
+    NumPy counterpart of xfuns.cal_features_and_return_one_day, all the
+    checkpoints are computed in one pass from prefix sums and one sort of the
+    whole day for each sort key.
+
+    Divergence: vtop*_ret, vtop*_cvp and vtop*_cvr read the bars with the
+    largest volume, and volumes are whole lots, so ties at the head cut are
+    routine. The pandas kernel breaks them by the default quicksort, whose
+    order depends on the numpy build and the CPU, while this engine keeps
+    tied bars in bar order, as kind="stable" does. On synthetic_market
+    (4 instruments x 30 days x 7 checkpoints) the vtop01 columns differ in
+    6-9% of the rows, vtop02 in 12-20% and vtop05 in 26-35%. All the other
+    columns equal the pandas kernel within rtol = 1e-8, atol = 1e-10
+    (moments are computed from cumulative sums), ties in vwap or smart_idx
+    at a cut are possible but not seen there. The engines are therefore
+    not interchangeable, dp_00_features_and_return records the one which
+    saved each day, see kernel_label.
+
+    :param m01: same as xfuns.cal_features_and_return_one_day, checked by xfuns.check_m01_bars as it is there
+    :return: same columns, index and dtypes as xfuns.cal_features_and_return_one_day
+    """
+    bars = {k: m01[k].to_numpy(dtype=np.int64 if k == "timestamp" else np.float64)[None, :] for k in vec_bar_cols}
+    check_m01_bars({k: v[0] for k, v in bars.items()}, contract, tot_bar_num, widths=(5, 10, 15))
+    res = cal_features_and_return_vec(
+        bars=bars, contract_multiplier=contract_multiplier,
+        pre_settle=np.array([pre_settle], dtype=np.float64),
+        pre_spot_close=np.array([pre_spot_close], dtype=np.float64),
+        sub_win_width=sub_win_width, tot_bar_num=tot_bar_num,
+        amount_scale=amount_scale, ret_scale=ret_scale, selected_factors=selected_factors, backend=backend)
+    return features_to_frame(res, instrument, [contract]).set_axis(range(1, res["timestamp"].shape[1] + 1))
+
+
+def cal_features_and_return_batch(m01_tensor: np.ndarray, fields: list[str],
+                                  instrument: str, contracts: list[str], contract_multiplier: int,
+                                  pre_settle: np.ndarray, pre_spot_close: np.ndarray,
+                                  sub_win_width: int = 30, tot_bar_num: int = 240,
+                                  amount_scale: float = 1e4, ret_scale: int = 100,
+                                  selected_factors: list[str] | None = None,
+                                  backend: str = "numpy") -> list[pd.DataFrame]:
+    """
+    Features and return of many days of one instrument in one call, every
+    step of cal_features_and_return_vec runs across all the days at once.
+
+    :param m01_tensor: shape = (days, tot_bar_num, fields), minute bars of the major contract of each day, each
+                       one already checked by xfuns.check_m01_bars, as dp_00_features_and_return does before
+                       stacking them, so a bad day fails alone instead of the whole batch
+    :param fields: names of the last axis of m01_tensor, must cover vec_bar_cols
+    :param instrument:
+    :param contracts: major contract of each day
+    :param contract_multiplier:
+    :param pre_settle: shape = (days,)
+    :param pre_spot_close: shape = (days,)
+    :param sub_win_width:
+    :param tot_bar_num:
+    :param amount_scale:
+    :param ret_scale:
+    :param selected_factors: same as cal_features_and_return_vec
+    :param backend: same as cal_features_and_return_vec
+    :return: one data frame for each day, same as cal_features_and_return_one_day_vec
+    """
+    tensor = np.ascontiguousarray(
+        np.moveaxis(m01_tensor[:, :, [fields.index(k) for k in vec_bar_cols]], -1, 0), dtype=np.float64)
+    bars = dict(zip(vec_bar_cols, tensor))
+    bars["timestamp"] = bars["timestamp"].astype(np.int64)
+    res = cal_features_and_return_vec(
+        bars=bars, contract_multiplier=contract_multiplier,
+        pre_settle=np.asarray(pre_settle, dtype=np.float64),
+        pre_spot_close=np.asarray(pre_spot_close, dtype=np.float64),
+        sub_win_width=sub_win_width, tot_bar_num=tot_bar_num,
+        amount_scale=amount_scale, ret_scale=ret_scale, selected_factors=selected_factors, backend=backend)
+    t_num = res["timestamp"].shape[1]
+    res_df = features_to_frame(res, instrument, contracts)
+    return [res_df.iloc[d * t_num:(d + 1) * t_num].set_axis(range(1, t_num + 1)) for d in range(len(contracts))]
+
+
+def features_to_frame(res: dict[str, np.ndarray], instrument: str, contracts: list[str]) -> pd.DataFrame:
+    days, t_num = res["timestamp"].shape
+    res_df = pd.DataFrame({
+        "instrument": instrument,
+        "contract": np.repeat(contracts, t_num),
+        "tid": ["T{:02d}".format(t) for t in range(1, t_num + 1)] * days,
+        "timestamp": res["timestamp"].ravel(),
+        **{lbl: res[lbl].ravel() for lbl in factors + ["rtm"] if lbl in res},
+    })
+    return res_df
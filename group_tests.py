@@ -4,105 +4,279 @@ import numpy as np
 import pandas as pd
 import itertools as ittl
 import multiprocessing as mp
-from skyrim.falkreath import CManagerLibReader, CTable, CManagerLibWriter
-from skyrim.winterhold import plot_lines
-
-
-def cal_group_return(df: pd.DataFrame, fac: str, ret: str, ret_scale: int):
-    n = len(df)
-    m = int(n / 2)
-    d = n - 2 * m
-    lng_raw_wgt = np.array([1] * m + [0] * d + [0] * m)
-    srt_raw_wgt = np.array([0] * m + [0] * d + [1] * m)
-    lng_wgt = lng_raw_wgt / np.abs(lng_raw_wgt).sum()
-    srt_wgt = srt_raw_wgt / np.abs(srt_raw_wgt).sum()
+from features_cube import CFeaturesCube
+from result_store import CResultStore
+from charts import CChartRenderer
+from trades_simulation import cal_turnover, cal_net_ret
+
+
+def descending_order(x: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+
+    :param x: [..., instrument]
+    :param valid: [..., instrument], broadcast to x.shape
+    :return: [..., instrument], the instruments sorted by x descending, with NaN after the other values and
+             the ones not valid after all the others, ties are kept in the order of the instruments
+    """
+    order = np.argsort(-x, axis=-1, kind="stable")
+    invalid = ~np.take_along_axis(np.broadcast_to(valid, x.shape), order, axis=-1)
+    return np.take_along_axis(order, np.argsort(invalid, axis=-1, kind="stable"), axis=-1)
+
+
+def tie_blocks(x: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+
+    :param x: [..., instrument]
+    :param valid: [..., instrument], broadcast to x.shape
+    :return: (bgn, stp), [..., instrument] each, if the n valid instruments are sorted by x descending, with NaN
+             after the other values, the block of the instruments tied with one of them takes the positions
+             [bgn, stp), NaN are tied with each other, and bgn = stp = n for the instruments not valid
+    """
+    valid = np.broadcast_to(valid, x.shape)
+    pos = np.broadcast_to(np.arange(x.shape[-1]), x.shape)
+    order = descending_order(x, valid)
+    xs, vs = np.take_along_axis(x, order, axis=-1), np.take_along_axis(valid, order, axis=-1)
+
+    # a block goes on while the values are the same, and stops before the first instrument not valid
+    same = ((xs[..., 1:] == xs[..., :-1]) | (np.isnan(xs[..., 1:]) & np.isnan(xs[..., :-1]))) & vs[..., 1:]
+    head, tail = np.ones(x.shape[:-1] + (1,), dtype=bool), np.ones(x.shape[:-1] + (1,), dtype=bool)
+    sorted_bgn = np.maximum.accumulate(np.where(np.concatenate([head, ~same], axis=-1), pos, 0), axis=-1)
+    sorted_stp = np.minimum.accumulate(np.where(np.concatenate([~same, tail], axis=-1), pos + 1, x.shape[-1])[..., ::-1], axis=-1)[..., ::-1]
+    bgn, stp = np.empty_like(sorted_bgn), np.empty_like(sorted_stp)
+    np.put_along_axis(bgn, order, sorted_bgn, axis=-1)
+    np.put_along_axis(stp, order, sorted_stp, axis=-1)
+    n = valid.sum(axis=-1, keepdims=True)
+    return np.where(valid, bgn, n), np.where(valid, stp, n)
+
+
+def slot_shares(bgn: np.ndarray, stp: np.ndarray, slot_bgn: np.ndarray, slot_stp: np.ndarray) -> np.ndarray:
+    """
+    share of each instrument in the positions [slot_bgn, slot_stp) of the sorted instruments, as the average
+    of all the orders of the ties: the positions of a block of ties are shared evenly by its instruments
+
+    :param bgn: block of ties of each instrument, as tie_blocks returns
+    :param stp:
+    :param slot_bgn: broadcast to bgn.shape
+    :param slot_stp: broadcast to bgn.shape
+    :return: [..., instrument], between 0 and 1, e.g. 1 for an instrument without ties inside the slots
+    """
+    return np.maximum(np.minimum(stp, slot_stp) - np.maximum(bgn, slot_bgn), 0) / np.maximum(stp - bgn, 1)
+
+
+def cal_group_return_of_tid(cube: CFeaturesCube, factors: list[str], tid: str, bgn_date: str, stp_date: str,
+                            ret: str = "rtm", ret_scale: int = 100) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    returns of the long, short and hedged groups of all the factors of one tid, from one slice of the cube.
+    For each date and factor, the n instruments present are sorted by the factor descending with NaN last,
+    as in sort_values(ascending=False), the first int(n/2) of them are equally weighted in the long group
+    and the last int(n/2) in the short group.
+
+    sort_values does not define the order of ties, so a block of ties across the cut of a group, like the
+    0/1 values of up and dn, or days when a factor is NaN for all the instruments, shares the positions of
+    the group it takes evenly, which is the average of the returns of all the orders of the ties. Without
+    ties the returns are the ones of sort_values.
+
+    :return: (trade_dates, lng, srt, hdg), lng.shape = (dates, factors), dates without any instrument are dropped
+    """
+    tid_idx = cube.tid_index(tid)
+    date_slice = cube.date_slice(bgn_date, stp_date)
+    present = cube.present(bgn_date, stp_date)[:, :, tid_idx]  # [date, instrument]
+    tid_values = cube.sel(bgn_date, stp_date, tid=tid)  # [date, instrument, column], a view
+    x = tid_values[:, :, [cube.column_index(f) for f in factors]].transpose(0, 2, 1)  # [date, factor, instrument]
+    y = np.where(present, tid_values[:, :, cube.column_index(ret)], 0)[:, None, :]  # [date, 1, instrument]
+
+    bgn, stp = tie_blocks(x, present[:, None, :])
+
+    # weights are NaN if there are less than 2 instruments, and NaN returns of the instruments present
+    # are kept, so both give NaN returns, which are saved as 0
+    n = present.sum(axis=1)[:, None, None]
+    m = n // 2
+    lng_share, srt_share = slot_shares(bgn, stp, 0, m), slot_shares(bgn, stp, n - m, n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lng_wgt = lng_share / m
+        srt_wgt = srt_share / m
     hdg_wgt = lng_wgt * 0.5 - srt_wgt * 0.5
-    sig_df = df.sort_values(by=fac, ascending=False)
-    ret_lng = sig_df[ret] @ lng_wgt / ret_scale
-    ret_srt = sig_df[ret] @ srt_wgt / ret_scale
-    ret_hdg = sig_df[ret] @ hdg_wgt / ret_scale
-    return ret_lng, ret_srt, ret_hdg
+    lng, srt, hdg = [(y * w).sum(axis=-1) / ret_scale for w in (lng_wgt, srt_wgt, hdg_wgt)]
+    has_obs = n[:, 0, 0] > 0
+    trade_dates = cube.dates[date_slice][has_obs]
+    return trade_dates, np.nan_to_num(lng[has_obs], nan=0), np.nan_to_num(srt[has_obs], nan=0), np.nan_to_num(hdg[has_obs], nan=0)
+
+
+def group_tests_per_tid(
+        tid: str, factors: list[str],
+        bgn_date: str, stp_date: str,
+        features_and_return_dir: str,
+) -> pd.DataFrame:
+    """
+
+    :return: rows of the group_tests table, with columns factor, tid, trade_date, lng, srt and hdg
+    """
+    # --- load cube, read once for all the factors
+    features_and_return_cube = CFeaturesCube(features_and_return_dir)
+    trade_dates, lng, srt, hdg = cal_group_return_of_tid(features_and_return_cube, factors, tid, bgn_date, stp_date)
+    return pd.DataFrame({
+        "factor": np.repeat(factors, len(trade_dates)),
+        "tid": tid,
+        "trade_date": np.tile(trade_dates, len(factors)),
+        "lng": lng.T.flatten(),
+        "srt": srt.T.flatten(),
+        "hdg": hdg.T.flatten(),
+    })
 
 
-def group_test_per_factor_and_tid(
-        factor: str, tid: str,
+def multi_process_fun_for_group_tests(
+        group_n: int,
+        factors: list[str], tids: list[str],
         run_mode: str, bgn_date: str, stp_date: str | None,
         features_and_return_dir: str,
         group_tests_dir: str,
         sqlite3_tables: dict,
 ):
+    """
+    the tids are calculated by group_n processes, and all the results are written to group_tests.db
+    in one transaction by this process. With run_mode = "a" the dates in [bgn_date, stp_date)
+    are added, or replaced if they are saved already, and the other dates are kept.
+
+    """
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
-    # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
-    )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    pool = mp.Pool(processes=group_n)
+    res = [pool.apply_async(group_tests_per_tid, args=(tid, factors, bgn_date, stp_date, features_and_return_dir))
+           for tid in tids]
+    pool.close()
+    pool.join()
 
     # --- load lib writer
-    group_tests_lib_id = "{}-{}-group_tests".format(factor, tid)
-    group_tests_lib = CManagerLibWriter(
-        t_db_save_dir=group_tests_dir,
-        t_db_name=group_tests_lib_id + ".db"
-    )
-    group_tests_lib_stru = sqlite3_tables[group_tests_lib_id]
-    group_tests_lib_tab = CTable(t_table_struct=group_tests_lib_stru)
-    group_tests_lib.initialize_table(t_table=group_tests_lib_tab, t_remove_existence=run_mode.upper() in ["O", "OVERWRITE"])
+    group_tests_lib = CResultStore(group_tests_dir, "group_tests.db", sqlite3_tables["group_tests"])
+    group_tests_lib.initialize_table(t_remove_existence=run_mode.upper() in ["O", "OVERWRITE"])
+    group_tests_lib.update(t_update_df=pd.concat([_.get() for _ in res], ignore_index=True))
+    group_tests_lib.close()
+    return 0
+
+
+def read_hdg_of_tids(tids: list[str], bgn_date: str, stp_date: str,
+                     group_tests_dir: str, sqlite3_tables: dict) -> dict[str, pd.DataFrame]:
+    """
+    all the tids are read from group_tests.db in one query
 
-    src_df = features_and_return_lib.read_by_conditions(
+    :return: {tid: hdg_df}, hdg_df.index = trade_date, hdg_df.columns = the factors saved of the tid
+    """
+    group_tests_lib = CResultStore(group_tests_dir, "group_tests.db", sqlite3_tables["group_tests"])
+    all_ret_df = group_tests_lib.read_by_conditions(
         t_conditions=[
             ("trade_date", ">=", bgn_date),
             ("trade_date", "<", stp_date),
-            ("tid", "=", tid),
         ],
-        t_value_columns=["trade_date", "instrument", "tid", factor, "rtm"]
+        t_value_columns=["factor", "tid", "trade_date", "hdg"]
     )
-
-    group_tests_srs = src_df.groupby(by="trade_date").apply(
-        cal_group_return, fac=factor, ret="rtm", ret_scale=100)
-    lng_ret_srs, srt_ret_srs, hdg_ret_srs = zip(*group_tests_srs)
-    group_tests_df = pd.DataFrame({
-        "lng": lng_ret_srs,
-        "srt": srt_ret_srs,
-        "hdg": hdg_ret_srs,
-    }, index=group_tests_srs.index).fillna(0)
-    group_tests_lib.update(t_update_df=group_tests_df, t_using_index=True)
-
-    # close libs
-    features_and_return_lib.close()
     group_tests_lib.close()
-    return 0
+    hdg_dfs = {k: v.pivot(index="trade_date", columns="factor", values="hdg") for k, v in all_ret_df.groupby(by="tid")}
+    return {tid: hdg_dfs.get(tid, pd.DataFrame(dtype=float)) for tid in tids}
+
+
+def select_factors(cum_hdg: pd.Series, head_n: int = 8) -> pd.DataFrame:
+    """
+
+    :param cum_hdg: cumulative hdg returns of the factors of one tid, index = factors
+    :param head_n:
+    :return: factors with the largest cumulative hdg returns, with direction 1, and the ones with the
+             smallest, with direction -1
+    """
+    sorted_cumsum = cum_hdg.sort_values(ascending=False)
+    head_factors = sorted_cumsum.head(head_n).index.to_list()
+    tail_factors = sorted_cumsum.tail(head_n).index.to_list()
+    return pd.DataFrame({
+        "factor": head_factors + tail_factors,
+        "direction": [1] * len(head_factors) + [-1] * len(tail_factors)
+    })
+
+
+def cal_quantile_return(cube: CFeaturesCube, factors: list[str], tids: list[str], bgn_date: str, stp_date: str,
+                        quantile_n: int, cost_rate: float, ret: str = "rtm", ret_scale: int = 100
+                        ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    returns of quantile_n buckets of all the factors and tids, from one slice of the cube. For each date, tid
+    and factor, the n instruments present with a finite factor are sorted by it descending, and the positions
+    p with int(p * quantile_n / n) = k are equally weighted in bucket k, so bucket 0 holds the largest values,
+    and some buckets are empty if n < quantile_n. A block of ties across the edge of a bucket shares the
+    positions it takes evenly, as in cal_group_return_of_tid.
+
+    turnover and net follow the convention of trades_simulation: the positions of a bucket are opened at the
+    checkpoint and closed at the close on every date, so a bucket which is not empty trades 2 and pays
+    cost_rate on every date.
+
+    :return: (trade_dates, obs, ret, turnover, net), obs.shape = (dates, tids) are the instruments present,
+             ret.shape = (dates, tids, factors, quantile_n), returns of empty buckets, or of buckets with a
+             NaN return, are 0
+    """
+    date_slice = cube.date_slice(bgn_date, stp_date)
+    tid_ids = [cube.tid_index(t) for t in tids]
+    present = cube.present(bgn_date, stp_date)[:, :, tid_ids].transpose(0, 2, 1)  # [date, tid, instrument]
+    values = cube.sel(bgn_date, stp_date)[:, :, tid_ids]  # [date, instrument, tid, column]
+    x = values[..., [cube.column_index(f) for f in factors]].transpose(0, 2, 3, 1)  # [date, tid, factor, instrument]
+    y = values[..., cube.column_index(ret)].transpose(0, 2, 1)[:, :, None, :]  # [date, tid, 1, instrument]
+    valid = present[:, :, None, :] & np.isfinite(x)
+    bgn, stp = tie_blocks(x, valid)
+    n = valid.sum(axis=-1, keepdims=True)
 
+    bucket_ret, turnover = np.zeros(x.shape[0:3] + (quantile_n,)), np.zeros(x.shape[0:3] + (quantile_n,))
+    for k in range(quantile_n):
+        # positions of bucket k are [ceil(k * n / quantile_n), ceil((k + 1) * n / quantile_n))
+        slot_bgn, slot_stp = -(-k * n // quantile_n), -(-(k + 1) * n // quantile_n)
+        wgt = slot_shares(bgn, stp, slot_bgn, slot_stp) / np.maximum(slot_stp - slot_bgn, 1)
+        bucket_ret[..., k] = np.where(wgt > 0, wgt * y, 0).sum(axis=-1) / ret_scale
+        turnover[..., k] = cal_turnover(wgt.reshape(x.shape[0], -1, x.shape[-1])).reshape(x.shape[0:3])
+    bucket_ret = np.nan_to_num(bucket_ret, nan=0)
+    net = cal_net_ret(bucket_ret, turnover, cost_rate)
+    return cube.dates[date_slice], present.sum(axis=-1), bucket_ret, turnover, net
 
-def process_target_fun_for_group_tests(
-        group_id: int, group_n: int,
+
+def quantile_tests(
         factors: list[str], tids: list[str],
-        **kwargs
+        quantile_n: int, cost_rate: float,
+        run_mode: str, bgn_date: str, stp_date: str | None,
+        features_and_return_dir: str,
+        group_tests_dir: str,
+        sqlite3_tables: dict,
+        chunk_dates: int = 60,
 ):
-    for i, (factor, tid) in enumerate(ittl.product(factors, tids)):
-        if i % group_n == group_id:
-            group_test_per_factor_and_tid(factor=factor, tid=tid, **kwargs)
-    return 0
+    """
+    all the factors and tids are calculated together in this process, chunk_dates dates of the cube at a time,
+    and saved to quantile_tests.db. With run_mode = "a" the dates in [bgn_date, stp_date) are added, or
+    replaced if they are saved already, and the other dates are kept. Buckets of an old quantile_n are not
+    removed by "a", so it should be run with "o" after quantile_n is changed.
 
+    """
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
-def multi_process_fun_for_group_tests(
-        group_n: int,
-        factors: list[str], tids: list[str],
-        **kwargs):
-    to_join_list = []
-    for group_id in range(group_n):
-        t = mp.Process(
-            target=process_target_fun_for_group_tests,
-            args=(group_id, group_n, factors, tids),
-            kwargs=kwargs)
-        t.start()
-        to_join_list.append(t)
-    for t in to_join_list:
-        t.join()
+    # --- load cube
+    features_and_return_cube = CFeaturesCube(features_and_return_dir)
+
+    # --- load lib writer
+    quantile_tests_lib = CResultStore(group_tests_dir, "quantile_tests.db", sqlite3_tables["quantile_tests"])
+    quantile_tests_lib.initialize_table(t_remove_existence=run_mode.upper() in ["O", "OVERWRITE"])
+
+    dates = features_and_return_cube.dates[features_and_return_cube.date_slice(bgn_date, stp_date)]
+    for i in range(0, len(dates), chunk_dates):
+        chunk_bgn_date = dates[i]
+        chunk_stp_date = dates[i + chunk_dates] if i + chunk_dates < len(dates) else stp_date
+        trade_dates, obs, ret, turnover, net = cal_quantile_return(
+            features_and_return_cube, factors, tids, chunk_bgn_date, chunk_stp_date, quantile_n, cost_rate)
+        d, t, k, q = np.nonzero(np.broadcast_to(obs[:, :, None, None] > 0, ret.shape))
+        quantile_tests_lib.update(t_update_df=pd.DataFrame({
+            "factor": np.array(factors)[k],
+            "tid": np.array(tids)[t],
+            "trade_date": trade_dates[d],
+            "bucket": q,
+            "obs": obs[d, t],
+            "ret": ret[d, t, k, q],
+            "turnover": turnover[d, t, k, q],
+            "net": net[d, t, k, q],
+        }))
+        print("... quantile tests of {} - {} are saved".format(trade_dates[0], trade_dates[-1]))
+    quantile_tests_lib.close()
     return 0
 
 
@@ -112,81 +286,33 @@ def group_tests_summary(
         group_tests_dir: str,
         group_tests_summary_dir: str,
         sqlite3_tables: dict,
+        plot: bool = True, proc_num: int = 4,
 ):
+    """
+
+    :param plot: False to save the csv files only
+    :param proc_num: processes rendering the charts
+    """
+    # --- load lib reader, all the factors and tids are read at once
+    hdg_by_tid = read_hdg_of_tids(tids, bgn_date, stp_date, group_tests_dir, sqlite3_tables)
+
     group_tests_summary_data = []
     group_data_by_fac, group_data_by_tid = {f: {} for f in factors}, {t: {} for t in tids}
     for factor, tid in ittl.product(factors, tids):
-        # --- load lib writer
-        group_tests_lib_id = "{}-{}-group_tests".format(factor, tid)
-        group_tests_lib = CManagerLibReader(
-            t_db_save_dir=group_tests_dir,
-            t_db_name=group_tests_lib_id + ".db"
-        )
-        group_tests_lib_stru = sqlite3_tables[group_tests_lib_id]
-        group_tests_lib_tab = CTable(t_table_struct=group_tests_lib_stru)
-        group_tests_lib.set_default(t_default_table_name=group_tests_lib_tab.m_table_name)
-
-        ret_df = group_tests_lib.read_by_conditions(
-            t_conditions=[
-                ("trade_date", ">=", bgn_date),
-                ("trade_date", "<", stp_date),
-            ],
-            t_value_columns=["trade_date", "lng", "srt", "hdg"]
-        ).set_index("trade_date")
-
-        ret_srs = ret_df["hdg"]
+        hdg_df = hdg_by_tid[tid]
+        ret_srs = hdg_df[factor] if factor in hdg_df.columns else pd.Series(dtype=float)
         group_data_by_fac[factor][tid] = ret_srs
         group_data_by_tid[tid][factor] = ret_srs
 
         group_tests_summary_data.append({
             "factor": factor,
             "tid": tid,
-            "obs": len(ret_df),
+            "obs": len(ret_srs),
             "mean": ret_srs.mean(),
             "std": ret_srs.std(),
             "sharpe": ret_srs.mean() / ret_srs.std() * np.sqrt(252),
         })
 
-    # plot by factor
-    for f, f_data in group_data_by_fac.items():
-        ret_df_by_fac = pd.DataFrame(f_data)
-        ret_df_by_fac_cumsum = ret_df_by_fac.cumsum()
-        plot_lines(
-            t_plot_df=ret_df_by_fac_cumsum,
-            t_fig_name="{}-hdg-cumsum".format(f),
-            # t_ylim=(-150, 150),
-            t_colormap="jet",
-            t_save_dir=group_tests_summary_dir
-        )
-        print("...", f, "plotted")
-
-    # plot by tid
-    for t, t_data in group_data_by_tid.items():
-        ret_df_by_tid = pd.DataFrame(t_data)
-        ret_df_by_tid_cumsum = ret_df_by_tid.cumsum()
-
-        sorted_cumsum = ret_df_by_tid_cumsum.iloc[-1, :].sort_values(ascending=False)
-        head_factors = sorted_cumsum.head(8).index.to_list()
-        tail_factors = sorted_cumsum.tail(8).index.to_list()
-
-        plot_lines(
-            t_plot_df=ret_df_by_tid_cumsum[head_factors + tail_factors],
-            t_fig_name="{}-hdg-cumsum".format(t),
-            t_colormap="jet",
-            # t_ylim=(-150, 150),
-            t_save_dir=group_tests_summary_dir
-        )
-        print("...", t, "plotted")
-
-        selected_factors_df = pd.DataFrame({
-            "factor": head_factors + tail_factors,
-            "direction": [1] * len(head_factors) + [-1] * len(tail_factors)
-        })
-        selected_factors_df.to_csv(
-            os.path.join(group_tests_summary_dir, "selected-factors-{}.csv.gz".format(t)),
-            index=False
-        )
-
     # summary all
     summary_df = pd.DataFrame(group_tests_summary_data).sort_values(by=["tid", "sharpe"], ascending=[True, False])
     pd.set_option("display.max_rows", 16)
@@ -203,4 +329,42 @@ def group_tests_summary(
         )
         print("\n-------------------\n...", tid, "hdg summary")
         print(tid_summary_df)
+
+    # selected factors of each tid
+    ret_df_by_tid = {t: pd.DataFrame(t_data) for t, t_data in group_data_by_tid.items()}
+    selected_factors_by_tid = {t: select_factors(t_df.cumsum().iloc[-1, :]) for t, t_df in ret_df_by_tid.items()}
+    for t, selected_factors_df in selected_factors_by_tid.items():
+        selected_factors_df.to_csv(
+            os.path.join(group_tests_summary_dir, "selected-factors-{}.csv.gz".format(t)),
+            index=False
+        )
+
+    if not plot:
+        return 0
+
+    # charts are rendered after the csv files are saved, unchanged ones are skipped
+    renderer = CChartRenderer(save_dir=group_tests_summary_dir, proc_num=proc_num)
+
+    # plot by factor
+    for f, f_data in group_data_by_fac.items():
+        ret_df_by_fac = pd.DataFrame(f_data)
+        ret_df_by_fac_cumsum = ret_df_by_fac.cumsum()
+        renderer.submit(
+            t_plot_df=ret_df_by_fac_cumsum,
+            t_fig_name="{}-hdg-cumsum".format(f),
+            # t_ylim=(-150, 150),
+            t_colormap="jet",
+        )
+
+    # plot by tid
+    for t, selected_factors_df in selected_factors_by_tid.items():
+        ret_df_by_tid_cumsum = ret_df_by_tid[t].cumsum()
+        renderer.submit(
+            t_plot_df=ret_df_by_tid_cumsum[selected_factors_df["factor"]],
+            t_fig_name="{}-hdg-cumsum".format(t),
+            t_colormap="jet",
+            # t_ylim=(-150, 150),
+        )
+
+    renderer.close()
     return 0
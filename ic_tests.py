@@ -4,119 +4,112 @@ import numpy as np
 import pandas as pd
 import itertools as ittl
 import multiprocessing as mp
-from skyrim.falkreath import CManagerLibReader, CTable, CManagerLibWriter
-from skyrim.winterhold import plot_lines
+from features_cube import CFeaturesCube
+from rank_corr import spearman_of_subsets
+from result_store import CResultStore
+from charts import CChartRenderer
+
+
+def cal_ic_of_tid(cube: CFeaturesCube, factors: list[str], tid: str, bgn_date: str, stp_date: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    cross-sectional Spearman IC of all the factors of one tid, from one slice of the cube, the instruments
+    of each date are ranked for all the factors at once, as in pd.DataFrame.corr(method="spearman")
+
+    :return: (trade_dates, obs, ic), ic.shape = (dates, factors), dates without any instrument are dropped
+    """
+    tid_idx = cube.tid_index(tid)
+    date_slice = cube.date_slice(bgn_date, stp_date)
+    present = cube.present(bgn_date, stp_date)[:, :, tid_idx]  # [date, instrument]
+    tid_values = cube.sel(bgn_date, stp_date, tid=tid)  # [date, instrument, column], a view
+    x = tid_values[:, :, [cube.column_index(f) for f in factors]].transpose(0, 2, 1)  # [date, factor, instrument]
+    y = tid_values[:, None, :, cube.column_index("rtm")]  # [date, 1, instrument]
+    ic = spearman_of_subsets(x, np.broadcast_to(y, x.shape), present[:, None, :, None])[..., 0]
+    obs = present.sum(axis=1)
+    has_obs = obs > 0
+    return cube.dates[date_slice][has_obs], obs[has_obs], np.nan_to_num(ic[has_obs], nan=0)
+
+
+def ic_tests_per_tid(
+        tid: str, factors: list[str],
+        bgn_date: str, stp_date: str,
+        features_and_return_dir: str,
+) -> pd.DataFrame:
+    """
+
+    :return: rows of the ic_tests table, with columns factor, tid, trade_date, obs and ic
+    """
+    # --- load cube, read once for all the factors
+    features_and_return_cube = CFeaturesCube(features_and_return_dir)
+    trade_dates, obs, ic = cal_ic_of_tid(features_and_return_cube, factors, tid, bgn_date, stp_date)
+    return pd.DataFrame({
+        "factor": np.repeat(factors, len(trade_dates)),
+        "tid": tid,
+        "trade_date": np.tile(trade_dates, len(factors)),
+        "obs": np.tile(obs, len(factors)),
+        "ic": ic.T.flatten(),
+    })
 
 
-def ic_test_per_factor_and_tid(
-        factor: str, tid: str,
+def multi_process_fun_for_ic_tests(
+        group_n: int,
+        factors: list[str], tids: list[str],
         run_mode: str, bgn_date: str, stp_date: str | None,
         features_and_return_dir: str,
         ic_tests_dir: str,
         sqlite3_tables: dict,
 ):
+    """
+    the tids are calculated by group_n processes, and all the results are written to ic_tests.db
+    in one transaction by this process. With run_mode = "a" the dates in [bgn_date, stp_date)
+    are added, or replaced if they are saved already, and the other dates are kept.
+
+    """
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
-    # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
-    )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    pool = mp.Pool(processes=group_n)
+    res = [pool.apply_async(ic_tests_per_tid, args=(tid, factors, bgn_date, stp_date, features_and_return_dir))
+           for tid in tids]
+    pool.close()
+    pool.join()
 
     # --- load lib writer
-    ic_tests_lib_id = "{}-{}-ic_tests".format(factor, tid)
-    ic_tests_lib = CManagerLibWriter(
-        t_db_save_dir=ic_tests_dir,
-        t_db_name=ic_tests_lib_id + ".db"
-    )
-    ic_tests_lib_stru = sqlite3_tables[ic_tests_lib_id]
-    ic_tests_lib_tab = CTable(t_table_struct=ic_tests_lib_stru)
-    ic_tests_lib.initialize_table(t_table=ic_tests_lib_tab, t_remove_existence=run_mode.upper() in ["O", "OVERWRITE"])
-
-    src_df = features_and_return_lib.read_by_conditions(
-        t_conditions=[
-            ("trade_date", ">=", bgn_date),
-            ("trade_date", "<", stp_date),
-            ("tid", "=", tid),
-        ],
-        t_value_columns=["trade_date", "instrument", "tid", factor, "rtm"]
-    )
-
-    ic_tests_srs = src_df.groupby(by="trade_date").apply(
-        lambda z: (len(z), z[[factor, "rtm"]].corr(method="spearman").at[factor, "rtm"]))
-    obs_srs, ic_srs = zip(*ic_tests_srs)
-    ic_tests_df = pd.DataFrame({
-        "obs": obs_srs,
-        "ic": ic_srs
-    }, index=ic_tests_srs.index).fillna(0)
-    ic_tests_lib.update(t_update_df=ic_tests_df, t_using_index=True)
-
-    # close libs
-    features_and_return_lib.close()
+    ic_tests_lib = CResultStore(ic_tests_dir, "ic_tests.db", sqlite3_tables["ic_tests"])
+    ic_tests_lib.initialize_table(t_remove_existence=run_mode.upper() in ["O", "OVERWRITE"])
+    ic_tests_lib.update(t_update_df=pd.concat([_.get() for _ in res], ignore_index=True))
     ic_tests_lib.close()
     return 0
 
 
-def process_target_fun_for_ic_tests(
-        group_id: int, group_n: int,
-        factors: list[str], tids: list[str],
-        **kwargs
-):
-    for i, (factor, tid) in enumerate(ittl.product(factors, tids)):
-        if i % group_n == group_id:
-            ic_test_per_factor_and_tid(factor=factor, tid=tid, **kwargs)
-    return 0
-
-
-def multi_process_fun_for_ic_tests(
-        group_n: int,
-        factors: list[str], tids: list[str],
-        **kwargs):
-    to_join_list = []
-    for group_id in range(group_n):
-        t = mp.Process(
-            target=process_target_fun_for_ic_tests,
-            args=(group_id, group_n, factors, tids),
-            kwargs=kwargs)
-        t.start()
-        to_join_list.append(t)
-    for t in to_join_list:
-        t.join()
-    return 0
-
-
 def ic_tests_summary(
         factors: list[str], tids: list[str],
         bgn_date: str, stp_date: str,
         ic_tests_dir: str,
         ic_tests_summary_dir: str,
         sqlite3_tables: dict,
+        plot: bool = True, proc_num: int = 4,
 ):
+    """
+
+    :param plot: False to save the csv files only
+    :param proc_num: processes rendering the charts
+    """
+    # --- load lib reader, all the factors and tids are read at once
+    ic_tests_lib = CResultStore(ic_tests_dir, "ic_tests.db", sqlite3_tables["ic_tests"])
+    all_ic_df = ic_tests_lib.read_by_conditions(
+        t_conditions=[
+            ("trade_date", ">=", bgn_date),
+            ("trade_date", "<", stp_date),
+        ],
+        t_value_columns=["factor", "tid", "trade_date", "ic"]
+    )
+    ic_tests_lib.close()
+    ic_dfs = {k: v.set_index("trade_date").sort_index() for k, v in all_ic_df.groupby(by=["factor", "tid"])}
+
     ic_tests_summary_data = []
     ic_data_by_fac, ic_data_by_tid = {f: {} for f in factors}, {t: {} for t in tids}
     for factor, tid in ittl.product(factors, tids):
-        # --- load lib writer
-        ic_tests_lib_id = "{}-{}-ic_tests".format(factor, tid)
-        ic_tests_lib = CManagerLibReader(
-            t_db_save_dir=ic_tests_dir,
-            t_db_name=ic_tests_lib_id + ".db"
-        )
-        ic_tests_lib_stru = sqlite3_tables[ic_tests_lib_id]
-        ic_tests_lib_tab = CTable(t_table_struct=ic_tests_lib_stru)
-        ic_tests_lib.set_default(t_default_table_name=ic_tests_lib_tab.m_table_name)
-
-        ic_df = ic_tests_lib.read_by_conditions(
-            t_conditions=[
-                ("trade_date", ">=", bgn_date),
-                ("trade_date", "<", stp_date),
-            ],
-            t_value_columns=["trade_date", "ic"]
-        ).set_index("trade_date")
-
+        ic_df = ic_dfs.get((factor, tid), pd.DataFrame({"ic": []}, dtype=float))
         ic_srs = ic_df["ic"]
         ic_data_by_fac[factor][tid] = ic_srs
         ic_data_by_tid[tid][factor] = ic_srs
@@ -130,18 +123,39 @@ def ic_tests_summary(
             "icir": ic_srs.mean() / ic_srs.std() * np.sqrt(252),
         })
 
+    # summary all
+    summary_df = pd.DataFrame(ic_tests_summary_data).sort_values(by=["tid", "icir"], ascending=[True, False])
+    pd.set_option("display.max_rows", 16)
+    for tid, tid_summary_df in summary_df.groupby(by="tid"):
+        tid_summary_file = "ic_summary-{}-{}-{}.csv".format(tid, bgn_date, stp_date)
+        tid_summary_df.to_csv(
+            os.path.join(ic_tests_summary_dir, tid_summary_file),
+            index=False, float_format="%.4f"
+        )
+        tid_summary_file = "ic_summary-{}-latest.csv".format(tid)
+        tid_summary_df.to_csv(
+            os.path.join(ic_tests_summary_dir, tid_summary_file),
+            index=False, float_format="%.4f"
+        )
+        print("\n-------------------\n...", tid, "ic summary")
+        print(tid_summary_df)
+
+    if not plot:
+        return 0
+
+    # charts are rendered after the csv files are saved, unchanged ones are skipped
+    renderer = CChartRenderer(save_dir=ic_tests_summary_dir, proc_num=proc_num)
+
     # plot by factor
     for f, f_data in ic_data_by_fac.items():
         ic_df_by_fac = pd.DataFrame(f_data)
         ic_df_by_fac_cumsum = ic_df_by_fac.cumsum()
-        plot_lines(
+        renderer.submit(
             t_plot_df=ic_df_by_fac_cumsum,
             t_fig_name="{}-ic-cumsum".format(f),
             t_ylim=(-150, 150),
             t_colormap="jet",
-            t_save_dir=ic_tests_summary_dir
         )
-        print("...", f, "plotted")
 
     # plot by tid
     for t, t_data in ic_data_by_tid.items():
@@ -152,29 +166,12 @@ def ic_tests_summary(
         head_factors = sorted_cumsum.head(8).index.to_list()
         tail_factors = sorted_cumsum.tail(8).index.to_list()
 
-        plot_lines(
+        renderer.submit(
             t_plot_df=ic_df_by_tid_cumsum[head_factors + tail_factors],
             t_fig_name="{}-ic-cumsum".format(t),
             t_colormap="jet",
             t_ylim=(-150, 150),
-            t_save_dir=ic_tests_summary_dir
         )
-        print("...", t, "plotted")
 
-    # summary all
-    summary_df = pd.DataFrame(ic_tests_summary_data).sort_values(by=["tid", "icir"], ascending=[True, False])
-    pd.set_option("display.max_rows", 16)
-    for tid, tid_summary_df in summary_df.groupby(by="tid"):
-        tid_summary_file = "ic_summary-{}-{}-{}.csv".format(tid, bgn_date, stp_date)
-        tid_summary_df.to_csv(
-            os.path.join(ic_tests_summary_dir, tid_summary_file),
-            index=False, float_format="%.4f"
-        )
-        tid_summary_file = "ic_summary-{}-latest.csv".format(tid)
-        tid_summary_df.to_csv(
-            os.path.join(ic_tests_summary_dir, tid_summary_file),
-            index=False, float_format="%.4f"
-        )
-        print("\n-------------------\n...", tid, "ic summary")
-        print(tid_summary_df)
+    renderer.close()
     return 0
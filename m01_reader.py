@@ -0,0 +1,124 @@
+import json
+import queue
+import threading
+import itertools as ittl
+import pandas as pd
+
+
+class CM01MajorContractReader(object):
+    """
+    Reads minute bars of the major contracts only, for a range of dates at
+    once. Consecutive dates of one instrument with the same major contract
+    are read in one query with the contract pushed into the conditions, so
+    a month costs a query or two for each instrument instead of one query
+    for each date and the bars of every contract.
+
+    Like any sqlite reader, it must be used and closed in the thread that
+    created it.
+    """
+
+    def __init__(self, futures_md_structure_path: str, futures_em01_db_name: str, futures_md_dir: str,
+                 m01_columns: list[str]):
+        # imported here, so iter_prefetched does not need skyrim
+        from skyrim.falkreath import CManagerLibReader, CTable
+
+        with open(futures_md_structure_path, "r") as j:
+            m01_table_struct = json.load(j)[futures_em01_db_name]["CTable"]
+        m01_table = CTable(t_table_struct=m01_table_struct)
+        self.m_db = CManagerLibReader(t_db_save_dir=futures_md_dir, t_db_name=futures_em01_db_name + ".db")
+        self.m_db.set_default(m01_table.m_table_name)
+        self.m_columns = m01_columns
+
+    def read(self, requests: list[tuple[str, str, str]]) -> tuple[dict, dict]:
+        """
+
+        :param requests: [(trade_date, instrument, major_contract), ...]
+        :return: ({(trade_date, instrument): m01_df}, {(trade_date, instrument): reason}), one m01_df for
+                 each request that is read, with an empty data frame if there is no bar
+        """
+        m01_dfs, errors = {}, {}
+        by_instrument = sorted(requests, key=lambda z: (z[1], z[0]))
+        for instrument, instrument_requests in ittl.groupby(by_instrument, key=lambda z: z[1]):
+            # consecutive dates with the same major contract are read in one query
+            for contract, run in ittl.groupby(instrument_requests, key=lambda z: z[2]):
+                trade_dates = [trade_date for trade_date, _, _ in run]
+                try:
+                    df = self._read_contract(contract, trade_dates[0], trade_dates[-1])
+                except Exception:
+                    # fall back to one query for each date, so only the dates which are not readable fail
+                    dfs = []
+                    for trade_date in trade_dates:
+                        try:
+                            dfs.append(self._read_contract(contract, trade_date, trade_date))
+                        except Exception as e:
+                            errors[(trade_date, instrument)] = "M01 is not readable: {}".format(e)
+                    df = pd.concat(dfs) if len(dfs) > 0 else None
+                for trade_date in trade_dates:
+                    if (trade_date, instrument) not in errors:
+                        m01_df = df.loc[df["trade_date"] == trade_date, self.m_columns]
+                        m01_dfs[(trade_date, instrument)] = m01_df.reset_index(drop=True)
+        return m01_dfs, errors
+
+    def _read_contract(self, contract: str, bgn_date: str, end_date: str) -> pd.DataFrame:
+        return self.m_db.read_by_conditions(
+            t_conditions=[
+                ("trade_date", ">=", bgn_date),
+                ("trade_date", "<=", end_date),
+                ("wind_code", "=", contract),
+            ],
+            t_value_columns=["trade_date"] + self.m_columns
+        )
+
+    def close(self):
+        self.m_db.close()
+
+
+def iter_prefetched(tasks: list, open_reader, read_fun):
+    """
+    Iterates (task, read_fun(reader, task)) while the next task is already
+    being read by a background thread, so reading overlaps with whatever
+    the caller does with the current one. The reader is opened, used and
+    closed in the background thread. If the caller stops early, the thread
+    finishes the read in progress, closes the reader and is joined.
+
+    :param tasks:
+    :param open_reader: called without arguments in the background thread
+    :param read_fun: read_fun(reader, task)
+    """
+    buffer, stop, cancel = queue.Queue(maxsize=1), object(), threading.Event()
+
+    def put(item) -> bool:
+        # waits for the buffer to be free, unless the caller is gone
+        while not cancel.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        reader = None
+        try:
+            reader = open_reader()
+            for task in tasks:
+                if cancel.is_set() or not put((task, read_fun(reader, task), None)):
+                    break
+        except Exception as e:
+            put((None, None, e))
+        finally:
+            if reader is not None:
+                reader.close()
+            put(stop)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while (item := buffer.get()) is not stop:
+            task, res, err = item
+            if err is not None:
+                raise err
+            yield task, res
+    finally:
+        cancel.set()
+        thread.join()
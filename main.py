@@ -16,18 +16,22 @@ from project_setup import research_summary_dir
 from project_config import sqlite3_tables
 from project_config import equity_indexes
 from project_config import factors
-from project_config import instruments_universe, tids
+from project_config import instruments_universe, tids, sub_win_width, tot_bar_num
 from project_config import train_windows
 from project_config import model_lbls
 from project_config import x_lbls, y_lbls
 from project_config import cost_rate
+from project_config import quantile_n
 from dp_00_features_and_return import split_spot_daily_k, cal_features_and_return
-from dp_01_convert_csv_to_sqlite3 import convert_csv_to_sqlite3
+from dp_01_convert_csv_to_sqlite3 import export_store_to_sqlite3
+from features_cube import build_features_cube
 from ic_tests import multi_process_fun_for_ic_tests
 from ic_tests import ic_tests_summary
 from group_tests import multi_process_fun_for_group_tests
 from group_tests import group_tests_summary
-from portfolios_linear import portfolios_linear_mp
+from group_tests import quantile_tests
+from factor_selection import update_factor_selection
+from portfolios_linear import portfolios_linear
 from ml_normalize import ml_normalize_mp
 from ml_train_rrcv import ml_rrcv_mp
 from ml_train_mlpc import ml_mlpc_mp
@@ -42,11 +46,14 @@ if __name__ == "__main__":
     switch = {
         "split": False,
         "features_and_return": False,
+        "cube": False,
         "toSql": False,
         "ic_tests": False,
         "ic_tests_summary": False,
         "group_tests": False,
         "group_tests_summary": False,
+        "quantile_tests": False,
+        "factor_selection": False,
         "portfolios_linear": False,
         "normalize": False,
         "rrcv": False,
@@ -69,16 +76,32 @@ if __name__ == "__main__":
             futures_md_dir=futures_md_dir,
             major_minor_dir=major_minor_dir,
             research_features_and_return_dir=research_features_and_return_dir,
+            sub_win_width=sub_win_width, tot_bar_num=tot_bar_num,
+            engine="pandas",
+            batch_freq=None,
+            selected_factors=None,
+            backend="numpy",
+            proc_num=None,
+            run_mode="o",
+            save_csv=False,
             verbose=False,
         )
 
+    if switch["cube"]:
+        build_features_cube(
+            research_features_and_return_dir=research_features_and_return_dir,
+            bgn_date=md_bgn_date, stp_date=md_stp_date,
+            instruments=instruments_universe, tids=tids,
+        )
+
     if switch["toSql"]:
-        convert_csv_to_sqlite3(
+        export_store_to_sqlite3(
             run_mode="o", bgn_date=md_bgn_date, stp_date=md_stp_date,
             calendar_path=calendar_path,
             research_features_and_return_dir=research_features_and_return_dir,
             equity_indexes=equity_indexes,
             sqlite3_tables=sqlite3_tables,
+            bulk_load=True,
         )
 
     if switch["ic_tests"]:
@@ -119,14 +142,34 @@ if __name__ == "__main__":
             sqlite3_tables=sqlite3_tables
         )
 
+    if switch["quantile_tests"]:
+        quantile_tests(
+            factors=factors, tids=tids,
+            quantile_n=quantile_n, cost_rate=cost_rate,
+            run_mode="o", bgn_date=md_bgn_date, stp_date=md_stp_date,
+            features_and_return_dir=research_features_and_return_dir,
+            group_tests_dir=research_group_tests_dir,
+            sqlite3_tables=sqlite3_tables,
+        )
+
+    if switch["factor_selection"]:
+        # only the months from the last one saved are calculated again, use "o" if the group tests
+        # of the months before it are changed, e.g. by a new kernel
+        update_factor_selection(
+            factors=factors, tids=tids,
+            run_mode="a",
+            group_tests_dir=research_group_tests_dir,
+            sqlite3_tables=sqlite3_tables,
+        )
+
     if switch["portfolios_linear"]:
-        portfolios_linear_mp(
-            proc_num=5,
+        portfolios_linear(
             tids=tids, bgn_date=md_bgn_date, stp_date=md_stp_date,
             features_and_return_dir=research_features_and_return_dir,
-            group_tests_summary_dir=research_group_tests_summary_dir,
+            group_tests_dir=research_group_tests_dir,
             portfolios_dir=research_portfolios_dir,
-            sqlite3_tables=sqlite3_tables
+            sqlite3_tables=sqlite3_tables,
+            cost_rate=cost_rate,
         )
 
     if switch["normalize"]:
@@ -179,12 +222,11 @@ if __name__ == "__main__":
         )
 
     if switch["summary"]:
-        for model_lbl in model_lbls:
-            ml_summary(
-                model_lbl=model_lbl,
-                instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
-                sqlite3_tables=sqlite3_tables,
-                predictions_dir=research_predictions_dir, navs_dir=research_navs_dir,
-                research_summary_dir=research_summary_dir,
-                cost_rate=cost_rate
-            )
+        ml_summary(
+            model_lbls=model_lbls,
+            instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
+            sqlite3_tables=sqlite3_tables,
+            predictions_dir=research_predictions_dir, navs_dir=research_navs_dir,
+            research_summary_dir=research_summary_dir,
+            cost_rate=cost_rate
+        )
@@ -3,7 +3,7 @@ import itertools as ittl
 import numpy as np
 import pandas as pd
 from skyrim.falkreath import CManagerLibReader, CTable
-from skyrim.riften import CNAV
+from trades_simulation import simulate_trades, cal_nav_indicators
 
 
 def cal_precision_and_recall(t_value: int, t_y_actu: np.ndarray, t_y_pred: np.ndarray):
@@ -30,21 +30,16 @@ def cal_precision_and_recall(t_value: int, t_y_actu: np.ndarray, t_y_pred: np.nd
     }
 
 
-def cal_trades(t_raw_df: pd.DataFrame, t_cost_rate: float):
-    ret_df = t_raw_df[["trade_date", "raw_ret"]].groupby("trade_date")[["raw_ret"]].apply(lambda z: z.mean(axis=0))
-    ret_df["net_ret"] = ret_df["raw_ret"] - t_cost_rate
-    ret_df["nav"] = (ret_df["net_ret"] + 1).cumprod()
-    nav = CNAV(t_raw_nav_srs=ret_df["net_ret"], t_annual_rf_rate=0, t_type="RET", t_freq="D")
-    nav.cal_all_indicators()
-    return nav.to_dict(t_type="eng"), ret_df[["net_ret", "nav"]]
-
-
 def ml_summary_model(model_lbl: str,
                      instrument: str | None, tid: str, trn_win: int,
-                     predictions_dir: str, navs_dir: str,
+                     predictions_dir: str,
                      sqlite3_tables: dict,
-                     cost_rate: float, ret_scale: int = 100
-                     ):
+                     ) -> tuple[dict, str, pd.DataFrame]:
+    """
+
+    :return: (summary_model, pred_id, predictions_df), trades of predictions_df are simulated by ml_summary
+             together with the other models
+    """
     model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
     pred_id = model_grp_id + "-pred-{}".format(model_lbl)
     predictions_lib = CManagerLibReader(
@@ -61,62 +56,89 @@ def ml_summary_model(model_lbl: str,
     if model_lbl in ["mlpc"]:
         predictions_df["pred"] = predictions_df["pred"] * 2 - 1
 
-    summary_header = {
+    # classify models
+    cls_df = predictions_df[["rtm", "pred"]].applymap(lambda z: 1 if z >= 0 else 0)
+    summary_model = {
         "model": model_lbl,
         "instrument": instrument,
         "tid": tid,
         "tmw": trn_win,
     }
-
-    # classify models
-    cls_df = predictions_df[["rtm", "pred"]].applymap(lambda z: 1 if z >= 0 else 0)
-    summary_model = summary_header.copy()
     summary_model.update(
         cal_precision_and_recall(t_value=1, t_y_actu=cls_df["rtm"], t_y_pred=cls_df["pred"]))
+    return summary_model, pred_id, predictions_df
 
-    # simu trades
-    predictions_df["raw_ret"] = np.sign(predictions_df["pred"]) * predictions_df["rtm"] / ret_scale
-    summary_trades = summary_header.copy()
-    sum_trades, nav_df = cal_trades(t_raw_df=predictions_df, t_cost_rate=cost_rate)
-    summary_trades.update(sum_trades)
-    nav_file = "{}-nav.csv.gz".format(pred_id)
-    nav_path = os.path.join(navs_dir, nav_file)
-    nav_df.to_csv(nav_path, float_format="%.8f")
-    return summary_model, summary_trades
 
-
-def ml_summary(model_lbl: str,
+def ml_summary(model_lbls: list[str],
                instruments_universe: list[str], tids: list[str], train_windows: list[int],
                sqlite3_tables: dict,
                predictions_dir: str, navs_dir: str,
                research_summary_dir: str,
-               cost_rate: float,
+               cost_rate: float, ret_scale: int = 100,
                ):
-    res_models, res_trades = [], []
-    for instrument, tid, train_window in ittl.product(instruments_universe + [None], tids, train_windows):
-        ans_model, ans_trade = ml_summary_model(
+    """
+    trades of all the models are simulated at once, each of them holds sign(pred) equally weighted in the
+    instruments it predicts on each date, from the checkpoint to the close, and pays cost_rate for opening and
+    closing each unit of weight, see trades_simulation
+
+    """
+    configs = list(ittl.product(model_lbls, instruments_universe + [None], tids, train_windows))
+    res_models, pred_ids, predictions_dfs = [], [], []
+    for model_lbl, instrument, tid, train_window in configs:
+        ans_model, pred_id, predictions_df = ml_summary_model(
             model_lbl=model_lbl,
             instrument=instrument, tid=tid, trn_win=train_window,
-            predictions_dir=predictions_dir, navs_dir=navs_dir,
+            predictions_dir=predictions_dir,
             sqlite3_tables=sqlite3_tables,
-            cost_rate=cost_rate
         )
         res_models.append(ans_model)
-        res_trades.append(ans_trade)
+        pred_ids.append(pred_id)
+        predictions_dfs.append(predictions_df)
         print("... | {:>8s} | {:>8s} | {:>3s} | TMW{:02d} | summarized |".format(
             model_lbl,
             instrument if instrument else "",
             tid if tid else "",
             train_window))
-    res_models_df, res_trades_df = pd.DataFrame(res_models), pd.DataFrame(res_trades)
-    res_trades_df["sharpe_ratio"] = res_trades_df["sharpe_ratio"].astype(float)
-
-    res_models_file = "summary.{}.models.csv".format(model_lbl)
-    res_trades_file = "summary.{}.trades.csv".format(model_lbl)
-    res_models_path = os.path.join(research_summary_dir, res_models_file)
-    res_trades_path = os.path.join(research_summary_dir, res_trades_file)
-    res_models_df.to_csv(
-        res_models_path, index=False, float_format="%.6f")
-    res_trades_df.sort_values(by="sharpe_ratio", ascending=False).head(20).to_csv(
-        res_trades_path, index=False, float_format="%.2f")
+
+    # --- positions of all the models, as the columns of one matrix
+    trade_dates = np.unique(np.concatenate([df["trade_date"].to_numpy(dtype=str) for df in predictions_dfs]))
+    instruments = sorted(set().union(*[df["instrument"] for df in predictions_dfs]))
+    instrument_idx = {z: i for i, z in enumerate(instruments)}
+    wgt = np.zeros((len(trade_dates), len(configs), len(instruments)))
+    ret = np.zeros((len(trade_dates), len(configs), len(instruments)))
+    traded = np.zeros((len(trade_dates), len(configs)), dtype=bool)
+    for c, df in enumerate(predictions_dfs):
+        d = np.searchsorted(trade_dates, df["trade_date"].to_numpy(dtype=str))
+        i = df["instrument"].map(instrument_idx).to_numpy()
+        n = df.groupby(by="trade_date")["trade_date"].transform("size").to_numpy()
+        wgt[d, c, i] = np.sign(df["pred"].to_numpy()) / n
+        ret[d, c, i] = df["rtm"].to_numpy() / ret_scale
+        traded[d, c] = True
+    _, turnover, net_ret = simulate_trades(wgt=wgt, ret=ret, cost_rate=cost_rate, traded=traded)
+    net_ret_df = pd.DataFrame(net_ret, index=pd.Index(trade_dates, name="trade_date"), columns=pred_ids)
+    nav_df, indicators_df = cal_nav_indicators(net_ret_df)
+    indicators_df["turnover"] = turnover.sum(axis=0) / traded.sum(axis=0)
+
+    res_trades = []
+    for c, ((model_lbl, instrument, tid, train_window), pred_id) in enumerate(zip(configs, pred_ids)):
+        nav_file = "{}-nav.csv.gz".format(pred_id)
+        nav_path = os.path.join(navs_dir, nav_file)
+        pd.DataFrame({"net_ret": net_ret_df[pred_id], "nav": nav_df[pred_id]})[traded[:, c]].to_csv(nav_path, float_format="%.8f")
+        summary_trades = {"model": model_lbl, "instrument": instrument, "tid": tid, "tmw": train_window}
+        summary_trades.update(indicators_df.loc[pred_id].to_dict())
+        res_trades.append(summary_trades)
+
+    for model_lbl in model_lbls:
+        res_models_df = pd.DataFrame([_ for _ in res_models if _["model"] == model_lbl])
+        res_trades_df = pd.DataFrame([_ for _ in res_trades if _["model"] == model_lbl])
+        res_trades_df["sharpe_ratio"] = res_trades_df["sharpe_ratio"].astype(float)
+
+        res_models_file = "summary.{}.models.csv".format(model_lbl)
+        res_trades_file = "summary.{}.trades.csv".format(model_lbl)
+        res_models_path = os.path.join(research_summary_dir, res_models_file)
+        res_trades_path = os.path.join(research_summary_dir, res_trades_file)
+        res_models_df.to_csv(
+            res_models_path, index=False, float_format="%.6f")
+        res_trades_df.sort_values(by="sharpe_ratio", ascending=False).head(20).to_csv(
+            res_trades_path, index=False, float_format="%.2f")
     return 0
@@ -4,10 +4,10 @@ import itertools as ittl
 import multiprocessing as mp
 import numpy as np
 from sklearn.linear_model import RidgeCV
-from skyrim.falkreath import CManagerLibReader, CTable
 from skyrim.whiterun import CCalendarMonthly
 from xfuns import save_to_sio_obj
 from xfuns import read_from_sio_obj
+from features_cube import CFeaturesCube
 
 
 def ml_rrcv_per_instru_and_tid(
@@ -21,7 +21,7 @@ def ml_rrcv_per_instru_and_tid(
     """
 
     :param instrument: like IC.CFE, and None means all the data
-    :param tid: ['T01',...,'T07']
+    :param tid: one of project_config.tids
     :param trn_win: [12,24,36]
     :param bgn_date: format = [YYYYMMDD]
     :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
@@ -44,13 +44,7 @@ def ml_rrcv_per_instru_and_tid(
     calendar = CCalendarMonthly(calendar_path)
 
     # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
-    )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    features_and_return_lib = CFeaturesCube(features_and_return_dir)
 
     # --- dates
     iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
@@ -2,90 +2,131 @@ import os
 import datetime as dt
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
-from skyrim.falkreath import CManagerLibReader, CTable
-from skyrim.winterhold import plot_lines
-
-
-def cal_portfolio_return(df: pd.DataFrame, selected_factors_df: pd.DataFrame, ret: str, ret_scale: int):
-    n = len(df)
-    m = int(n / 2)
-    d = n - 2 * m
-    lng_raw_wgt = np.array([1] * m + [0] * d + [0] * m)
-    srt_raw_wgt = np.array([0] * m + [0] * d + [1] * m)
-    lng_wgt = lng_raw_wgt / np.abs(lng_raw_wgt).sum()
-    srt_wgt = srt_raw_wgt / np.abs(srt_raw_wgt).sum()
-    hdg_wgt = lng_wgt * 0.5 - srt_wgt * 0.5
-    raw_wgt_data = {}
-    for fac, sig in selected_factors_df.itertuples(index=False):
-        sig_df = df[["instrument", fac]].sort_values(by=fac, ascending=False if sig > 0 else True)
-        raw_wgt_data[fac] = pd.Series(hdg_wgt, index=sig_df["instrument"])
-    raw_wgt_df = pd.DataFrame(raw_wgt_data)
-    tot_wgt_srs = raw_wgt_df.sum(axis=1)
-    tot_wgt_srs_abs_sum = tot_wgt_srs.abs().sum()
-    wgt_srs = tot_wgt_srs / tot_wgt_srs_abs_sum
-    port_ret = df[["instrument", ret]].set_index("instrument")[ret] @ wgt_srs / ret_scale
-    return port_ret
-
-
-def portfolios_linear_per_tid(
-        tid: str,
-        bgn_date: str, stp_date: str | None,
+from features_cube import CFeaturesCube
+from group_tests import tie_blocks, slot_shares
+from factor_selection import read_selected_factors
+from trades_simulation import cal_turnover, cal_net_ret, cal_nav_indicators
+
+
+def cal_portfolio_weights(x: np.ndarray, direction: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """
+    linear combination of the hedged groups of the selected factors: for each factor, the n instruments present
+    are sorted by the factor, descending if its direction is 1 and ascending if it is -1, with NaN last, and the
+    first int(n/2) are weighted 0.5 / int(n/2), the last int(n/2) -0.5 / int(n/2). Weights of all the factors
+    are summed and scaled to sum(abs(weights)) = 1. A block of ties across the cut of a group shares the weights
+    of the positions it takes evenly, as in group_tests.cal_group_return_of_tid, so the weights do not depend
+    on the order of the instruments.
+
+    :param x: [..., factor, instrument]
+    :param direction: [..., factor], 1 or -1 for the factors selected, 0 for the others
+    :param present: [..., instrument]
+    :return: [..., instrument], weights, 0 for the instruments not present, NaN if all of them are 0
+    """
+    bgn, stp = tie_blocks(x * direction[..., None], present[..., None, :])
+    n = present.sum(axis=-1)[..., None, None]
+    m = n // 2
+    hdg_wgt = (slot_shares(bgn, stp, 0, m) * 0.5 - slot_shares(bgn, stp, n - m, n) * 0.5) / np.maximum(m, 1)
+    tot_wgt = (hdg_wgt * (direction != 0)[..., None]).sum(axis=-2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return tot_wgt / np.abs(tot_wgt).sum(axis=-1, keepdims=True)
+
+
+def cal_portfolios_linear_of_tids(
+        cube: CFeaturesCube, tids: list[str], selected_by_tid: dict[str, dict[str, pd.DataFrame]],
+        bgn_date: str, stp_date: str, ret: str = "rtm", ret_scale: int = 100,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    weights and returns of the linear portfolios of all the tids and dates, from one slice of the cube
+
+    :param selected_by_tid: {tid: {trade_month: selected_factors_df}}, as read_selected_factors returns
+    :return: (trade_dates, traded, wgt, port_ret), traded.shape = port_ret.shape = (dates, tids),
+             wgt.shape = (dates, tids, instruments), dates of a tid without selected factors, or without
+             any instrument, are not traded
+    """
+    date_slice = cube.date_slice(bgn_date, stp_date)
+    trade_dates = cube.dates[date_slice]
+    trade_months = np.array([_[0:6] for _ in trade_dates.tolist()])
+    selected_factors = sorted(set().union(*[df["factor"] for by_month in selected_by_tid.values() for df in by_month.values()]))
+    factor_idx = {f: k for k, f in enumerate(selected_factors)}
+
+    # direction of each factor, on each date of each tid
+    direction = np.zeros((len(trade_dates), len(tids), len(selected_factors)))
+    traded = np.zeros((len(trade_dates), len(tids)), dtype=bool)
+    for t, tid in enumerate(tids):
+        for trade_month, selected_factors_df in selected_by_tid[tid].items():
+            in_month = trade_months == trade_month
+            direction[np.ix_(in_month, [t], selected_factors_df["factor"].map(factor_idx).to_numpy())] = \
+                selected_factors_df["direction"].to_numpy()
+            traded[in_month, t] = True
+
+    tid_ids = [cube.tid_index(tid) for tid in tids]
+    present = cube.present(bgn_date, stp_date)[:, :, tid_ids].transpose(0, 2, 1)  # [date, tid, instrument]
+    values = cube.sel(bgn_date, stp_date)[:, :, tid_ids]  # [date, instrument, tid, column]
+    x = values[..., [cube.column_index(f) for f in selected_factors]].transpose(0, 2, 3, 1)  # [date, tid, factor, instrument]
+    y = np.where(present, values[..., cube.column_index(ret)].transpose(0, 2, 1), 0)  # [date, tid, instrument]
+    wgt = cal_portfolio_weights(x, direction, present)
+    port_ret = (y * wgt).sum(axis=-1) / ret_scale
+    return trade_dates, traded & present.any(axis=-1), wgt, port_ret
+
+
+def portfolios_linear(
+        tids: list[str], bgn_date: str, stp_date: str | None,
         features_and_return_dir: str,
-        group_tests_summary_dir: str,
+        group_tests_dir: str,
+        portfolios_dir: str,
         sqlite3_tables: dict,
+        cost_rate: float,
 ):
-    # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
+    """
+    besides the returns without costs, net returns are saved with cost_rate paid for opening and closing each
+    unit of weight on every date traded, as trades_simulation.simulate_trades does. stp_date = None
+    calculates bgn_date only, as quantile_tests does
+
+    """
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # factors selected for each month before it starts, by factor_selection.update_factor_selection
+    selected_by_tid = read_selected_factors(tids, bgn_date, stp_date, group_tests_dir, sqlite3_tables)
+
+    # --- load cube, all the tids are calculated at once
+    features_and_return_cube = CFeaturesCube(features_and_return_dir)
+    trade_dates, traded, wgt, port_ret = cal_portfolios_linear_of_tids(
+        features_and_return_cube, tids, selected_by_tid, bgn_date, stp_date)
+    has_trade = traded.any(axis=1)
+    tid_ret_df = pd.DataFrame(
+        np.where(traded, port_ret, np.nan)[has_trade], index=trade_dates[has_trade], columns=tids).fillna(0)
+
+    # --- costs, by the turnover of the weights
+    turnover = cal_turnover(np.nan_to_num(wgt, nan=0), traded)
+    net_ret = np.where(traded, cal_net_ret(np.nan_to_num(port_ret, nan=0), turnover, cost_rate), np.nan)
+    tid_net_ret_df = pd.DataFrame(net_ret[has_trade], index=pd.Index(trade_dates[has_trade], name="trade_date"), columns=tids)
+    _, net_indicators_df = cal_nav_indicators(tid_net_ret_df)
+    net_indicators_df["turnover"] = turnover.sum(axis=0) / np.maximum(traded.sum(axis=0), 1)
+    tid_net_ret_df.fillna(0).to_csv(
+        os.path.join(portfolios_dir, "portfolios-linear-net-ret.csv.gz"),
+        float_format="%.8f"
     )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
-
-    selected_factors_df = pd.read_csv(
-        os.path.join(group_tests_summary_dir, "selected-factors-{}.csv.gz".format(tid))
-    )
-    selected_factors = selected_factors_df["factor"].tolist()
-
-    src_df = features_and_return_lib.read_by_conditions(
-        t_conditions=[
-            ("trade_date", ">=", bgn_date),
-            ("trade_date", "<", stp_date),
-            ("tid", "=", tid),
-        ],
-        t_value_columns=["trade_date", "instrument", "tid"] + selected_factors + ["rtm"]
+    net_indicators_df.T.to_csv(
+        os.path.join(portfolios_dir, "portfolios-linear-net-eval.csv"),
+        index_label="indicator",
+        float_format="%.6f"
     )
 
-    portfolio_ret_srs = src_df.groupby(by="trade_date").apply(
-        cal_portfolio_return, selected_factors_df=selected_factors_df, ret="rtm", ret_scale=100)
-
-    return portfolio_ret_srs
-
+    # weights of the dates traded, for turnover
+    d, t = np.nonzero(traded)
+    tid_wgt_df = pd.DataFrame(np.nan_to_num(wgt[d, t], nan=0), columns=features_and_return_cube.instruments)
+    tid_wgt_df.insert(0, "tid", np.array(tids)[t])
+    tid_wgt_df.insert(0, "trade_date", trade_dates[d])
+    tid_wgt_df.sort_values(by=["tid", "trade_date"]).to_csv(
+        os.path.join(portfolios_dir, "portfolios-linear-wgt.csv.gz"),
+        index=False, float_format="%.8f"
+    )
 
-def portfolios_linear_mp(
-        proc_num: int,
-        tids: list[str], portfolios_dir: str,
-        **kwargs
-):
-    pool = mp.Pool(processes=proc_num)
-    res = []
-    for tid in tids:
-        print("...", "@", dt.datetime.now(), tid, "started")
-        t = pool.apply_async(
-            portfolios_linear_per_tid,
-            args=(tid,),
-            kwds=kwargs,
-        )
-        res.append(t)
-
-    tid_ret_data = {}
-    for tid, _ in zip(tids, res):
-        tid_ret_data[tid] = _.get()
-    tid_ret_df = pd.DataFrame(tid_ret_data).fillna(0)
     tid_ret_df_cumsum = tid_ret_df.cumsum()
 
+    # imported here, so the weights and returns above do not need skyrim
+    from skyrim.winterhold import plot_lines
     plot_lines(t_plot_df=tid_ret_df_cumsum,
                t_fig_name="portfolios-linear-nav",
                t_colormap="jet",
@@ -118,5 +159,6 @@ def portfolios_linear_mp(
     print("\n", tid_ret_df)
     print("\n", tid_ret_df_cumsum)
     print("\n", performance_df)
+    print("\n", net_indicators_df.T)
 
     return 0
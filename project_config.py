@@ -69,42 +69,105 @@ sqlite3_tables = {
 }
 
 instruments_universe = ["IC.CFE", "IH.CFE", "IF.CFE", "IM.CFE"]
-tids = ["T{:02d}".format(t) for t in range(1, 8)]
+
+# --- checkpoint grid
+# a checkpoint every sub_win_width bars of the tot_bar_num bars of a day, except the close,
+# e.g. sub_win_width = 30, 10, 5 gives 7, 23, 47 tids
+sub_win_width, tot_bar_num = 30, 240
+tids = ["T{:02d}".format(t) for t in range(1, int(tot_bar_num / sub_win_width))]
+
+# --- features manifest
+# recorded with the features and return of each day, days saved by another version are recalculated
+# by the append mode of cal_features_and_return, bump it whenever the kernels change their outputs
+features_kernel_version = "1"
+
 train_windows = (12, 24, 36)
 x_lbls, y_lbls = factors, ["rtm"]
 
-# --- ic tests
-for factor, tid in ittl.product(factors, tids):
-    ic_tests_lib_id = "{}-{}-ic_tests".format(factor, tid)
-    sqlite3_tables.update({
-        ic_tests_lib_id: {
-            "table_name": "ic_tests",
-            "primary_keys": {
-                "trade_date": "TEXT",
-            },
-            "value_columns": {
-                "obs": "INTEGER",
-                "ic": "REAL",
-            }
+# --- ic tests, of all the factors and tids in one table
+sqlite3_tables.update({
+    "ic_tests": {
+        "table_name": "ic_tests",
+        "primary_keys": {
+            "factor": "TEXT",
+            "tid": "TEXT",
+            "trade_date": "TEXT",
         },
-    })
+        "value_columns": {
+            "obs": "INTEGER",
+            "ic": "REAL",
+        }
+    },
+})
 
-# --- ic tests
-for factor, tid in ittl.product(factors, tids):
-    group_tests_lib_id = "{}-{}-group_tests".format(factor, tid)
-    sqlite3_tables.update({
-        group_tests_lib_id: {
-            "table_name": "ic_tests",
-            "primary_keys": {
-                "trade_date": "TEXT",
-            },
-            "value_columns": {
-                "lng": "REAL",
-                "srt": "REAL",
-                "hdg": "REAL",
-            }
+# --- group tests, of all the factors and tids in one table
+sqlite3_tables.update({
+    "group_tests": {
+        "table_name": "group_tests",
+        "primary_keys": {
+            "factor": "TEXT",
+            "tid": "TEXT",
+            "trade_date": "TEXT",
         },
-    })
+        "value_columns": {
+            "lng": "REAL",
+            "srt": "REAL",
+            "hdg": "REAL",
+        }
+    },
+})
+
+# --- factor selection, walk-forward by month from group tests
+sqlite3_tables.update({
+    "group_tests_monthly": {
+        "table_name": "group_tests_monthly",
+        "primary_keys": {
+            "factor": "TEXT",
+            "tid": "TEXT",
+            "trade_month": "TEXT",
+        },
+        "value_columns": {
+            "obs": "INTEGER",
+            "hdg_sum": "REAL",
+            "hdg_sum_sq": "REAL",
+            "cum_obs": "INTEGER",
+            "cum_sum": "REAL",
+            "cum_sum_sq": "REAL",
+        }
+    },
+    "selected_factors": {
+        "table_name": "selected_factors",
+        "primary_keys": {
+            "tid": "TEXT",
+            "trade_month": "TEXT",
+            "factor": "TEXT",
+        },
+        "value_columns": {
+            "direction": "INTEGER",
+        }
+    },
+})
+
+# --- quantile tests, of all the factors and tids in one table
+# instruments are split into quantile_n buckets by each factor, bucket 0 holds the largest values
+quantile_n = 5
+sqlite3_tables.update({
+    "quantile_tests": {
+        "table_name": "quantile_tests",
+        "primary_keys": {
+            "factor": "TEXT",
+            "tid": "TEXT",
+            "trade_date": "TEXT",
+            "bucket": "INTEGER",
+        },
+        "value_columns": {
+            "obs": "INTEGER",
+            "ret": "REAL",
+            "turnover": "REAL",
+            "net": "REAL",
+        }
+    },
+})
 
 model_lbls = ["rrcv", "mlpc"]
 for instrument, tid, trn_win, model_lbl in ittl.product(
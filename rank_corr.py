@@ -0,0 +1,120 @@
+import numpy as np
+
+
+def _count_below(ref: np.ndarray, ref_valid: np.ndarray, q: np.ndarray) -> np.ndarray:
+    # for each q: number of valid ref < q, plus half of valid ref == q
+    ref, ref_valid, q = ref[..., None, :], ref_valid[..., None, :], q[..., :, None]
+    return ((ref < q) & ref_valid).sum(axis=-1) + 0.5 * ((ref == q) & ref_valid).sum(axis=-1)
+
+
+class CExpandingSpearman(object):
+    """
+    Spearman correlation of an expanding window of (x, y) pairs.
+
+    Average ranks of the pairs already seen are kept and only shifted by
+    the pairs of each new block, so a block of w pairs costs O(n * w)
+    instead of re-ranking all n pairs. Like pd.DataFrame.corr(method="spearman"),
+    only pairs with both values finite are used.
+
+    Leading axes are independent windows, e.g. (days,) or (pairs, days),
+    and the last axis is the one that expands.
+    """
+
+    def __init__(self, shape: tuple[int, ...], capacity: int):
+        self.m_size = 0
+        self.m_x = np.empty(shape + (capacity,))
+        self.m_y = np.empty(shape + (capacity,))
+        self.m_valid = np.zeros(shape + (capacity,), dtype=bool)
+        self.m_rank_x = np.zeros(shape + (capacity,))
+        self.m_rank_y = np.zeros(shape + (capacity,))
+
+    def update(self, x_new: np.ndarray, y_new: np.ndarray) -> np.ndarray:
+        """
+
+        :param x_new: shape = shape + (w,)
+        :param y_new: shape = shape + (w,)
+        :return: Spearman correlation of all the pairs seen so far, shape = shape
+        """
+        n0, n1 = self.m_size, self.m_size + x_new.shape[-1]
+        valid_new = np.isfinite(x_new) & np.isfinite(y_new)
+        for x, rank, v in [(self.m_x, self.m_rank_x, x_new), (self.m_y, self.m_rank_y, y_new)]:
+            old, old_valid = x[..., 0:n0], self.m_valid[..., 0:n0]
+            rank[..., 0:n0] += _count_below(v, valid_new, old)
+            rank[..., n0:n1] = _count_below(old, old_valid, v) + _count_below(v, valid_new, v) + 0.5
+            x[..., n0:n1] = v
+        self.m_valid[..., n0:n1] = valid_new
+        self.m_size = n1
+        return self.corr()
+
+    def corr(self) -> np.ndarray:
+        valid = self.m_valid[..., 0:self.m_size]
+        nobs = valid.sum(axis=-1)
+        mean = (nobs[..., None] + 1) / 2
+        vx = np.where(valid, self.m_rank_x[..., 0:self.m_size] - mean, 0)
+        vy = np.where(valid, self.m_rank_y[..., 0:self.m_size] - mean, 0)
+        divisor = np.sqrt((vx * vx).sum(axis=-1) * (vy * vy).sum(axis=-1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(divisor != 0, (vx * vy).sum(axis=-1) / divisor, np.nan)
+
+
+def spearman_of_heads(x: np.ndarray, y: np.ndarray, heads: list[int]) -> list[np.ndarray]:
+    """
+
+    :param x: shape = (..., n), already sorted by the key that defines the heads, e.g. volume
+    :param y: shape = (..., n)
+    :param heads: increasing sizes k, the correlation of x[..., 0:k] and y[..., 0:k] is returned for each one
+    :return: one array with shape = (...) for each k
+    """
+    engine = CExpandingSpearman(shape=x.shape[:-1], capacity=max(heads, default=0))
+    res, k0 = [], 0
+    for k in heads:
+        res.append(engine.update(x[..., k0:k], y[..., k0:k]))
+        k0 = k
+    return res
+
+
+def _subset_ranks(x: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    # average rank of each member of each subset among the members of that subset, 0 for non members
+    bar_num = x.shape[-1]
+    order = np.argsort(x, axis=-1, kind="stable")
+    sorted_x = np.take_along_axis(x, order, axis=-1)
+    sorted_masks = np.take_along_axis(masks, order[..., None], axis=-2)
+    cum_members = np.cumsum(sorted_masks, axis=-2)
+
+    # first and last sorted position of the group of ties of each sorted position
+    grp_head = np.ones(sorted_x.shape, dtype=bool)
+    grp_head[..., 1:] = sorted_x[..., 1:] != sorted_x[..., :-1]
+    grp_tail = np.ones(sorted_x.shape, dtype=bool)
+    grp_tail[..., :-1] = grp_head[..., 1:]
+    pos = np.arange(bar_num)
+    grp_bgn = np.maximum.accumulate(np.where(grp_head, pos, 0), axis=-1)
+    grp_end = np.minimum.accumulate(np.where(grp_tail, pos, bar_num - 1)[..., ::-1], axis=-1)[..., ::-1]
+
+    below = np.where(grp_bgn[..., None] > 0,
+                     np.take_along_axis(cum_members, np.maximum(grp_bgn - 1, 0)[..., None], axis=-2), 0)
+    below_or_tied = np.take_along_axis(cum_members, grp_end[..., None], axis=-2)
+    sorted_ranks = np.where(sorted_masks, below + (below_or_tied - below + 1) / 2, 0)
+    return np.take_along_axis(sorted_ranks, np.argsort(order, axis=-1)[..., None], axis=-2)
+
+
+def spearman_of_subsets(x: np.ndarray, y: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    """
+    Spearman correlation of many subsets of the same (x, y) pairs at once.
+    x and y are sorted once, and the ranks within every subset are read
+    from cumulative member counts along the sorted order, so the cost is
+    O(n * subsets) after the sort, without a loop over the subsets.
+
+    :param x: shape = (..., n)
+    :param y: shape = (..., n)
+    :param masks: shape = (..., n, subsets), True if the pair belongs to the subset, e.g. the first k bars
+    :return: shape = (..., subsets), pairs with any value not finite are left out, as in pd.DataFrame.corr
+    """
+    masks = np.broadcast_to(masks, x.shape + masks.shape[-1:]) & (np.isfinite(x) & np.isfinite(y))[..., None]
+    rank_x, rank_y = _subset_ranks(x, masks), _subset_ranks(y, masks)
+    mean = (masks.sum(axis=-2, keepdims=True) + 1) / 2
+    vx = np.where(masks, rank_x - mean, 0)
+    vy = np.where(masks, rank_y - mean, 0)
+    divisor = np.sqrt((vx * vx).sum(axis=-2) * (vy * vy).sum(axis=-2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(divisor != 0, (vx * vy).sum(axis=-2) / divisor, np.nan)
+
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import pandas as pd
+
+
+class CResultStore(object):
+    """
+    One sqlite3 table for the results of all the factors and tids of a stage, keyed by the primary keys of
+    its table struct, like {"factor": "TEXT", "tid": "TEXT", "trade_date": "TEXT"}.
+
+    update() inserts the rows of a data frame in one transaction, replacing the rows with the same keys, so
+    new dates are appended and the dates calculated again are replaced, without rewriting the others.
+    read_by_conditions() takes the same arguments as CManagerLibReader, and reads all the rows it needs in
+    one query.
+    """
+
+    def __init__(self, save_dir: str, db_name: str, table_struct: dict):
+        self.m_db_path = os.path.join(save_dir, db_name)
+        self.m_table_name = table_struct["table_name"]
+        self.m_key_cols = list(table_struct["primary_keys"])
+        self.m_columns = self.m_key_cols + list(table_struct["value_columns"])
+        self.m_col_types = dict(table_struct["primary_keys"], **table_struct["value_columns"])
+        self.m_connection = sqlite3.connect(self.m_db_path, timeout=60)
+
+    def initialize_table(self, t_remove_existence: bool = False):
+        if t_remove_existence:
+            self.m_connection.execute("DROP TABLE IF EXISTS {}".format(self.m_table_name))
+        self.m_connection.execute("CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}))".format(
+            self.m_table_name,
+            ", ".join("{} {}".format(c, self.m_col_types[c]) for c in self.m_columns),
+            ", ".join(self.m_key_cols)))
+        self.m_connection.commit()
+
+    def update(self, t_update_df: pd.DataFrame):
+        """
+
+        :param t_update_df: with all the columns of the table
+        """
+        sql = "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+            self.m_table_name, ", ".join(self.m_columns), ", ".join(["?"] * len(self.m_columns)))
+        with self.m_connection:
+            self.m_connection.executemany(sql, t_update_df[self.m_columns].to_numpy(dtype=object).tolist())
+
+    @staticmethod
+    def _where(t_conditions: list[tuple[str, str, object]]) -> str:
+        return "" if len(t_conditions) == 0 else " WHERE " + " AND ".join("{} {} ?".format(c, op) for c, op, _ in t_conditions)
+
+    def remove(self, t_conditions: list[tuple[str, str, object]]):
+        with self.m_connection:
+            self.m_connection.execute("DELETE FROM {}".format(self.m_table_name) + self._where(t_conditions),
+                                      [v for _, _, v in t_conditions])
+
+    def read_by_conditions(self, t_conditions: list[tuple[str, str, object]], t_value_columns: list[str]) -> pd.DataFrame:
+        sql = "SELECT {} FROM {}".format(", ".join(t_value_columns), self.m_table_name) + self._where(t_conditions)
+        return pd.read_sql(sql, self.m_connection, params=[v for _, _, v in t_conditions])
+
+    def max_of(self, t_column: str, t_conditions: list[tuple[str, str, object]] | None = None):
+        """
+
+        :return: the largest value of t_column in the rows meeting t_conditions, None if there is no row
+        """
+        t_conditions = [] if t_conditions is None else t_conditions
+        sql = "SELECT MAX({}) FROM {}".format(t_column, self.m_table_name) + self._where(t_conditions)
+        return self.m_connection.execute(sql, [v for _, _, v in t_conditions]).fetchone()[0]
+
+    def close(self):
+        self.m_connection.close()
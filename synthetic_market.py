@@ -0,0 +1,116 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+# instrument -> (spot code, contract multiplier, price level of the spot index)
+synthetic_instruments = {
+    "IH.CFE": ("000016.SH", 300, 2600.0),
+    "IF.CFE": ("000300.SH", 300, 3900.0),
+    "IC.CFE": ("000905.SH", 200, 6000.0),
+    "IM.CFE": ("000852.SH", 200, 6500.0),
+}
+
+m01_id_cols = ["timestamp", "loc_id", "instrument", "exchange", "wind_code"]
+m01_val_cols = [
+    "open", "high", "low", "close",
+    "volume", "amount", "oi",
+    "daily_open", "daily_high", "daily_low",
+    "preclose", "preoi",
+]
+
+
+def _session_timestamps(trade_date: str, tot_bar_num: int) -> np.ndarray:
+    # from 09:30 and 13:00, one bar a minute, labelled by the start of the bar
+    am = dt.datetime.strptime(trade_date + "0930", "%Y%m%d%H%M").timestamp()
+    pm = dt.datetime.strptime(trade_date + "1300", "%Y%m%d%H%M").timestamp()
+    am_bar_num = tot_bar_num // 2
+    return np.concatenate([am + 60 * np.arange(am_bar_num), pm + 60 * np.arange(tot_bar_num - am_bar_num)]).astype(np.int64)
+
+
+def _intraday_profile(tot_bar_num: int) -> np.ndarray:
+    # U-shaped: busy after the open and before the close, quiet around the lunch break
+    x = np.linspace(-1, 1, tot_bar_num)
+    return 0.6 + 1.4 * x ** 2
+
+
+def gen_synthetic_session(rng: np.random.Generator, trade_date: str, instrument: str, contract: str,
+                          preclose: float, preoi: float, contract_multiplier: int,
+                          daily_vol: float = 0.012, avg_volume: float = 80.0,
+                          tick: float = 0.2, amount_scale: float = 1e4, tot_bar_num: int = 240) -> pd.DataFrame:
+    """
+
+    :param rng:
+    :param trade_date: YYYYMMDD
+    :param instrument: like "IH.CFE"
+    :param contract: like "IH2306.CFE"
+    :param preclose: close of the contract on the previous trade date
+    :param preoi: open interest of the contract on the previous trade date
+    :param contract_multiplier:
+    :param daily_vol: volatility of the daily return, minute returns are fat-tailed and follow the U-shaped profile
+    :param avg_volume: average volume of a minute bar
+    :param tick: minimum price change
+    :param amount_scale: amount is saved in units of amount_scale, as in the M01 library
+    :param tot_bar_num:
+    :return: minute bars with the same columns as the M01 library, ready for cal_features_and_return_one_day
+    """
+    profile = _intraday_profile(tot_bar_num)
+    bar_vol = daily_vol * np.sqrt(profile / profile.sum())
+    ret = bar_vol * rng.standard_t(df=4, size=tot_bar_num) / np.sqrt(2)
+    day_open = np.round(preclose * (1 + rng.normal(0, 0.3 * daily_vol)) / tick) * tick
+    close = np.round(day_open * np.exp(np.cumsum(ret)) / tick) * tick
+    open_ = np.concatenate([[day_open], close[:-1]])
+    wick = np.abs(rng.normal(0, 0.5, size=(2, tot_bar_num))) * bar_vol * preclose
+    high = np.round((np.maximum(open_, close) + wick[0]) / tick) * tick
+    low = np.round((np.minimum(open_, close) - wick[1]) / tick) * tick
+
+    # volume follows the profile and the size of the move
+    move = np.abs(close - open_) / (bar_vol * preclose)
+    volume = rng.poisson(avg_volume * profile * (0.5 + 0.5 * move) * rng.lognormal(0, 0.3)).astype(np.float64)
+    vwap = np.clip((open_ + high + low + close) / 4 + rng.normal(0, 0.2, tot_bar_num) * tick, low, high)
+    amount = np.round(volume * vwap * contract_multiplier / amount_scale, 4)
+    oi = preoi + np.cumsum(rng.integers(-3, 4, tot_bar_num) * np.minimum(volume, 1))
+
+    code, exchange = contract.split(".")
+    return pd.DataFrame({
+        "timestamp": _session_timestamps(trade_date, tot_bar_num),
+        "loc_id": code,
+        "instrument": instrument.split(".")[0],
+        "exchange": exchange,
+        "wind_code": contract,
+        "open": open_, "high": high, "low": low, "close": close,
+        "volume": volume, "amount": amount, "oi": oi,
+        "daily_open": day_open,
+        "daily_high": np.maximum.accumulate(high),
+        "daily_low": np.minimum.accumulate(low),
+        "preclose": preclose, "preoi": preoi,
+    })[m01_id_cols + m01_val_cols]
+
+
+def gen_synthetic_market(instrument: str, bgn_date: str, days: int, seed: int = 0,
+                         tot_bar_num: int = 240) -> list[tuple[str, str, float, float, pd.DataFrame]]:
+    """
+
+    :param instrument: one of synthetic_instruments
+    :param bgn_date: YYYYMMDD, first trade date, trade dates are business days
+    :param days: number of trade dates
+    :param seed:
+    :param tot_bar_num:
+    :return: one (trade_date, major_contract, pre_settle, pre_spot_close, m01_df) a day, the same blocks
+             dp_00_features_and_return.cal_features_and_return builds from the libraries
+    """
+    rng = np.random.default_rng(seed)
+    _, contract_multiplier, spot = synthetic_instruments[instrument]
+    basis = rng.normal(-0.004, 0.004)
+    close, oi = np.round(spot * (1 + basis) / 0.2) * 0.2, 1e5
+    res = []
+    for trade_date in pd.bdate_range(start=bgn_date, periods=days).strftime("%Y%m%d"):
+        contract = "{}{}.CFE".format(instrument.split(".")[0], trade_date[2:6])
+        pre_spot_close, pre_settle = spot, np.round(close * (1 + rng.normal(0, 2e-4)) / 0.2) * 0.2
+        m01_df = gen_synthetic_session(rng, trade_date, instrument, contract, close, oi, contract_multiplier,
+                                       daily_vol=rng.uniform(0.008, 0.02), tot_bar_num=tot_bar_num)
+        res.append((trade_date, contract, pre_settle, pre_spot_close, m01_df))
+
+        close, oi = m01_df["close"].iloc[-1], m01_df["oi"].iloc[-1]
+        basis = 0.95 * basis + rng.normal(-0.0002, 0.001)
+        spot = close / (1 + basis)
+    return res
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import charts
+from charts import CChartRenderer, charts_manifest_file
+
+
+def fake_render(plot_kwargs: dict) -> str:
+    # stands for plot_lines, a chart with a column named "fail" can not be rendered
+    if "fail" in plot_kwargs["t_plot_df"].columns:
+        raise ValueError("can not plot {}".format(plot_kwargs["t_fig_name"]))
+    plot_kwargs["t_plot_df"].to_csv(os.path.join(plot_kwargs["t_save_dir"], plot_kwargs["t_fig_name"] + ".pdf"))
+    return plot_kwargs["t_fig_name"]
+
+
+@pytest.fixture
+def renderer_of(tmp_path, monkeypatch):
+    # workers are forked, so they render with the stub and do not need matplotlib
+    monkeypatch.setattr(charts, "_render", fake_render)
+    monkeypatch.setattr(charts, "_init_render_worker", lambda: None)
+    return lambda: CChartRenderer(save_dir=str(tmp_path), proc_num=2)
+
+
+def read_manifest(save_dir: str) -> dict[str, str]:
+    manifest_df = pd.read_csv(os.path.join(save_dir, charts_manifest_file), dtype=str)
+    return dict(zip(manifest_df["fig_name"], manifest_df["fingerprint"]))
+
+
+def test_only_changed_charts_are_rendered_again(renderer_of, tmp_path):
+    rng = np.random.default_rng(0)
+    a_df, b_df = pd.DataFrame({"x": rng.normal(size=10)}), pd.DataFrame({"y": rng.normal(size=10)})
+    renderer = renderer_of()
+    assert renderer.submit(a_df, "a", t_colormap="jet")
+    assert renderer.submit(b_df, "b", t_colormap="jet")
+    renderer.close()
+    assert os.path.exists(tmp_path / "a.pdf") and os.path.exists(tmp_path / "b.pdf")
+    assert sorted(read_manifest(str(tmp_path))) == ["a", "b"]
+
+    # unchanged charts are skipped, a changed series or argument is rendered again
+    renderer = renderer_of()
+    assert not renderer.submit(a_df, "a", t_colormap="jet")
+    b_df.iloc[3, 0] += 1
+    assert renderer.submit(b_df, "b", t_colormap="jet")
+    renderer.close()
+    assert renderer.m_skipped == 1
+    assert pd.read_csv(tmp_path / "b.pdf", index_col=0)["y"].iloc[3] == pytest.approx(b_df["y"].iloc[3])
+    renderer = renderer_of()
+    assert not renderer.submit(b_df, "b", t_colormap="jet")
+    assert renderer.submit(a_df, "a", t_colormap="viridis")
+    renderer.close()
+
+    # a chart recorded but not saved any more is rendered again
+    os.remove(tmp_path / "a.pdf")
+    renderer = renderer_of()
+    assert renderer.submit(a_df, "a", t_colormap="viridis")
+    renderer.close()
+
+
+def test_failed_charts_are_dropped_from_the_manifest(renderer_of, tmp_path, capsys):
+    renderer = renderer_of()
+    renderer.submit(pd.DataFrame({"x": [1.0, 2.0]}), "a")
+    renderer.submit(pd.DataFrame({"x": [1.0, 2.0]}), "b")
+    renderer.close()
+
+    renderer = renderer_of()
+    assert renderer.submit(pd.DataFrame({"fail": [1.0, 2.0]}), "b")
+    assert renderer.submit(pd.DataFrame({"fail": [1.0, 2.0]}), "c")
+    renderer.close()
+    assert "Warning! b is not rendered" in capsys.readouterr().out
+    assert sorted(read_manifest(str(tmp_path))) == ["a"]
+
+    # so they are rendered again next time, even if the file of the last success is still saved
+    renderer = renderer_of()
+    assert renderer.submit(pd.DataFrame({"x": [1.0, 2.0]}), "b")
+    renderer.close()
+    assert sorted(read_manifest(str(tmp_path))) == ["a", "b"]
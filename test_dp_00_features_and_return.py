@@ -0,0 +1,84 @@
+import pandas as pd
+import dp_00_features_and_return as dp_00
+from features_jit import jit_available
+from features_manifest import CFeaturesManifest
+from features_store import CFeaturesStore
+from project_config import features_kernel_version
+from synthetic_market import gen_synthetic_market
+from dp_00_features_and_return import kernel_label, split_read_chunks
+from dp_00_features_and_return import cal_features_and_return_for_batches, cal_features_and_return_for_chunk
+
+
+def test_kernel_label():
+    v = features_kernel_version
+    assert kernel_label("pandas", None, "jit") == v + ".pandas"
+    assert kernel_label("vec", None, "numpy") == v + ".vec-numpy"
+    assert kernel_label("pandas", "month", "numpy") == v + ".vec-numpy"
+    assert kernel_label("vec", "year", "jit") == v + (".vec-jit" if jit_available else ".vec-numpy")
+
+
+class CSyntheticM01Reader(object):
+    # stands for CM01MajorContractReader, with the bars of synthetic_market
+    def __init__(self, m01_dfs: dict[tuple[str, str], pd.DataFrame]):
+        self.m_m01_dfs = m01_dfs
+
+    def read(self, requests: list[tuple[str, str, str]]) -> tuple[dict, dict]:
+        return {(trade_date, instrument): self.m_m01_dfs[(trade_date, instrument)] for trade_date, instrument, _ in requests}, {}
+
+    def close(self):
+        pass
+
+
+def synthetic_kwargs(tmp_path, monkeypatch) -> tuple[list, dict]:
+    blocks = gen_synthetic_market("IF.CFE", "20230116", 20)  # 12 days in January and 8 in February
+    prev_dates = ["20230113"] + [trade_date for trade_date, _, _, _, _ in blocks[:-1]]
+    monkeypatch.setattr(dp_00, "_reference_tables", {
+        "major_minor": {"IF.CFE": pd.DataFrame({"n_contract": [b[1] for b in blocks]}, index=[b[0] for b in blocks])},
+        "futures_md": {"IF.CFE": pd.DataFrame.from_dict({d: {b[1]: b[2]} for d, b in zip(prev_dates, blocks)}, orient="index")},
+        "spot": {"IF.CFE": pd.DataFrame({"close": [b[3] for b in blocks]}, index=prev_dates)},
+    })
+    m01_dfs = {(trade_date, "IF.CFE"): m01_df for trade_date, _, _, _, m01_df in blocks}
+    monkeypatch.setattr(dp_00, "CM01MajorContractReader", lambda *args: CSyntheticM01Reader(m01_dfs))
+    batches = [(trade_date, [(trade_date, prev_date)]) for (trade_date, _, _, _, _), prev_date in zip(blocks, prev_dates)]
+    kwargs = dict(
+        equity_indexes=[("000300.SH", "IF.CFE")], contract_multipliers={"IF.CFE": 300},
+        futures_md_structure_path="", futures_em01_db_name="", futures_md_dir="",
+        research_features_and_return_dir=str(tmp_path), sub_win_width=30, tot_bar_num=240,
+        engine="pandas", batch_freq=None, selected_factors=None, backend="numpy", run_mode="O",
+        manifest=CFeaturesManifest(str(tmp_path / "manifest.csv")), store=CFeaturesStore(str(tmp_path)),
+        save_csv=False, verbose=False,
+    )
+    return batches, kwargs
+
+
+def test_unexpected_errors_fail_the_days_of_their_chunk_only(tmp_path, monkeypatch):
+    batches, kwargs = synthetic_kwargs(tmp_path, monkeypatch)
+    engine = dp_00.features_engines["pandas"]
+
+    def engine_failing_in_january(m01: pd.DataFrame, **engine_kwargs):
+        if m01["wind_code"].iloc[0] == "IF2301.CFE":
+            raise RuntimeError("bad engine")
+        return engine(m01=m01, **engine_kwargs)
+
+    monkeypatch.setitem(dp_00.features_engines, "pandas", engine_failing_in_january)
+    (jan_failures, jan_records, jan_frames), (feb_failures, feb_records, feb_frames) = list(
+        cal_features_and_return_for_batches(batches=batches, **kwargs))
+    assert [trade_date for trade_date, _, _ in jan_failures] == [b[0] for b in batches[0:12]]
+    assert all(reason == "unexpected error: RuntimeError('bad engine')" for _, _, reason in jan_failures)
+    assert jan_records == [] and jan_frames == []
+    assert feb_failures == []
+    assert [trade_date for trade_date, _, _, _, _, _ in feb_records] == [b[0] for b in batches[12:20]]
+    assert [trade_date for trade_date, _, _ in feb_frames] == [b[0] for b in batches[12:20]]
+
+
+def test_a_chunk_which_can_not_be_read_fails_its_days(tmp_path, monkeypatch):
+    batches, kwargs = synthetic_kwargs(tmp_path, monkeypatch)
+
+    def open_failing(*args):
+        raise OSError("no M01")
+
+    monkeypatch.setattr(dp_00, "CM01MajorContractReader", open_failing)
+    jan_chunk, feb_chunk = split_read_chunks(batches)
+    failures, records, frames = cal_features_and_return_for_chunk(jan_chunk, **kwargs)
+    assert failures == [(b[0], "IF.CFE", "unexpected error: OSError('no M01')") for b in jan_chunk]
+    assert records == [] and frames == []
@@ -0,0 +1,26 @@
+import sqlite3
+from project_config import sqlite3_tables
+from dp_01_convert_csv_to_sqlite3 import features_and_return_indexes, features_and_return_query_shapes
+from dp_01_convert_csv_to_sqlite3 import create_secondary_indexes, check_query_plans
+
+
+def test_indexes_serve_every_query_shape(tmp_path):
+    db_path = str(tmp_path / "features_and_return.db")
+    table_struct = sqlite3_tables["features_and_return"]
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE {} ({}, PRIMARY KEY ({}))".format(
+        table_struct["table_name"],
+        ", ".join("{} {}".format(c, t) for c, t in dict(table_struct["primary_keys"], **table_struct["value_columns"]).items()),
+        ", ".join(table_struct["primary_keys"])))
+    connection.commit()
+
+    # only the delete of the loader is served by the primary key
+    problems = {description: problem for description, _, problem in check_query_plans(
+        db_path, table_struct["table_name"], features_and_return_query_shapes)}
+    assert problems["load_to_sqlite3, append"] == ""
+    assert all(problem != "" for description, problem in problems.items() if description.startswith("external"))
+
+    create_secondary_indexes(connection, table_struct["table_name"], features_and_return_indexes)
+    connection.close()
+    for description, plan, problem in check_query_plans(db_path, table_struct["table_name"], features_and_return_query_shapes):
+        assert problem == "", (description, plan)
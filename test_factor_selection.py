@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from project_config import sqlite3_tables
+from result_store import CResultStore
+from group_tests import select_factors
+from factor_selection import factor_selection_db_name, update_factor_selection, read_selected_factors
+
+factors = ["basis", "csr", "onr", "vwap_ret"]
+tids = ["T01", "T02"]
+
+
+def gen_hdg(seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    trade_dates = pd.bdate_range("20230101", "20230430").strftime("%Y%m%d")
+    index = pd.MultiIndex.from_product([factors, tids, trade_dates], names=["factor", "tid", "trade_date"])
+    return pd.DataFrame({"lng": 0.0, "srt": 0.0, "hdg": rng.normal(size=len(index))}, index=index).reset_index()
+
+
+def save_group_tests(group_tests_dir: str, hdg_df: pd.DataFrame):
+    lib = CResultStore(group_tests_dir, "group_tests.db", sqlite3_tables["group_tests"])
+    lib.initialize_table()
+    lib.update(hdg_df)
+    lib.close()
+
+
+def read_table(group_tests_dir: str, table: str) -> pd.DataFrame:
+    lib = CResultStore(group_tests_dir, factor_selection_db_name, sqlite3_tables[table])
+    df = lib.read_by_conditions([], lib.m_columns).sort_values(by=lib.m_key_cols).reset_index(drop=True)
+    lib.close()
+    return df
+
+
+def test_months_are_selected_from_the_months_before_them(tmp_path):
+    hdg_df = gen_hdg()
+    save_group_tests(str(tmp_path), hdg_df)
+    update_factor_selection(factors, tids, "o", str(tmp_path), sqlite3_tables, head_n=1)
+    selected_by_tid = read_selected_factors(tids, "20230101", "20230531", str(tmp_path), sqlite3_tables)
+    for tid in tids:
+        assert sorted(selected_by_tid[tid]) == ["202302", "202303", "202304", "202305"]
+        for trade_month, selected_factors_df in selected_by_tid[tid].items():
+            before_df = hdg_df.loc[(hdg_df["tid"] == tid) & (hdg_df["trade_date"] < trade_month + "01")]
+            expected = select_factors(before_df.groupby(by="factor")["hdg"].sum(), head_n=1)
+            assert selected_factors_df.sort_values(by="factor").to_numpy().tolist() == \
+                   expected.sort_values(by="factor").to_numpy().tolist(), (tid, trade_month)
+
+
+def test_append_is_the_same_as_overwrite(tmp_path):
+    hdg_df = gen_hdg(seed=1)
+    full_dir, append_dir = tmp_path / "full", tmp_path / "append"
+    full_dir.mkdir()
+    append_dir.mkdir()
+    save_group_tests(str(full_dir), hdg_df)
+    update_factor_selection(factors, tids, "o", str(full_dir), sqlite3_tables, head_n=1)
+
+    # the last month saved by the first run is incomplete, and is calculated again by the second
+    for stp_date in ["20230215", "20230320", "20230501"]:
+        save_group_tests(str(append_dir), hdg_df.loc[hdg_df["trade_date"] < stp_date])
+        update_factor_selection(factors, tids, "a", str(append_dir), sqlite3_tables, head_n=1)
+    for table in ["group_tests_monthly", "selected_factors"]:
+        pd.testing.assert_frame_equal(read_table(str(append_dir), table), read_table(str(full_dir), table))
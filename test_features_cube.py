@@ -0,0 +1,50 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from features_cube import CFeaturesCube, build_features_cube
+from features_manifest import CFeaturesManifest, features_manifest_file
+
+
+def gen_rows() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    rows_df = pd.DataFrame([(trade_date, instrument, tid) for trade_date in ["20230103", "20230104", "20230105"]
+                            for instrument in ["IH.CFE", "IF.CFE"] for tid in ["T01", "T02"]],
+                           columns=["trade_date", "instrument", "tid"])
+    return rows_df.assign(basis=rng.normal(size=len(rows_df)), rtm=rng.normal(size=len(rows_df)))
+
+
+def test_cube_reads_the_rows_of_the_store(make_cube):
+    rows_df = gen_rows().query("not (instrument == 'IF.CFE' and trade_date == '20230103')")
+    cube = make_cube(rows_df, ["IH.CFE", "IF.CFE"], ["T01", "T02"])
+    assert cube.dates.tolist() == ["20230103", "20230104", "20230105"]
+    assert cube.present("20230103", "20230104")[0, 1].tolist() == [False, False]
+    df = cube.read_by_conditions([("trade_date", ">=", "20230104"), ("tid", "=", "T02")], ["trade_date", "instrument", "rtm"])
+    expected = rows_df.query("trade_date >= '20230104' and tid == 'T02'")
+    assert df["rtm"].tolist() == expected["rtm"].tolist()
+    assert np.allclose(cube.sel("20230104", "20230106", tid="T02", column="rtm"),
+                       expected["rtm"].to_numpy().reshape(2, 2))
+    assert pickle.loads(pickle.dumps(cube)).sel(column="basis").shape == (3, 2, 2)
+
+
+def test_cube_warns_when_features_are_saved_again(make_cube, tmp_path, capsys):
+    cube = make_cube(gen_rows(), ["IH.CFE", "IF.CFE"], ["T01", "T02"])
+    save_dir = str(tmp_path / "cube")
+    assert cube.check_source(save_dir)
+
+    # days out of the cube do not matter
+    manifest = CFeaturesManifest(os.path.join(save_dir, features_manifest_file))
+    manifest.update([("20221230", "IH.CFE", "f0", "v0", 4, "20230101 00:00:00.000000")])
+    manifest.save()
+    capsys.readouterr()
+    assert CFeaturesCube(save_dir).check_source(save_dir)
+    assert "Warning" not in capsys.readouterr().out
+
+    manifest.update([("20230104", "IH.CFE", "f1", "v0", 4, "20230105 00:00:00.000000")])
+    manifest.save()
+    CFeaturesCube(save_dir)
+    assert "Warning" in capsys.readouterr().out
+    assert not cube.check_source(save_dir)
+
+    build_features_cube(save_dir, "20230103", "99991231", ["IH.CFE", "IF.CFE"], ["T01", "T02"])
+    assert CFeaturesCube(save_dir).check_source(save_dir)
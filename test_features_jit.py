@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("numba")
+import features_vec
+
+
+def test_jit_backend_agrees_with_numpy_backend():
+    rng = np.random.default_rng(0)
+    days, bars = 16, 240
+    bars_dict = {
+        "open": 4000 + rng.normal(size=(days, bars)).cumsum(axis=1),
+        "volume": rng.integers(0, 40, size=(days, bars)).astype(float),
+        "daily_open": np.full((days, bars), 4000.0),
+        "preclose": np.full((days, bars), 3995.0),
+        "timestamp": np.tile(np.arange(bars, dtype=np.int64) * 60, (days, 1)),
+    }
+    bars_dict["close"] = bars_dict["open"] + rng.normal(size=(days, bars))
+    bars_dict["high"] = np.maximum(bars_dict["open"], bars_dict["close"]) + 0.2
+    bars_dict["low"] = np.minimum(bars_dict["open"], bars_dict["close"]) - 0.2
+    bars_dict["amount"] = bars_dict["volume"] * bars_dict["close"] * 300 / 1e4
+    bars_dict["daily_high"] = np.maximum.accumulate(bars_dict["high"], axis=1)
+    bars_dict["daily_low"] = np.minimum.accumulate(bars_dict["low"], axis=1)
+    bars_dict["close"][3, 5:9] = np.nan  # missing bars
+    selected_factors = ["cvp", "cvr", "vtop01_cvp", "vtop05_cvr", "smart01", "smart01_ret", "smart02", "smart02_ret",
+                        "smart05", "smart05_ret", "vh01", "vl01", "vd01", "vh02", "vl02", "vd02", "vh05", "vl05", "vd05",
+                        "exr", "exrb01"]
+    kwargs = dict(bars=bars_dict, contract_multiplier=300,
+                  pre_settle=np.full(days, 3990.0), pre_spot_close=np.full(days, 3980.0),
+                  selected_factors=selected_factors)
+    res_numpy = features_vec.cal_features_and_return_vec(backend="numpy", **kwargs)
+    res_jit = features_vec.cal_features_and_return_vec(backend="jit", **kwargs)
+    for lbl in selected_factors:
+        assert np.allclose(res_numpy[lbl], res_jit[lbl], rtol=1e-8, atol=1e-10, equal_nan=True), lbl
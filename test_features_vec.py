@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from synthetic_market import gen_synthetic_market
+from features_vec import cal_features_and_return_one_day_vec
+
+
+def test_one_day_vec_rejects_bars_not_aligned_with_sessions():
+    trade_date, contract, pre_settle, pre_spot_close, m01_df = gen_synthetic_market("IF.CFE", "20230103", 1)[0]
+    res_df = cal_features_and_return_one_day_vec(m01_df, "IF.CFE", contract, 300, pre_settle, pre_spot_close)
+    assert len(res_df) == 7 and np.isfinite(res_df["basis"]).all()
+
+    # the afternoon session starts 2 bars early, inside an M05 bar
+    timestamp = m01_df["timestamp"].to_numpy()
+    m01_df = m01_df.assign(timestamp=np.concatenate([timestamp[0:118], timestamp[120:], timestamp[-1] + 60 * np.arange(1, 3)]))
+    with pytest.raises(ValueError, match="not aligned with M05"):
+        cal_features_and_return_one_day_vec(m01_df, "IF.CFE", contract, 300, pre_settle, pre_spot_close)
+    with pytest.raises(ValueError, match="length of M01"):
+        cal_features_and_return_one_day_vec(m01_df.iloc[0:200], "IF.CFE", contract, 300, pre_settle, pre_spot_close)
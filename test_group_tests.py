@@ -0,0 +1,141 @@
+import itertools as ittl
+import numpy as np
+import pandas as pd
+from project_config import sqlite3_tables
+from result_store import CResultStore
+from group_tests import tie_blocks, slot_shares, cal_group_return_of_tid, cal_quantile_return
+from group_tests import read_hdg_of_tids, select_factors
+
+instruments = ["IC.CFE", "IH.CFE", "IF.CFE", "IM.CFE"]
+tids = ["T01", "T02"]
+factors = ["basis", "up", "vtop01_cvp", "exrb01"]
+
+
+def gen_rows(seed: int = 0, dates: int = 12) -> pd.DataFrame:
+    # IM is not listed in the first 5 dates, up is 0 or 1, vtop01_cvp is one of a few values, and exrb01
+    # is NaN for all the instruments on some dates and for some of them on others
+    rng = np.random.default_rng(seed)
+    rows = []
+    for d, tid, instrument in ittl.product(range(dates), tids, instruments):
+        if instrument == "IM.CFE" and d < 5:
+            continue
+        rows.append({
+            "trade_date": "202301{:02d}".format(d + 1), "instrument": instrument, "tid": tid,
+            "basis": rng.normal(),
+            "up": float(rng.integers(0, 2)),
+            "vtop01_cvp": rng.choice([-0.5, 0.5, 1.0]),
+            "exrb01": np.nan if d % 4 == 0 or rng.random() < 0.2 else rng.normal(),
+            "rtm": rng.normal(),
+        })
+    return pd.DataFrame(rows)
+
+
+def baseline_group_return(df: pd.DataFrame, fac: str, ret: str = "rtm", ret_scale: int = 100):
+    # group_tests.cal_group_return before the vectorized kernel, with the ties in the order of the rows
+    n = len(df)
+    m = int(n / 2)
+    d = n - 2 * m
+    lng_raw_wgt = np.array([1] * m + [0] * d + [0] * m)
+    srt_raw_wgt = np.array([0] * m + [0] * d + [1] * m)
+    lng_wgt = lng_raw_wgt / np.abs(lng_raw_wgt).sum()
+    srt_wgt = srt_raw_wgt / np.abs(srt_raw_wgt).sum()
+    hdg_wgt = lng_wgt * 0.5 - srt_wgt * 0.5
+    sig_df = df.sort_values(by=fac, ascending=False, kind="stable")
+    return sig_df[ret] @ lng_wgt / ret_scale, sig_df[ret] @ srt_wgt / ret_scale, sig_df[ret] @ hdg_wgt / ret_scale
+
+
+def test_tie_blocks():
+    x = np.array([[0.5, 1.0, 0.5, np.nan, 0.5], [2.0, np.nan, 1.0, np.nan, 3.0]])
+    valid = np.array([[True, True, True, True, False], [True, True, True, True, True]])
+    bgn, stp = tie_blocks(x, valid)
+    assert bgn.tolist() == [[1, 0, 1, 3, 4], [1, 3, 2, 3, 0]]
+    assert stp.tolist() == [[3, 1, 3, 4, 4], [2, 5, 3, 5, 1]]
+    # the long group of 2 takes one of the two positions of the tied block [1, 3)
+    assert np.allclose(slot_shares(bgn, stp, 0, 2)[0], [0.5, 1, 0.5, 0, 0])
+
+
+def test_group_return_is_the_average_of_the_orders_of_ties(make_cube):
+    rows_df = gen_rows()
+    cube = make_cube(rows_df, instruments, tids)
+    for tid in tids:
+        trade_dates, lng, srt, hdg = cal_group_return_of_tid(cube, factors, tid, "20230101", "20230201")
+        tid_df = rows_df.loc[rows_df["tid"] == tid]
+        assert trade_dates.tolist() == sorted(tid_df["trade_date"].unique())
+        for (d, trade_date), (k, factor) in ittl.product(enumerate(trade_dates), enumerate(factors)):
+            date_df = tid_df.loc[tid_df["trade_date"] == trade_date]
+            expected = np.nan_to_num(np.mean([
+                baseline_group_return(date_df.iloc[list(perm)], factor)
+                for perm in ittl.permutations(range(len(date_df)))], axis=0), nan=0)
+            assert np.allclose([lng[d, k], srt[d, k], hdg[d, k]], expected, rtol=0, atol=1e-14), (tid, trade_date, factor)
+
+
+def test_group_return_without_ties_is_the_one_of_sort_values(make_cube):
+    rows_df = gen_rows(seed=1)
+    cube = make_cube(rows_df, instruments, tids)
+    trade_dates, lng, srt, hdg = cal_group_return_of_tid(cube, ["basis"], "T02", "20230101", "20230201")
+    tid_df = rows_df.loc[rows_df["tid"] == "T02"]
+    for d, trade_date in enumerate(trade_dates):
+        date_df = tid_df.loc[tid_df["trade_date"] == trade_date]
+        expected = baseline_group_return(date_df.sample(frac=1, random_state=d), "basis")
+        assert np.allclose([lng[d, 0], srt[d, 0], hdg[d, 0]], expected, rtol=0, atol=1e-14)
+
+
+def test_group_return_does_not_depend_on_the_order_of_instruments(make_cube):
+    rows_df = gen_rows(seed=2)
+    res = cal_group_return_of_tid(make_cube(rows_df, instruments, tids), factors, "T01", "20230101", "20230201")
+    res_reversed = cal_group_return_of_tid(
+        make_cube(rows_df, instruments[::-1], tids, "reversed"), factors, "T01", "20230101", "20230201")
+    for a, b in zip(res[1:], res_reversed[1:]):
+        assert np.allclose(a, b, rtol=0, atol=1e-14)
+
+
+def baseline_quantile_return(df: pd.DataFrame, fac: str, quantile_n: int, ret: str = "rtm", ret_scale: int = 100) -> np.ndarray:
+    # the instrument at position p of the finite values, sorted descending with the ties in the order of
+    # the rows, is equally weighted in bucket int(p * quantile_n / n)
+    sig_df = df.loc[np.isfinite(df[fac])].sort_values(by=fac, ascending=False, kind="stable")
+    bucket = np.arange(len(sig_df)) * quantile_n // max(len(sig_df), 1)
+    return np.array([sig_df[ret].to_numpy()[bucket == k].mean() / ret_scale if (bucket == k).any() else 0
+                     for k in range(quantile_n)])
+
+
+def test_quantile_return_turnover_and_cost(make_cube):
+    rows_df = gen_rows(seed=3)
+    rows_df.loc[rows_df.index[7], "basis"] = np.inf  # left out, as NaN
+    cube = make_cube(rows_df, instruments, tids)
+    quantile_n, cost_rate = 3, 5e-4
+    trade_dates, obs, ret, turnover, net = cal_quantile_return(
+        cube, factors, tids, "20230101", "20230201", quantile_n, cost_rate)
+    for (d, trade_date), (t, tid), (k, factor) in ittl.product(enumerate(trade_dates), enumerate(tids), enumerate(factors)):
+        date_df = rows_df.loc[(rows_df["tid"] == tid) & (rows_df["trade_date"] == trade_date)]
+        assert obs[d, t] == len(date_df)
+        expected = np.mean([baseline_quantile_return(date_df.iloc[list(perm)], factor, quantile_n)
+                            for perm in ittl.permutations(range(len(date_df)))], axis=0)
+        assert np.allclose(ret[d, t, k], expected, rtol=0, atol=1e-14), (trade_date, tid, factor)
+
+        # every bucket which is not empty is opened and closed on each date
+        finite_n = np.isfinite(date_df[factor]).sum()
+        not_empty = np.isin(np.arange(quantile_n), np.arange(finite_n) * quantile_n // max(finite_n, 1))
+        assert np.allclose(turnover[d, t, k], np.where(not_empty, 2, 0))
+        assert np.allclose(net[d, t, k], ret[d, t, k] - np.where(not_empty, cost_rate, 0))
+
+
+def test_group_tests_are_saved_in_one_table(tmp_path):
+    rng = np.random.default_rng(4)
+    rows = [(f, t, "202301{:02d}".format(d)) for f in factors for t in tids for d in range(3, 13)]
+    ret_df = pd.DataFrame(rows, columns=["factor", "tid", "trade_date"]).assign(
+        lng=rng.normal(size=len(rows)), srt=rng.normal(size=len(rows)))
+    ret_df["hdg"] = ret_df["lng"] * 0.5 - ret_df["srt"] * 0.5
+    lib = CResultStore(str(tmp_path), "group_tests.db", sqlite3_tables["group_tests"])
+    lib.initialize_table(t_remove_existence=True)
+    lib.update(ret_df)
+    lib.close()
+
+    hdg_dfs = read_hdg_of_tids(tids + ["T03"], "20230105", "20230110", str(tmp_path), sqlite3_tables)
+    for tid in tids:
+        expected = ret_df.query("tid == @tid and trade_date >= '20230105' and trade_date < '20230110'").pivot(
+            index="trade_date", columns="factor", values="hdg")
+        pd.testing.assert_frame_equal(hdg_dfs[tid], expected)
+    assert hdg_dfs["T03"].empty
+
+    selected_df = select_factors(pd.Series([0.3, -0.1, 0.2, -0.4], index=factors), head_n=1)
+    assert selected_df.to_numpy().tolist() == [["basis", 1], ["exrb01", -1]]
@@ -0,0 +1,49 @@
+import threading
+import pytest
+from m01_reader import iter_prefetched
+
+
+class CFakeReader(object):
+    def __init__(self):
+        self.m_reads = []
+        self.m_closed = False
+
+    def read(self, task: int) -> int:
+        if task < 0:
+            raise ValueError("task = {}".format(task))
+        self.m_reads.append(task)
+        return task * 10
+
+    def close(self):
+        self.m_closed = True
+
+
+def iter_fake(tasks: list[int]) -> tuple[CFakeReader, object]:
+    reader = CFakeReader()
+    return reader, iter_prefetched(tasks, open_reader=lambda: reader, read_fun=lambda r, task: r.read(task))
+
+
+def test_all_tasks_are_read_in_order():
+    reader, it = iter_fake(list(range(5)))
+    assert list(it) == [(k, k * 10) for k in range(5)]
+    assert reader.m_closed
+
+
+def test_caller_stopping_early_does_not_block_the_reader():
+    thread_num = threading.active_count()
+    reader, it = iter_fake(list(range(100)))
+    for task, res in it:
+        if task == 2:
+            break
+    it.close()
+    assert reader.m_closed
+    assert len(reader.m_reads) < 100
+    assert threading.active_count() == thread_num
+
+
+def test_errors_are_raised_to_the_caller():
+    reader, it = iter_fake([0, 1, -1, 3])
+    with pytest.raises(ValueError, match="task = -1"):
+        for _ in it:
+            pass
+    assert reader.m_closed and reader.m_reads == [0, 1]
@@ -0,0 +1,50 @@
+import itertools as ittl
+import numpy as np
+import pandas as pd
+from portfolios_linear import cal_portfolio_weights
+
+
+def baseline_hdg_wgt(df: pd.DataFrame, fac: str, sig: int) -> pd.Series:
+    # hedged weights of one factor in portfolios_linear.cal_portfolio_return before the matrix implementation,
+    # with the ties in the order of the rows
+    n = len(df)
+    m = int(n / 2)
+    d = n - 2 * m
+    lng_raw_wgt = np.array([1] * m + [0] * d + [0] * m)
+    srt_raw_wgt = np.array([0] * m + [0] * d + [1] * m)
+    hdg_wgt = lng_raw_wgt / np.abs(lng_raw_wgt).sum() * 0.5 - srt_raw_wgt / np.abs(srt_raw_wgt).sum() * 0.5
+    sig_df = df[["instrument", fac]].sort_values(by=fac, ascending=False if sig > 0 else True, kind="stable")
+    return pd.Series(hdg_wgt, index=sig_df["instrument"])
+
+
+def test_portfolio_weights_are_the_average_of_the_orders_of_ties():
+    rng = np.random.default_rng(0)
+    instruments, factors = ["IC.CFE", "IH.CFE", "IF.CFE", "IM.CFE"], ["basis", "up", "vtop01_cvp", "exrb01"]
+    dates = 30
+    x = np.stack([
+        rng.normal(size=(dates, 4)),
+        rng.integers(0, 2, size=(dates, 4)).astype(float),
+        rng.choice([-0.5, 0.5, 1.0], size=(dates, 4)),
+        np.where(rng.random(size=(dates, 4)) < 0.3, np.nan, rng.normal(size=(dates, 4))),
+    ], axis=1)  # [date, factor, instrument]
+    x[0:3, 3, :] = np.nan
+    direction = rng.choice([-1, 0, 1], size=(dates, 4)).astype(float)
+    direction[:, 1] = 1
+    present = np.ones((dates, 4), dtype=bool)
+    present[0:10, 3] = False  # IM is not listed yet
+    wgt = cal_portfolio_weights(x, direction, present)
+
+    for d in range(dates):
+        df = pd.DataFrame(x[d].T, columns=factors).assign(instrument=instruments)[present[d]]
+        tot_wgt = pd.Series(0.0, index=instruments)
+        for k, fac in enumerate(factors):
+            if direction[d, k] == 0:
+                continue
+            perm_wgt = [baseline_hdg_wgt(df.iloc[list(perm)], fac, direction[d, k])
+                        for perm in ittl.permutations(range(len(df)))]
+            tot_wgt = tot_wgt.add(pd.concat(perm_wgt, axis=1).mean(axis=1), fill_value=0)
+        expected = (tot_wgt / tot_wgt.abs().sum()).reindex(instruments).to_numpy()
+        assert np.allclose(wgt[d], expected, rtol=0, atol=1e-14, equal_nan=True), d
+
+    # reversing the instruments reverses the weights, whatever the ties
+    assert np.allclose(cal_portfolio_weights(x[..., ::-1], direction, present[:, ::-1]), wgt[:, ::-1], rtol=0, atol=1e-14, equal_nan=True)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+from rank_corr import CExpandingSpearman, spearman_of_heads, spearman_of_subsets
+
+
+def pandas_spearman(x: np.ndarray, y: np.ndarray) -> float:
+    return pd.DataFrame({"x": x, "y": y}).corr(method="spearman").at["x", "y"]
+
+
+def gen_pairs(seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    # x has many ties, and a few pairs are not finite
+    rng = np.random.default_rng(seed)
+    x = rng.integers(0, 20, size=(4, 210)).astype(float)
+    y = rng.normal(size=(4, 210))
+    x[1, 5], y[2, 7], x[3, 9] = np.nan, np.inf, np.nan
+    return x, y
+
+
+def test_expanding_spearman():
+    x, y = gen_pairs()
+    engine = CExpandingSpearman(shape=(4,), capacity=210)
+    for n in range(30, 211, 30):
+        rho = engine.update(x[:, n - 30:n], y[:, n - 30:n])
+        for d in range(4):
+            assert abs(rho[d] - pandas_spearman(x[d, 0:n], y[d, 0:n])) < 1e-12, (n, d)
+
+
+def test_spearman_of_heads():
+    x, y = gen_pairs()
+    for k, rho in zip([3, 6, 15], spearman_of_heads(x[:, 0:30], y[:, 0:30], [3, 6, 15])):
+        for d in range(4):
+            expected = pandas_spearman(x[d, 0:k], y[d, 0:k])
+            assert (np.isnan(rho[d]) and np.isnan(expected)) or abs(rho[d] - expected) < 1e-12, (k, d)
+
+
+def test_spearman_of_subsets():
+    x, y = gen_pairs()
+    rng = np.random.default_rng(1)
+    masks = np.stack([np.arange(210) < 30, np.arange(210) < 150, rng.random(210) < 0.3], axis=-1)
+    rho = spearman_of_subsets(x, y, masks)
+    for d, c in np.ndindex(4, 3):
+        sel = masks[:, c]
+        assert abs(rho[d, c] - pandas_spearman(x[d, sel], y[d, sel])) < 1e-12, (d, c)
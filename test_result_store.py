@@ -0,0 +1,37 @@
+import pandas as pd
+from project_config import sqlite3_tables
+from result_store import CResultStore
+
+
+def test_update_replaces_rows_with_the_same_keys(tmp_path):
+    lib = CResultStore(str(tmp_path), "ic_tests.db", sqlite3_tables["ic_tests"])
+    lib.initialize_table(t_remove_existence=True)
+    lib.update(pd.DataFrame({"factor": ["basis", "basis", "csr"], "tid": "T01",
+                             "trade_date": ["20230103", "20230104", "20230103"], "obs": 4, "ic": [0.1, 0.2, 0.3]}))
+    lib.update(pd.DataFrame({"factor": ["basis", "basis"], "tid": "T01",
+                             "trade_date": ["20230104", "20230105"], "obs": 3, "ic": [-0.2, 0.5]}))
+    df = lib.read_by_conditions([("factor", "=", "basis")], ["trade_date", "obs", "ic"]).sort_values(by="trade_date")
+    assert df["trade_date"].tolist() == ["20230103", "20230104", "20230105"]
+    assert df["obs"].tolist() == [4, 3, 3]
+    assert df["ic"].tolist() == [0.1, -0.2, 0.5]
+    assert lib.max_of("trade_date") == "20230105"
+    assert lib.max_of("trade_date", [("factor", "=", "csr")]) == "20230103"
+    assert lib.max_of("trade_date", [("factor", "=", "onr")]) is None
+    lib.close()
+
+
+def test_remove_and_initialize(tmp_path):
+    lib = CResultStore(str(tmp_path), "ic_tests.db", sqlite3_tables["ic_tests"])
+    lib.initialize_table()
+    lib.update(pd.DataFrame({"factor": "basis", "tid": ["T01", "T02"], "trade_date": "20230103", "obs": 4, "ic": [0.1, 0.2]}))
+    lib.remove([("tid", ">", "T01")])
+    assert lib.read_by_conditions([], ["tid"])["tid"].tolist() == ["T01"]
+    lib.close()
+
+    # rows are kept by a new connection unless the table is removed
+    lib = CResultStore(str(tmp_path), "ic_tests.db", sqlite3_tables["ic_tests"])
+    lib.initialize_table()
+    assert len(lib.read_by_conditions([], ["ic"])) == 1
+    lib.initialize_table(t_remove_existence=True)
+    assert len(lib.read_by_conditions([], ["ic"])) == 0
+    lib.close()
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from trades_simulation import cal_turnover, cal_net_ret, simulate_trades, cal_nav_indicators
+
+
+def test_turnover_opens_and_closes_every_date_traded():
+    # one instrument, [1, 1, not traded, -1]: every date traded opens and closes its position,
+    # holding the same position as the date before is not free
+    wgt = np.array([1.0, 1.0, 0.0, -1.0])[:, None, None]
+    traded = np.array([True, True, False, True])[:, None]
+    assert np.allclose(cal_turnover(wgt, traded)[:, 0], [2, 2, 0, 2])
+    assert np.allclose(cal_turnover(wgt)[:, 0], [2, 2, 0, 2])
+
+
+def test_full_position_pays_cost_rate_as_the_flat_charge():
+    rng = np.random.default_rng(0)
+    dates, columns, instruments, cost_rate = 20, 3, 4, 5e-4
+    wgt = np.sign(rng.normal(size=(dates, columns, instruments))) / instruments
+    ret = rng.normal(size=(dates, 1, instruments)) / 100
+    raw_ret, turnover, net_ret = simulate_trades(wgt, ret, cost_rate)
+    assert np.allclose(turnover, 2)
+    assert np.allclose(raw_ret, (wgt * ret).sum(axis=-1))
+    assert np.allclose(net_ret, raw_ret - cost_rate)
+
+    # half of the weight pays half of the cost
+    _, turnover, net_ret = simulate_trades(wgt / 2, ret, cost_rate)
+    assert np.allclose(turnover, 1)
+    assert np.allclose(net_ret, raw_ret / 2 - cost_rate / 2)
+    assert np.allclose(cal_net_ret(raw_ret, np.full_like(raw_ret, 2), cost_rate), raw_ret - cost_rate)
+
+
+def test_dates_not_traded_are_nan_and_free():
+    wgt = np.array([[0.5, -0.5], [0.0, 0.0], [0.5, 0.5]])[:, None, :]
+    ret = np.array([[0.01, np.nan], [0.02, 0.03], [0.01, -0.02]])[:, None, :]
+    traded = np.array([True, False, True])[:, None]
+    raw_ret, turnover, net_ret = simulate_trades(wgt, ret, 1e-3, traded)
+    assert np.allclose(turnover[:, 0], [2, 0, 2])
+    assert np.isnan(raw_ret[1, 0]) and np.isnan(net_ret[1, 0])
+    assert np.isclose(raw_ret[0, 0], 0.005)  # NaN returns of the instruments held count as 0
+    assert np.isclose(net_ret[2, 0], -0.005 - 1e-3)
+
+
+def test_nav_indicators():
+    rng = np.random.default_rng(1)
+    net_ret_df = pd.DataFrame(rng.normal(0.0005, 0.01, size=(60, 2)), columns=["a", "b"],
+                              index=["D{:03d}".format(_) for _ in range(60)])
+    net_ret_df.iloc[10, 1] = np.nan
+    nav_df, indicators_df = cal_nav_indicators(net_ret_df)
+    for c in net_ret_df.columns:
+        r = net_ret_df[c]
+        nav = (r.fillna(0) + 1).cumprod()
+        drawdown = 1 - nav / nav.cummax()
+        assert indicators_df.at[c, "obs"] == r.count()
+        assert np.isclose(indicators_df.at[c, "hold_period_return"], nav.iloc[-1] - 1)
+        assert np.isclose(indicators_df.at[c, "sharpe_ratio"], r.mean() / r.std() * np.sqrt(252))
+        assert np.isclose(indicators_df.at[c, "max_drawdown_scale"], drawdown.max())
+        assert indicators_df.at[c, "max_drawdown_date"] == drawdown.idxmax()
+    assert np.isnan(nav_df.iloc[10, 1]) and not nav_df["a"].isna().any()
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from synthetic_market import gen_synthetic_market
+from xfuns import check_m01_bars, cal_features_and_return_one_day
+
+bar_cols = ["open", "high", "low", "close", "timestamp"]
+
+
+def gen_day():
+    trade_date, contract, pre_settle, pre_spot_close, m01_df = gen_synthetic_market("IF.CFE", "20230103", 1)[0]
+    return contract, pre_settle, pre_spot_close, m01_df
+
+
+def test_check_m01_bars():
+    contract, _, _, m01_df = gen_day()
+    assert check_m01_bars({k: m01_df[k].to_numpy() for k in bar_cols}, contract) == 0
+
+    with pytest.raises(ValueError, match="length of M01"):
+        check_m01_bars({k: m01_df[k].to_numpy()[0:235] for k in bar_cols}, contract)
+
+    # the first 15 minutes are missing, so the first M05, M10 and M15 bars are empty
+    bars = {k: m01_df[k].to_numpy(dtype=np.int64 if k == "timestamp" else np.float64, copy=True) for k in bar_cols}
+    for k in ["open", "high", "low", "close"]:
+        bars[k][0:15] = np.nan
+    with pytest.raises(ValueError, match="length of M05"):
+        check_m01_bars(bars, contract)
+
+    # the morning session ends 2 bars early, so the afternoon session starts inside an M05 bar
+    timestamp = m01_df["timestamp"].to_numpy().copy()
+    timestamp[118:] = timestamp[120:].tolist() + [timestamp[-1] + 60, timestamp[-1] + 120]
+    bars = {k: m01_df[k].to_numpy() for k in bar_cols[0:4]}
+    bars["timestamp"] = timestamp
+    with pytest.raises(ValueError, match="not aligned with M05"):
+        check_m01_bars(bars, contract)
+
+
+def test_pandas_kernel_raises_value_error():
+    contract, pre_settle, pre_spot_close, m01_df = gen_day()
+    with pytest.raises(ValueError, match="length of M01"):
+        cal_features_and_return_one_day(m01_df.iloc[0:230].copy(), "IF.CFE", contract, 300, pre_settle, pre_spot_close)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# rtm is the return from the checkpoint of a tid to the close of the same day, so on every date a strategy
+# is traded, its positions are opened at the checkpoint and closed at the close, nothing is held overnight
+# or over the dates it is not traded. The turnover of a date is the weight traded to open and to close the
+# positions, 2 * sum(abs(w[t])), whatever they were the date before, and cost_rate is the cost of opening
+# and closing a unit of weight, i.e. the flat cost_rate which ml_summary took from a full position on
+# every date, so net = raw - turnover * cost_rate / 2.
+
+
+def cal_turnover(wgt: np.ndarray, traded: np.ndarray | None = None) -> np.ndarray:
+    """
+
+    :param wgt: [date, column, instrument], weights held from the checkpoint to the close of each date, 0 for
+                the instruments not held
+    :param traded: [date, column], False on the dates a column is not traded, None if all the dates are traded
+    :return: [date, column], 2 * sum(abs(w[t])) of the instruments, 0 on the dates not traded
+    """
+    turnover = 2 * np.abs(wgt).sum(axis=-1)
+    return turnover if traded is None else np.where(traded, turnover, 0)
+
+
+def cal_net_ret(raw_ret: np.ndarray, turnover: np.ndarray, cost_rate: float) -> np.ndarray:
+    """
+
+    :param raw_ret: returns before costs
+    :param turnover: as cal_turnover returns, with the shape of raw_ret
+    :param cost_rate: cost of opening and closing a unit of weight
+    :return: returns after costs
+    """
+    return raw_ret - turnover * cost_rate / 2
+
+
+def simulate_trades(wgt: np.ndarray, ret: np.ndarray, cost_rate: float,
+                    traded: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    every column is a strategy holding wgt from the checkpoint to the close of each date, so a full position
+    pays cost_rate on every date it is traded, and a date with smaller positions pays less
+
+    :param wgt: [date, column, instrument], weights held over each date, 0 for the instruments not held
+    :param ret: [date, column, instrument], or [date, 1, instrument] for returns shared by all the columns,
+                returns of the instruments over each date, NaN returns of the instruments held count as 0
+    :param cost_rate: cost of opening and closing a unit of weight
+    :param traded: as in cal_turnover
+    :return: (raw_ret, turnover, net_ret), [date, column] each, raw_ret and net_ret are NaN on the dates
+             not traded
+    """
+    raw_ret = (wgt * np.nan_to_num(ret, nan=0)).sum(axis=-1)
+    turnover = cal_turnover(wgt, traded)
+    net_ret = cal_net_ret(raw_ret, turnover, cost_rate)
+    if traded is not None:
+        raw_ret, net_ret = np.where(traded, raw_ret, np.nan), np.where(traded, net_ret, np.nan)
+    return raw_ret, turnover, net_ret
+
+
+def cal_nav_indicators(net_ret_df: pd.DataFrame, annual_days: int = 252) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    indicators of daily returns without risk free rate, like CNAV(t_type="RET", t_freq="D", t_annual_rf_rate=0),
+    for all the columns at once
+
+    :param net_ret_df: index = trade_date, columns = strategies, NaN on the dates a strategy is not traded
+    :param annual_days:
+    :return: (nav_df, indicators_df), nav_df is like net_ret_df, with NaN on the same dates,
+             indicators_df.index = columns of net_ret_df
+    """
+    nav_df = (net_ret_df.fillna(0) + 1).cumprod()
+    annual_return = net_ret_df.mean() * annual_days
+    annual_volatility = net_ret_df.std() * np.sqrt(annual_days)
+    max_drawdown_scale = (1 - nav_df / nav_df.cummax()).max()
+    indicators_df = pd.DataFrame({
+        "obs": net_ret_df.count(),
+        "hold_period_return": nav_df.iloc[-1] - 1,
+        "annual_return": annual_return,
+        "annual_volatility": annual_volatility,
+        "sharpe_ratio": annual_return / annual_volatility,
+        "max_drawdown_scale": max_drawdown_scale,
+        "max_drawdown_date": (1 - nav_df / nav_df.cummax()).idxmax(),
+        "calmar_ratio": annual_return / max_drawdown_scale,
+    })
+    return nav_df.where(net_ret_df.notna()), indicators_df
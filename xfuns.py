@@ -1,33 +1,103 @@
-import sys
-import datetime as dt
 import numpy as np
 import pandas as pd
 import skops.io as sio
 
 
+def _agg_first(x: np.ndarray) -> np.ndarray:
+    idx = np.argmax(~np.isnan(x), axis=-1)[..., None]
+    return np.take_along_axis(x, idx, axis=-1)[..., 0]
+
+
+def _agg_last(x: np.ndarray) -> np.ndarray:
+    return _agg_first(x[..., ::-1])
+
+
+fixed_grid_agg_methods = {
+    "open": _agg_first,
+    "high": lambda z: np.fmax.reduce(z, axis=-1),
+    "low": lambda z: np.fmin.reduce(z, axis=-1),
+    "close": _agg_last,
+    "volume": lambda z: np.nansum(z, axis=-1),
+    "amount": lambda z: np.nansum(z, axis=-1),
+}
+
+
+def aggregate_fixed_grid(bars: dict[str, np.ndarray], widths: tuple[int, ...] = (5, 10, 15)) -> dict[int, dict[str, np.ndarray]]:
+    """
+    aggregate 1-minute bars to k-minute bars on the fixed grid of bar numbers,
+    by reshaping instead of resampling by clock. NaN are skipped like pandas
+    does with "first", max, min, "last" and np.sum.
+
+    :param bars: any of open/high/low/close/volume/amount, each one with shape = (..., bar_num),
+                 trailing bars which do not fill a k-minute bar are left out
+    :param widths: k of each k-minute bar set
+    :return: {k: {field: array with shape = (..., bar_num // k)}}
+    """
+    res = {}
+    for width in widths:
+        res[width] = {}
+        for k, x in bars.items():
+            agg_num = x.shape[-1] // width
+            x_grid = x[..., 0:agg_num * width].reshape(x.shape[:-1] + (agg_num, width))
+            res[width][k] = fixed_grid_agg_methods[k](x_grid)
+    return res
+
+
+def is_aligned_with_sessions(timestamp: np.ndarray, width: int, bar_seconds: int = 60) -> bool:
+    """
+
+    :param timestamp: (..., bar_num), timestamps of 1-minute bars
+    :param width: k of k-minute bars
+    :param bar_seconds:
+    :return: True if every session break, i.e. a gap != bar_seconds between two bars, falls on the edge of a k-minute bar
+    """
+    break_idx = np.nonzero(np.diff(timestamp, axis=-1) != bar_seconds)[-1] + 1
+    return bool(np.all(break_idx % width == 0))
+
+
+def check_m01_bars(bars: dict[str, np.ndarray], contract: str, tot_bar_num: int = 240,
+                   widths: tuple[int, ...] = (5, 10, 15)):
+    """
+    checks the minute bars of one day before the features are calculated from them
+
+    :param bars: open/high/low/close/timestamp of the minute bars of one day, each one with shape = (bar_num,)
+    :param contract: major contract, only for the message
+    :param tot_bar_num: number of minute bars of a day
+    :param widths: k of the k-minute bars the features use
+    :raises ValueError: if there are not tot_bar_num bars, any k-minute bar is empty, or a session break
+                        falls inside a k-minute bar
+    """
+    if (bar_num := len(bars["timestamp"])) != tot_bar_num:
+        raise ValueError("length of M01 is {} != {}, contract = {}".format(bar_num, tot_bar_num, contract))
+    m_aggs = aggregate_fixed_grid({k: bars[k] for k in ["open", "high", "low", "close"]}, widths=widths)
+    for width in widths:
+        m_agg_len = int(np.sum(~np.all(np.isnan(np.stack(list(m_aggs[width].values()))), axis=0)))
+        if m_agg_len != tot_bar_num / width:
+            raise ValueError("length of M{:02d} is {} != {}, contract = {}".format(
+                width, m_agg_len, tot_bar_num / width, contract))
+        if not is_aligned_with_sessions(bars["timestamp"], width):
+            raise ValueError("session breaks are not aligned with M{:02d} bars, contract = {}".format(width, contract))
+    return 0
+
+
 def cal_features_and_return_one_day(m01: pd.DataFrame,
                                     instrument: str, contract: str, contract_multiplier: int,
                                     pre_settle: float, pre_spot_close: float,
                                     sub_win_width: int = 30, tot_bar_num: int = 240,
                                     amount_scale: float = 1e4, ret_scale: int = 100) -> pd.DataFrame:
+    # raises ValueError if the bars can not be aggregated to 5,10,15 minutes
+    check_m01_bars({k: m01[k].to_numpy(dtype=np.int64 if k == "timestamp" else np.float64)
+                    for k in ["open", "high", "low", "close", "timestamp"]},
+                   contract, tot_bar_num, widths=(5, 10, 15))
+
     # basic price
     prev_day_close = m01["preclose"].iloc[0]
     this_day_open = m01["daily_open"].iloc[0]
 
     # aggregate variables
     agg_vars = ["open", "high", "low", "close", "volume", "amount"]
-    agg_methods = {
-        "open": "first",
-        "high": max,
-        "low": min,
-        "close": "last",
-        "volume": np.sum,
-        "amount": np.sum,
-    }
-    dropna_cols = ["open", "high", "low", "close"]
 
     # intermediary variables
-    m01["datetime"] = m01["timestamp"].map(dt.datetime.fromtimestamp)
     m01["vwap"] = (m01["amount"] / m01["volume"] / contract_multiplier * amount_scale).fillna(method="ffill")
     m01["vwap_cum"] = (m01["amount"].cumsum() / m01["volume"].cumsum() / contract_multiplier * amount_scale).fillna(method="ffill")
     m01["m01_return"] = (m01["vwap"] / m01["vwap"].shift(1).fillna(pre_settle) - 1) * ret_scale
@@ -36,16 +106,8 @@ def cal_features_and_return_one_day(m01: pd.DataFrame,
     m01["amplitude"] = (m01["high"] / m01["low"] - 1) * ret_scale
 
     # agg to 5,10,15 minutes
-    m05 = m01.set_index("datetime")[agg_vars].resample("5T").aggregate(agg_methods).dropna(axis=0, how="all", subset=dropna_cols)
-    m10 = m01.set_index("datetime")[agg_vars].resample("10T").aggregate(agg_methods).dropna(axis=0, how="all", subset=dropna_cols)
-    m15 = m01.set_index("datetime")[agg_vars].resample("15T").aggregate(agg_methods).dropna(axis=0, how="all", subset=dropna_cols)
-    for m_agg, m_agg_width in zip((m05, m10, m15), (5, 10, 15)):
-        if len(m_agg) != tot_bar_num / m_agg_width:
-            print("... data length is wrong! Length of M{:02d} is {} != {}".format(
-                m_agg_width, len(m_agg), tot_bar_num / m_agg_width))
-            print("... contract = {}".format(contract))
-            print("... this program will terminate at once, please check again")
-            sys.exit()
+    m_aggs = aggregate_fixed_grid({k: m01[k].to_numpy(dtype=np.float64) for k in agg_vars}, widths=(5, 10, 15))
+    m05, m10, m15 = m_aggs[5], m_aggs[10], m_aggs[15]
 
     # initial results
     res = {